@@ -0,0 +1,277 @@
+################################################################################
+#
+# Copyright (c) 2011-2012, Daniel Baeumges (dbaeumges@googlemail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+from common import Logger
+
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+
+
+# ================================================================================
+# ADB Client Error
+# ================================================================================
+class AdbClientError(Exception):
+    GENERAL_ERROR = 0
+    CONNECTION_ERROR = 1
+    PROTOCOL_ERROR = 2
+    COMMAND_FAILED = 3
+
+    def __init__(self, theValue, theCode=GENERAL_ERROR):
+        self.value = theValue
+        self.code = theCode
+
+    def __str__(self):
+        return ('%d: ' % self.code) + repr(self.value)
+
+    def getCode(self):
+        return self.code
+
+
+# ================================================================================
+# ADB Client
+# ================================================================================
+class AdbClient:
+    """
+    In-process client for the adb server protocol (host:transport, shell:,
+    sync: push/pull). One instance is bound to one device serial and keeps
+    its sync session open between transfers.
+    """
+    DEFAULT_HOST = 'localhost'
+    DEFAULT_PORT = 5037
+    SYNC_DATA_MAX = 64 * 1024
+
+    def __init__(self, theSerial, theHost=DEFAULT_HOST, thePort=DEFAULT_PORT, theTimeout=None, theLogger=Logger()):
+        self.serial = theSerial
+        self.host = theHost
+        self.port = thePort
+        self.timeout = theTimeout
+        self.log = theLogger
+
+        self.syncSock = None
+        self.syncLock = threading.Lock()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes the sync session.
+        """
+        if not self.syncSock is None:
+            try:
+                self.syncSock.sendall(struct.pack('<4sI', 'QUIT', 0))
+            except socket.error:
+                pass
+            self.syncSock.close()
+            self.syncSock = None
+
+    # ================================================================================
+    # Services
+    # ================================================================================
+    def shell(self, theCmd):
+        """
+        Runs theCmd in a device shell and returns its output.
+        """
+        self.log.debug('Exec adb shell (native): %s' % theCmd)
+        sock = self.__openTransport()
+        try:
+            self.__sendRequest(sock, 'shell:%s' % theCmd)
+            chunkList = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunkList.append(chunk)
+        except socket.error as sockErr:
+            raise AdbClientError('Shell command \'%s\' failed: %s' % (theCmd, sockErr),
+                                 AdbClientError.CONNECTION_ERROR)
+        finally:
+            sock.close()
+        return ''.join(chunkList)
+
+    def waitForDevice(self, theTimeout=None, theInterval=1):
+        """
+        Waits until a transport to the device can be opened.
+        """
+        startTime = time.time()
+        while True:
+            try:
+                self.__openTransport().close()
+                return
+            except AdbClientError as adbErr:
+                if adbErr.getCode() != AdbClientError.COMMAND_FAILED:
+                    raise
+                if not theTimeout is None and time.time() - startTime > theTimeout:
+                    raise
+            time.sleep(theInterval)
+
+    def pull(self, theRemoteFile, theLocalFile):
+        """
+        Copies theRemoteFile from the device to theLocalFile.
+        """
+        self.log.debug('Pull (native): %s -> %s' % (theRemoteFile, theLocalFile))
+        localFile = open(theLocalFile, 'wb')
+        try:
+            self.__runSync(self.__pull, theRemoteFile, localFile)
+        finally:
+            localFile.close()
+
+    def push(self, theLocalFile, theRemoteFile, theMode=0644):
+        """
+        Copies theLocalFile to theRemoteFile on the device.
+        """
+        self.log.debug('Push (native): %s -> %s' % (theLocalFile, theRemoteFile))
+        self.__runSync(self.__push, theLocalFile, theRemoteFile, theMode)
+
+    def install(self, theApk):
+        """
+        Installs theApk like 'adb install' does: push to /data/local/tmp,
+        'pm install' and remove the temporary file. Returns the pm output.
+        """
+        remoteFile = '/data/local/tmp/%s' % os.path.basename(theApk)
+        self.push(theApk, remoteFile)
+        try:
+            return self.shell('pm install %s' % remoteFile)
+        finally:
+            self.shell('rm %s' % remoteFile)
+
+    # ================================================================================
+    # Helpers
+    # ================================================================================
+    def __connect(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error as sockErr:
+            raise AdbClientError('Failed to connect to adb server %s:%d: %s' % (self.host, self.port, sockErr),
+                                 AdbClientError.CONNECTION_ERROR)
+        return sock
+
+    def __openTransport(self):
+        """
+        Returns a new socket switched to the transport of the device.
+        """
+        sock = self.__connect()
+        try:
+            self.__sendRequest(sock, 'host:transport:%s' % self.serial)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def __sendRequest(self, theSock, theRequest):
+        """
+        Sends a host request (hex length prefix) and checks the status.
+        """
+        try:
+            theSock.sendall('%04x%s' % (len(theRequest), theRequest))
+            status = self.__recvExact(theSock, 4)
+            if status == 'OKAY':
+                return
+            if status == 'FAIL':
+                length = int(self.__recvExact(theSock, 4), 16)
+                message = self.__recvExact(theSock, length)
+                raise AdbClientError('Request \'%s\' failed: %s' % (theRequest, message),
+                                     AdbClientError.COMMAND_FAILED)
+        except socket.error as sockErr:
+            raise AdbClientError('Request \'%s\' failed: %s' % (theRequest, sockErr),
+                                 AdbClientError.CONNECTION_ERROR)
+        raise AdbClientError('Invalid status \'%s\' for request \'%s\'' % (status, theRequest),
+                             AdbClientError.PROTOCOL_ERROR)
+
+    def __recvExact(self, theSock, theLength):
+        data = []
+        remaining = theLength
+        while remaining > 0:
+            chunk = theSock.recv(remaining)
+            if not chunk:
+                raise AdbClientError('Connection closed by adb server', AdbClientError.CONNECTION_ERROR)
+            data.append(chunk)
+            remaining -= len(chunk)
+        return ''.join(data)
+
+    def __runSync(self, theFunc, *theArgs):
+        """
+        Runs a transfer on the open sync session. The session is reopened
+        once if the connection dropped.
+        """
+        self.syncLock.acquire()
+        try:
+            for attempt in xrange(2):
+                if self.syncSock is None:
+                    sock = self.__openTransport()
+                    try:
+                        self.__sendRequest(sock, 'sync:')
+                    except:
+                        sock.close()
+                        raise
+                    self.syncSock = sock
+                try:
+                    return theFunc(self.syncSock, *theArgs)
+                except (socket.error, AdbClientError) as err:
+                    self.syncSock.close()
+                    self.syncSock = None
+                    if isinstance(err, AdbClientError) and err.getCode() != AdbClientError.CONNECTION_ERROR:
+                        raise
+                    if attempt == 1:
+                        raise AdbClientError('Sync failed: %s' % str(err), AdbClientError.CONNECTION_ERROR)
+        finally:
+            self.syncLock.release()
+
+    def __pull(self, theSock, theRemoteFile, theLocalFile):
+        theLocalFile.seek(0)
+        theLocalFile.truncate()
+        theSock.sendall(struct.pack('<4sI', 'RECV', len(theRemoteFile)) + theRemoteFile)
+        while True:
+            msgId, length = struct.unpack('<4sI', self.__recvExact(theSock, 8))
+            if msgId == 'DATA':
+                theLocalFile.write(self.__recvExact(theSock, length))
+            elif msgId == 'DONE':
+                return
+            elif msgId == 'FAIL':
+                raise AdbClientError('Failed to pull %s: %s' % (theRemoteFile, self.__recvExact(theSock, length)),
+                                     AdbClientError.COMMAND_FAILED)
+            else:
+                raise AdbClientError('Invalid sync message \'%s\'' % msgId, AdbClientError.PROTOCOL_ERROR)
+
+    def __push(self, theSock, theLocalFile, theRemoteFile, theMode):
+        spec = '%s,%d' % (theRemoteFile, stat.S_IFREG | theMode)
+        theSock.sendall(struct.pack('<4sI', 'SEND', len(spec)) + spec)
+        localFile = open(theLocalFile, 'rb')
+        try:
+            while True:
+                chunk = localFile.read(self.SYNC_DATA_MAX)
+                if not chunk:
+                    break
+                theSock.sendall(struct.pack('<4sI', 'DATA', len(chunk)) + chunk)
+        finally:
+            localFile.close()
+        theSock.sendall(struct.pack('<4sI', 'DONE', int(time.time())))
+        msgId, length = struct.unpack('<4sI', self.__recvExact(theSock, 8))
+        if msgId == 'OKAY':
+            return
+        if msgId == 'FAIL':
+            raise AdbClientError('Failed to push %s: %s' % (theLocalFile, self.__recvExact(theSock, length)),
+                                 AdbClientError.COMMAND_FAILED)
+        raise AdbClientError('Invalid sync message \'%s\'' % msgId, AdbClientError.PROTOCOL_ERROR)
@@ -193,22 +193,35 @@ class TaintTagEnum:
     TAINT_USER_INPUT    = 0x20000
     TAINT_MEDIA         = 0x40000
 
+    # Memoized getTaintString results (tag int -> string)
+    TAINT_STRING_DICT = {}
+
+    @staticmethod
+    def parseTaintTag(theTag):
+        """
+        Returns the tag as int, hex strings (e.g. '0x402') are converted.
+        """
+        if isinstance(theTag, basestring):
+            return int(theTag, 16)
+        return theTag
+
     @staticmethod
     def appendTaintTags(theTag1, theTag2):
-        tagInt1 = int(theTag1, 16)
-        tagInt2 = int(theTag2, 16)
-        tagInt = tagInt1 | tagInt2
-        tag = "0x%X" % tagInt
-        return tag
+        return TaintTagEnum.parseTaintTag(theTag1) | TaintTagEnum.parseTaintTag(theTag2)
 
     @staticmethod
     def getTaintString(theTag):
-        try:
-            tagInt = int(theTag, 16)
-        except TypeError, typeErr:
-            if theTag == 0:
-                tagInt = theTag
-        tagString = str(theTag) + ' ('
+        tagInt = TaintTagEnum.parseTaintTag(theTag)
+        tagString = TaintTagEnum.TAINT_STRING_DICT.get(tagInt)
+        if tagString is None:
+            tagString = TaintTagEnum.__buildTaintString(tagInt)
+            TaintTagEnum.TAINT_STRING_DICT[tagInt] = tagString
+        return tagString
+
+    @staticmethod
+    def __buildTaintString(theTag):
+        tagInt = theTag
+        tagString = '0x%X (' % tagInt
         if tagInt == TaintTagEnum.TAINT_CLEAR:
             tagString += 'No Tag)'
         else:
@@ -16,9 +16,12 @@
 #
 ################################################################################
 
+from adb_client import AdbClient, AdbClientError
 from emulator_telnet_client import EmulatorTelnetClient
 from common import Logger, TaintLogKeyEnum, Utils
 
+from threading import Thread
+
 import os
 import signal
 import subprocess
@@ -38,6 +41,7 @@ class EmulatorClientError(Exception):
     MONKEY_ERROR = 6
     INSTALLATION_ERROR_SYSTEM_NOT_RUNNING = 7
     LOGCAT_REDIRECT_RUNNING = 8
+    BOOT_TIMEOUT_ERROR = 9
     
     def __init__(self, theValue, theCode=GENERAL_ERROR, theBaseError=None):        
         self.value = theValue
@@ -66,11 +70,18 @@ def _overwriteSignalsForProcess():
 # Emulator Client
 # ================================================================================
 class EmulatorClient:
+    # Number of rotated files kept by the host-side logcat stream
+    LOGCAT_STREAM_NUM_ROTATIONS = 4
+
     def __init__(self, theSdkPath='',
                        thePort=5554,
                        theImageDirPath='',
                        theRunHeadlessFlag=False,
                        theAvdName=None,
+                       theBootTimeout=300,
+                       theNativeAdbFlag=False,
+                       theAdbServerHost=AdbClient.DEFAULT_HOST,
+                       theAdbServerPort=AdbClient.DEFAULT_PORT,
                        theLogger=Logger()):
         self.sdkPath = Utils.addSlashToPath(theSdkPath)
         self.port = thePort
@@ -79,20 +90,37 @@ class EmulatorClient:
         self.log = theLogger
         
         self.avdName = theAvdName
+        self.bootTimeout = theBootTimeout
+        self.bootTime = None # seconds until the device was usable
 
         self.emulator = None
 
         self.logcatRedirectFile = ''
         self.logcatRedirectProcess = None
 
+        self.logcatStreamProcess = None
+        self.logcatStreamThread = None
+
         self.adbProcess = None
 
+        # In-process adb client, subprocess adb is used if not set
+        self.adbServerHost = theAdbServerHost
+        self.adbServerPort = theAdbServerPort
+        self.adbClient = None
+        if theNativeAdbFlag:
+            self.adbClient = AdbClient('emulator-%s' % str(self.port),
+                                       theHost=self.adbServerHost, thePort=self.adbServerPort, theLogger=self.log)
+
+        self.telnetClient = None
+
     def isEmulatorRunning(self):
         return self.emulator is not None
     
     def __del__(self):
         if not self.logcatRedirectProcess is None:
             self.logcatRedirectProcess.kill()
+        if not self.logcatStreamProcess is None:
+            self.logcatStreamProcess.kill()
         if not self.adbProcess is None:
             self.adbProcess.kill()
         if not self.emulator is None:
@@ -103,6 +131,7 @@ class EmulatorClient:
         Starts the emulator with TaintDroid images
         """
         self.log.info('Start emulator')
+        startTime = time.time()
         try:
             args = ['%semulator' % Utils.getEmulatorPath(self.sdkPath)]
             if self.avdName is not None:
@@ -141,8 +170,31 @@ class EmulatorClient:
         #sync with host time
         hosttime = time.strftime("%Y%m%d.%H%M%S")
         self.runAdbCommand(['shell', 'date', '-s',hosttime])
-        # Wait
-        time.sleep(60)
+
+        # Wait until system is usable
+        self.waitForBoot(startTime + self.bootTimeout)
+        self.bootTime = time.time() - startTime
+        self.log.info('Emulator booted in %.1fsec' % self.bootTime)
+
+    def waitForBoot(self, theDeadline, theInterval=2):
+        """
+        Polls sys.boot_completed and the package manager service until both
+        are available. Raises an error if the deadline (time.time() value) is
+        reached before.
+        """
+        bootCompletedFlag = False
+        while True:
+            if not bootCompletedFlag:
+                retval = self.runAdbCommand(['shell', 'getprop', 'sys.boot_completed'])
+                bootCompletedFlag = retval[0].strip() == '1'
+            if bootCompletedFlag:
+                retval = self.runAdbCommand(['shell', 'pm', 'path', 'android'])
+                if retval[0].find('package:') != -1:
+                    return
+            if time.time() + theInterval > theDeadline:
+                raise EmulatorClientError('Emulator not ready after %dsec' % self.bootTimeout,
+                                          theCode=EmulatorClientError.BOOT_TIMEOUT_ERROR)
+            time.sleep(theInterval)
 
     def stop(self):
         """
@@ -150,6 +202,7 @@ class EmulatorClient:
         """
         if self.emulator is None:
             raise EmulatorClientError('Emulator not started')
+        self.__closeClients()
         self.emulator.terminate()
         self.emulator = None
 
@@ -164,18 +217,37 @@ class EmulatorClient:
             self.logcatRedirectProcess.kill()
             self.logcatRedirectProcess = None
 
+        if not self.logcatStreamProcess is None:
+            self.logcatStreamProcess.kill()
+            self.logcatStreamProcess = None
+
         if not self.adbProcess is None:
             self.adbProcess.kill()
             self.adbProcess = None
 
+        self.__closeClients()
         self.emulator.kill()
         self.emulator = None
 
     def getTelnetClient(self):
         """
-        Returns an instance of the EmulatorTelnetClient for the started emulator
+        Returns the EmulatorTelnetClient of the started emulator.
+        The console session is kept open until the emulator is stopped.
+        """
+        if self.telnetClient is None:
+            self.telnetClient = EmulatorTelnetClient(thePort=self.port, theLogger=self.log)
+        self.telnetClient.log = self.log
+        return self.telnetClient
+
+    def __closeClients(self):
+        """
+        Closes the console session and the sync session of the adb client.
         """
-        return EmulatorTelnetClient(thePort=self.port, theLogger=self.log)
+        if not self.telnetClient is None:
+            self.telnetClient.close()
+            self.telnetClient = None
+        if not self.adbClient is None:
+            self.adbClient.close()
 
     def setProperty(self, theKey, theValue):
         """
@@ -252,7 +324,37 @@ class EmulatorClient:
         """
         retval = self.runAdbCommand(['uninstall', thePackage])
         if retval[0].find('Success') == -1:
-            raise EmulatorClientError('Failed to uninstall %s: %s' % (thePackage, retval[0]), EmulatorClientError.UNINSTALLATION_ERROR)
+            raise EmulatorClientError('Failed to uninstall %s: %s' % (thePackage, retval[0]), EmulatorClientError.GENERAL_UNINSTALLATION_ERROR)
+
+    def resetState(self, thePackage=None, theLogcatRedirectFile=None):
+        """
+        Resets the running emulator to a clean state so that it can be
+        reused for the next app: uninstalls the package, wipes its data
+        directory, removes the logcat redirect file, clears logcat and
+        restores the taint properties.
+        """
+        if self.emulator is None:
+            raise EmulatorClientError('Emulator not started')
+        self.log.info('Reset emulator state')
+
+        self.stopLogcatRedirect()
+        if not thePackage is None and thePackage != '':
+            try:
+                self.uninstallPackage(thePackage)
+            except EmulatorClientError as ecErr:
+                self.log.debug('Uninstall during reset failed: %s' % str(ecErr))
+            self.runAdbCommand(['shell', 'rm', '-r', '/data/data/%s' % thePackage])
+
+        logcatRedirectFile = theLogcatRedirectFile
+        if logcatRedirectFile is None:
+            logcatRedirectFile = self.logcatRedirectFile
+        if not logcatRedirectFile is None and logcatRedirectFile != '':
+            self.runAdbCommand(['shell', 'rm', logcatRedirectFile])
+        self.clearLog()
+
+        self.changeGlobalTaintLogState('0')
+        self.setProperty(TaintLogKeyEnum.GLOBAL_SKIP_LOOKUP_KEY, '0')
+        self.changeGlobalTaintLogFileSystemTaintMask('0')
 
     def useMonkey(self, thePackage=None, theEventCount=10000):
         """
@@ -333,6 +435,84 @@ class EmulatorClient:
                 pass
         self.logcatRedirectProcess = None
 
+    def startLogcatStream(self, theFile, theMaxSize=4096):
+        """
+        Start streaming logcat to theFile on the host (read it with
+        TaintLogAnalyzer.tailLogEntries while it grows). theFile is rotated
+        after theMaxSize kBytes like 'logcat -r' does (theFile.1, theFile.2, ...).
+        """
+        self.log.debug('Start logcat stream, file: %s, size: %dkBytes' % (theFile, theMaxSize))
+        if not self.logcatStreamProcess is None:
+            raise EmulatorClientError('Logcat stream is already running', EmulatorClientError.LOGCAT_REDIRECT_RUNNING)
+
+        args = ['%sadb' % Utils.getAdbPath(self.sdkPath), '-s', 'emulator-%s' % str(self.port),
+                'logcat', '-v', 'thread']
+        try:
+            devNull = open(os.devnull, 'w')
+            try:
+                self.logcatStreamProcess = subprocess.Popen(args,
+                                                            stdout=subprocess.PIPE,
+                                                            stdin=subprocess.PIPE,
+                                                            stderr=devNull)
+            finally:
+                devNull.close()
+        except OSError, osErr:
+            raise EmulatorClientError('Failed to run adb command \'%s\': %s' % (args, osErr.strerror),
+                                      theCode=EmulatorClientError.ADB_RUN_ERROR,
+                                      theBaseError=osErr)
+
+        self.logcatStreamThread = Thread(target=self.__readLogcatStream,
+                                         args=(self.logcatStreamProcess.stdout, theFile, theMaxSize))
+        self.logcatStreamThread.daemon = True
+        self.logcatStreamThread.start()
+
+    def stopLogcatStream(self, theTimeout=60):
+        """
+        Stop logcat streaming. Returns after the remaining lines were
+        written.
+        """
+        self.log.debug('End logcat stream')
+        if not self.logcatStreamProcess is None:
+            try:
+                self.logcatStreamProcess.terminate()
+            except OSError, osErr:
+                self.log.error('Failed to terminate logcat stream: %s' % str(osErr))
+            self.logcatStreamProcess.wait()
+        if not self.logcatStreamThread is None:
+            self.logcatStreamThread.join(theTimeout)
+            if self.logcatStreamThread.isAlive():
+                self.log.error('Logcat stream reader did not finish within %dsec' % theTimeout)
+        self.logcatStreamProcess = None
+        self.logcatStreamThread = None
+
+    def __readLogcatStream(self, theStream, theFile, theMaxSize):
+        """
+        Reader of the logcat stream, runs until adb closes the pipe.
+        Line endings are normalized to '\\n' as in a pulled logcat file.
+        """
+        maxBytes = theMaxSize * 1024
+        logFile = open(theFile, 'w')
+        size = 0
+        try:
+            for line in iter(theStream.readline, ''):
+                line = line.rstrip('\r\n') + '\n'
+                if size > 0 and size + len(line) > maxBytes:
+                    logFile.close()
+                    self.__rotateLogcatFile(theFile)
+                    logFile = open(theFile, 'w')
+                    size = 0
+                logFile.write(line)
+                size += len(line)
+        finally:
+            logFile.close()
+            theStream.close()
+
+    def __rotateLogcatFile(self, theFile):
+        for i in xrange(self.LOGCAT_STREAM_NUM_ROTATIONS - 1, 0, -1):
+            if os.path.exists('%s.%d' % (theFile, i)):
+                os.rename('%s.%d' % (theFile, i), '%s.%d' % (theFile, i + 1))
+        os.rename(theFile, '%s.1' % theFile)
+
     def getLogcatRedirectFile(self, theLogFile=None):
         """
         Return the redirect logcat file.
@@ -358,7 +538,22 @@ class EmulatorClient:
         """
         Runs a simple adb command
         """
-        args = ['%sadb' % Utils.getAdbPath(self.sdkPath), '-s', 'emulator-%s' % str(self.port)]
+        if not self.adbClient is None:
+            self.adbClient.log = self.log
+            try:
+                retval = self.__runNativeAdbCommand(theArgs)
+                if not retval is None:
+                    self.log.debug('Result: %s' % str(retval))
+                    return retval
+            except AdbClientError as adbErr:
+                if adbErr.getCode() != AdbClientError.CONNECTION_ERROR:
+                    return ('', str(adbErr))
+                self.log.debug('Native adb failed, use adb binary: %s' % str(adbErr))
+
+        args = ['%sadb' % Utils.getAdbPath(self.sdkPath)]
+        if self.adbServerHost != AdbClient.DEFAULT_HOST or self.adbServerPort != AdbClient.DEFAULT_PORT:
+            args.extend(['-H', self.adbServerHost, '-P', str(self.adbServerPort)])
+        args.extend(['-s', 'emulator-%s' % str(self.port)])
         args.extend(theArgs)
         self.log.debug('Exec adb command: %s' % args)
         try:
@@ -375,3 +570,29 @@ class EmulatorClient:
         #adb.wait()        
         self.log.debug('Result: %s' % str(retval))
         return retval
+
+    def __runNativeAdbCommand(self, theArgs):
+        """
+        Runs the adb command with the in-process adb client.
+        Returns (stdout, stderr) like runAdbCommand or None if the command
+        is not supported natively.
+        """
+        cmd = theArgs[0]
+        if cmd == 'shell':
+            return (self.adbClient.shell(' '.join(theArgs[1:])), '')
+        elif cmd == 'logcat':
+            return (self.adbClient.shell(' '.join(theArgs)), '')
+        elif cmd == 'wait-for-device':
+            self.adbClient.waitForDevice()
+            return ('', '')
+        elif cmd == 'install' and len(theArgs) == 2:
+            return (self.adbClient.install(theArgs[1]), '')
+        elif cmd == 'uninstall' and len(theArgs) == 2:
+            return (self.adbClient.shell('pm uninstall %s' % theArgs[1]), '')
+        elif cmd == 'pull' and len(theArgs) == 3:
+            self.adbClient.pull(theArgs[1], theArgs[2])
+            return ('', '')
+        elif cmd == 'push' and len(theArgs) == 3:
+            self.adbClient.push(theArgs[1], theArgs[2])
+            return ('', '')
+        return None
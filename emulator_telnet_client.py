@@ -18,6 +18,8 @@
 
 from common import Logger
 
+import re
+import socket
 import telnetlib
 
 
@@ -96,11 +98,34 @@ class BatteryHealthState:
 # Emulator Telnet Client
 # ================================================================================ 
 class EmulatorTelnetClient:
-    def __init__(self, theHost='localhost', thePort=5554, theLogger=Logger()):        
+    # Reply terminator of the emulator console (first OK or KO line)
+    REPLY_PATTERN = re.compile(r'(?:^|\n)(OK|KO(?::[^\n]*)?)\r?\n')
+
+    def __init__(self, theHost='localhost', thePort=5554, theTimeout=10, theLogger=Logger()):        
         self.host = theHost
         self.port = thePort
+        self.timeout = theTimeout
         self.log = theLogger
         self.tn = telnetlib.Telnet()
+        self.connectedFlag = False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes the console session.
+        """
+        if self.connectedFlag:
+            try:
+                self.tn.write('exit\n')
+            except (EOFError, socket.error):
+                pass
+        self.tn.close()
+        self.connectedFlag = False
 
 
     # ================================================================================
@@ -240,20 +265,59 @@ class EmulatorTelnetClient:
     # Helpers
     # ================================================================================
     def __runCommand(self, theCmd):
-        self.tn.open(self.host, self.port)
-        self.log.debug('Command to sent: %s\n' % theCmd)
-        self.tn.write('%s\n' % theCmd)
-        self.tn.write('exit\n')
-        aTnOutStr = self.tn.read_all()
-        self.tn.close()
-        self.log.debug('Command out:\n%s' % aTnOutStr)
-        aTnOutLineVec = aTnOutStr.rsplit('\n', 2)
-        if aTnOutLineVec[2] == '':
-            if aTnOutLineVec[1].startswith('OK'):
-                pass
-            else:
-                raise EmulatorTelnetClientError('Failed to run command %s' % theCmd)
-        elif aTnOutLineVec[2].startswith('OK'):
-            pass
-        else:
-            raise EmulatorTelnetClientError('Failed to run command %s' % theCmd)        
+        """
+        Runs theCmd on the persistent console session. If the console
+        dropped before the command was written, it is reconnected once. A
+        written command is never sent again as the emulator might have run
+        it already (e.g. a slow 'sms send').
+        """
+        retryFlag = True
+        while True:
+            writtenFlag = False
+            try:
+                if not self.connectedFlag:
+                    self.__connect()
+                else:
+                    # Raises EOFError if the console was closed meanwhile
+                    self.tn.read_very_eager()
+                self.log.debug('Command to sent: %s\n' % theCmd)
+                writtenFlag = True
+                self.tn.write('%s\n' % theCmd)
+                okFlag = self.__readReply(theCmd)
+                break
+            except (EOFError, socket.error) as err:
+                self.tn.close()
+                self.connectedFlag = False
+                if writtenFlag or not retryFlag:
+                    raise EmulatorTelnetClientError('Failed to run command %s: %s' % (theCmd, str(err)))
+                self.log.debug('Console connection lost (%s), reconnect' % str(err))
+                retryFlag = False
+        if not okFlag:
+            raise EmulatorTelnetClientError('Failed to run command %s' % theCmd)
+
+    def __connect(self):
+        """
+        Opens the console session and consumes the greeting.
+        """
+        self.tn = telnetlib.Telnet()
+        self.tn.open(self.host, self.port, self.timeout)
+        index, match, text = self.tn.expect([self.REPLY_PATTERN], self.timeout)
+        if index == -1 or match.group(1) != 'OK':
+            self.tn.close()
+            raise EmulatorTelnetClientError('Failed to connect to console on port %d' % self.port)
+        self.connectedFlag = True
+
+    def __readReply(self, theCmd):
+        """
+        Reads the reply of one command up to its OK/KO line.
+        Returns False if the console answered with KO.
+        """
+        index, match, text = self.tn.expect([self.REPLY_PATTERN], self.timeout)
+        self.log.debug('Command out:\n%s' % text)
+        if index == -1:
+            # Console closed or hung up without reply
+            raise EOFError('no reply within %dsec' % self.timeout)
+        elif match.group(1) != 'OK':
+            self.log.error('Command %s failed: %s' % (theCmd, match.group(1)))
+            return False
+        return True
@@ -1,6 +1,8 @@
 from apk_wrapper import APKWrapper, APKWrapperError
 from common import Logger, LogLevel, TaintLogActionEnum, TaintTagEnum, Utils
-from taintlog_analyzer import TaintLogAnalyzer, TaintLogAnalyzerError
+from logcat_compression import stripCompressionSuffix
+from taintlog_analyzer import LogEntryMatcher, TaintLogAnalyzer, TaintLogAnalyzerError
+from taintlog_columns import LogEntryColumns
 from taintlog_json import *
 
 from optparse import OptionParser
@@ -16,6 +18,10 @@ import shutil
 # ================================================================================
 
 class Analyzer:
+    # Fields of the app reports needed by the analysis modes, the action
+    # lists are read from the logcat files instead
+    APP_REPORT_FIELD_LIST = ['id', 'appPackage', 'appPath', 'appName', 'logcatFile', 'md5Hash', 'startTime', 'endTime']
+
     def __init__(self, theDirs, theMode=0, theSdkPath=None):
         self.dirs = theDirs
         self.mode = theMode
@@ -25,6 +31,8 @@ class Analyzer:
         self.printDictFile = None
         self.htmlOutputDir = None
         self.reportAppDir = None
+        self.logCacheFlag = True # use and write the cache files of the logcat files
+        self.numParseProcesses = 1 # processes parsing a large logcat file
         
     def getRuntime(self, theObj):
         startTime = datetime.datetime(int(theObj.startTime[0:4]),
@@ -42,13 +50,14 @@ class Analyzer:
         timeDiff = endTime - startTime
         return timeDiff
 
-    def getMainReport(self, theDir, theFactory):
+    def getMainReport(self, theDir, theFactory, theFieldList=None):
+        """
+        Returns the main report of theDir. If theFieldList is given, only
+        these fields of the app reports are read from report.json.
+        """
         reportFileName = os.path.join(theDir, 'report.json')
         if os.path.exists(reportFileName):
-            reportFile = open(reportFileName, 'r')
-            reportJson = reportFile.read()
-            report = theFactory.json2Py(reportJson)
-            return report
+            return JsonReportReader(reportFileName, theFieldList).getMainReport()
         else:
             report = MainReportEntry()
             timeNow = datetime.datetime.now()
@@ -56,7 +65,7 @@ class Analyzer:
             report.endTime = '%s %s' % (Utils.getDateAsString(timeNow), Utils.getTimeAsString(timeNow))
             fileNameList = os.listdir(theDir)
             for logcatFile in fileNameList:
-                if logcatFile.endswith('_logcat.log'):
+                if stripCompressionSuffix(logcatFile).endswith('_logcat.log'):
                     logcatFileNameParts = logcatFile.split('_')
                     apkName = ''
                     for i in xrange(len(logcatFileNameParts) - 2):
@@ -75,6 +84,19 @@ class Analyzer:
                     appReportEntry.endTime = '%s %s' % (Utils.getDateAsString(timeNow), Utils.getTimeAsString(timeNow))
                     report.appList.append(appReportEntry)
             return report
+
+    def iterAppReports(self, theDir, theFactory, theFieldList=None):
+        """
+        Generator yielding the app reports of theDir one at a time (see
+        getMainReport for theFieldList).
+        """
+        reportFileName = os.path.join(theDir, 'report.json')
+        if os.path.exists(reportFileName):
+            for appReport in JsonReportReader(reportFileName, theFieldList).iterAppReports():
+                yield appReport
+        else:
+            for appReport in self.getMainReport(theDir, theFactory).appList:
+                yield appReport
                     
 
     def getAppTaintLog(self, theDir, theLogcatFile):
@@ -83,38 +105,20 @@ class Analyzer:
             logcatFile = os.path.join(theDir, theLogcatFile)
         else:
             logcatFile = os.path.join(theDir, logcatFileParts[1])
-        logAnalyzer1 = TaintLogAnalyzer(theLogger=Logger(theLevel=LogLevel.ERROR))
+        # Line ends (numControlChars) are detected while parsing
+        logAnalyzer = TaintLogAnalyzer(theLogger=Logger(theLevel=LogLevel.ERROR))
+        logAnalyzer.setLogFile(logcatFile)
+        if self.logCacheFlag and logAnalyzer.loadLogCache():
+            return logAnalyzer
         try:
-            logAnalyzer1.setLogFile(logcatFile)
+            logAnalyzer.extractLogEntries(self.numParseProcesses)
         except IOError, ioErr:
             #raw_input('getAppTaintLog::IOError')
             return None
-        logAnalyzer1.extractLogEntries()
-
-        logAnalyzer2 = TaintLogAnalyzer(theLogger=Logger(theLevel=LogLevel.ERROR))
-        logAnalyzer2.setLogFile(logcatFile)
-        logAnalyzer2.numControlChars = 2
-        logAnalyzer2.extractLogEntries()
-
-        #print len(logAnalyzer1.getLogEntryList())
-        #print len(logAnalyzer1.getJson2PyFailedList())
-        #print '2: ', len(logAnalyzer2.getLogEntryList())
-        #print len(logAnalyzer2.getJson2PyFailedList())
-        #raw_input('xx')
-
-        if len(logAnalyzer1.getLogEntryList()) > len(logAnalyzer2.getLogEntryList()) and \
-           len(logAnalyzer1.getJson2PyFailedList()) < len(logAnalyzer2.getJson2PyFailedList()):
-            logAnalyzer = logAnalyzer1
-        else:
-            logAnalyzer = logAnalyzer2
-        
-        #if len(logAnalyzer.getLogEntryList()) == 0:
-        #    logAnalyzer.numControlChars = 2
-        #    logAnalyzer.extractLogEntries()
-        #if len(logAnalyzer.getLogEntryList()) == 0:
-            #raw_input('XX')
-        #    pass
+
         logAnalyzer.postProcessLogObjects()
+        if self.logCacheFlag:
+            logAnalyzer.storeLogCache()
         return logAnalyzer
 
     def getAppApk(self, theAppPath):
@@ -140,192 +144,78 @@ class Analyzer:
                             'location':[0,[]],
                             'other':[0,[]],
                             'nothing':[0,[]]}
-    def evalTagNumbers(self, theTaintLog, theApk, theBaseObj, theNumbers, theReportMode=False):
-        oneMatch = False
-        
-        noTag = copy.deepcopy(theBaseObj)
-        noTag.tag = -1
-        if theTaintLog.doesMatch([noTag]):
-            if theReportMode:
-                theNumbers['noTag'][0] += len(theTaintLog.getMatchingLogEntries([noTag]))
-            else:
-                theNumbers['noTag'][0] += 1
-                theNumbers['noTag'][1].append(theApk)
-            oneMatch = True
-
-        if isinstance(theBaseObj, CallActionLogEntry) and oneMatch:
-            for key, value in self.INITIAL_NUMBERS_DICT.iteritems():
-                if key != 'noTag' and key != 'nothing':
-                    theNumbers[key][0] -= 1
-            
-        contact = copy.deepcopy(theBaseObj)
-        contact.tagList.append(TaintTagEnum.TAINT_CONTACTS)
-        if theTaintLog.doesMatch([contact]):
-            if theReportMode:
-                theNumbers['contact'][0] += len(theTaintLog.getMatchingLogEntries([contact]))
-            else:
-                theNumbers['contact'][0] += 1
-                theNumbers['contact'][1].append(theApk)
-            oneMatch = True
-            
-        deviceInfos = copy.deepcopy(theBaseObj)
-        deviceInfos.tagList.append(TaintTagEnum.TAINT_PHONE_NUMBER)
-        deviceInfos.tagList.append(TaintTagEnum.TAINT_IMEI)
-        deviceInfos.tagList.append(TaintTagEnum.TAINT_IMSI)
-        deviceInfos.tagList.append(TaintTagEnum.TAINT_ICCID)
-        deviceInfos.tagList.append(TaintTagEnum.TAINT_DEVICE_SN)
-        if theTaintLog.doesMatch([deviceInfos]):
-            if theReportMode:
-                theNumbers['deviceInfos'][0] += len(theTaintLog.getMatchingLogEntries([deviceInfos]))
-            else:
-                theNumbers['deviceInfos'][0] += 1
-                theNumbers['deviceInfos'][1].append(theApk)
-            oneMatch = True
-            
-        userInput = copy.deepcopy(theBaseObj)
-        userInput.tagList.append(TaintTagEnum.TAINT_USER_INPUT)
-        if theTaintLog.doesMatch([userInput]):
-            if theReportMode:
-                theNumbers['userInput'][0] += len(theTaintLog.getMatchingLogEntries([userInput]))
-            else:
-                theNumbers['userInput'][0] += 1
-                theNumbers['userInput'][1].append(theApk)
-            oneMatch = True
-            
-        incomingData = copy.deepcopy(theBaseObj)
-        incomingData.tagList.append(TaintTagEnum.TAINT_INCOMING_DATA)
-        if theTaintLog.doesMatch([incomingData]):
-            if theReportMode:
-                theNumbers['incomingData'][0] += len(theTaintLog.getMatchingLogEntries([incomingData]))
-            else:
-                theNumbers['incomingData'][0] += 1
-                theNumbers['incomingData'][1].append(theApk)
-            oneMatch = True
-            
-        location = copy.deepcopy(theBaseObj)
-        location.tagList.append(TaintTagEnum.TAINT_LOCATION)
-        location.tagList.append(TaintTagEnum.TAINT_LOCATION_GPS)
-        location.tagList.append(TaintTagEnum.TAINT_LOCATION_NET)
-        location.tagList.append(TaintTagEnum.TAINT_LOCATION_LAST)
-        if theTaintLog.doesMatch([location]):
-            if theReportMode:
-                theNumbers['location'][0] += len(theTaintLog.getMatchingLogEntries([location]))
-            else:
-                theNumbers['location'][0] += 1
-                theNumbers['location'][1].append(theApk)
-            oneMatch = True
-            
-        other = copy.deepcopy(theBaseObj)
-        other.tagList.append(TaintTagEnum.TAINT_MIC)
-        other.tagList.append(TaintTagEnum.TAINT_CAMERA)
-        other.tagList.append(TaintTagEnum.TAINT_ACCELEROMETER)
-        other.tagList.append(TaintTagEnum.TAINT_HISTORY)
-        other.tagList.append(TaintTagEnum.TAINT_MEDIA)
-        other.tagList.append(TaintTagEnum.TAINT_SMS)
-        if theTaintLog.doesMatch([other]):
-            if theReportMode:
-                theNumbers['other'][0] += len(theTaintLog.getMatchingLogEntries([other]))
-            else:
-                theNumbers['other'][0] += 1
-                theNumbers['other'][1].append(theApk)
-            oneMatch = True
-
-        if not oneMatch:
-            theNumbers['nothing'][0] += 1
-            if theReportMode: theNumbers['nothing'][1].append(theApk)
-
-        return oneMatch
-
-    def evalSmsDestTagNumbers(self, theTaintLog, theApk, theBaseObj, theNumbers, theReportMode=False):
-        oneMatch = False
-        
-        noTag = copy.deepcopy(theBaseObj)
-        noTag.destinationTag = -1
-        if theTaintLog.doesMatch([noTag]):
-            if theReportMode:
-                theNumbers['noTag'][0] += len(theTaintLog.getMatchingLogEntries([noTag]))
-            else:
-                theNumbers['noTag'][0] += 1
-                theNumbers['noTag'][1].append(theApk)
-            oneMatch = True
-            
-        contact = copy.deepcopy(theBaseObj)
-        contact.destinationTagList.append(TaintTagEnum.TAINT_CONTACTS)
-        if theTaintLog.doesMatch([contact]):
-            if theReportMode:
-                theNumbers['contact'][0] += len(theTaintLog.getMatchingLogEntries([contact]))
-            else:
-                theNumbers['contact'][0] += 1
-                theNumbers['contact'][1].append(theApk)
-            oneMatch = True
-            
-        deviceInfos = copy.deepcopy(theBaseObj)
-        deviceInfos.destinationTagList.append(TaintTagEnum.TAINT_PHONE_NUMBER)
-        deviceInfos.destinationTagList.append(TaintTagEnum.TAINT_IMEI)
-        deviceInfos.destinationTagList.append(TaintTagEnum.TAINT_IMSI)
-        deviceInfos.destinationTagList.append(TaintTagEnum.TAINT_ICCID)
-        deviceInfos.destinationTagList.append(TaintTagEnum.TAINT_DEVICE_SN)
-        if theTaintLog.doesMatch([deviceInfos]):
-            if theReportMode:
-                theNumbers['deviceInfos'][0] += len(theTaintLog.getMatchingLogEntries([deviceInfos]))
-            else:
-                theNumbers['deviceInfos'][0] += 1
-                theNumbers['deviceInfos'][1].append(theApk)
-            oneMatch = True
-            
-        userInput = copy.deepcopy(theBaseObj)
-        userInput.destinationTagList.append(TaintTagEnum.TAINT_USER_INPUT)
-        if theTaintLog.doesMatch([userInput]):
-            if theReportMode:
-                theNumbers['userInput'][0] += len(theTaintLog.getMatchingLogEntries([userInput]))
-            else:
-                theNumbers['userInput'][0] += 1
-                theNumbers['userInput'][1].append(theApk)
-            oneMatch = True
-            
-        incomingData = copy.deepcopy(theBaseObj)
-        incomingData.destinationTagList.append(TaintTagEnum.TAINT_INCOMING_DATA)
-        if theTaintLog.doesMatch([incomingData]):
-            if theReportMode:
-                theNumbers['incomingData'][0] += len(theTaintLog.getMatchingLogEntries([incomingData]))
-            else:
-                theNumbers['incomingData'][0] += 1
-                theNumbers['incomingData'][1].append(theApk)
-            oneMatch = True
-            
-        location = copy.deepcopy(theBaseObj)
-        location.destinationTagList.append(TaintTagEnum.TAINT_LOCATION)
-        location.destinationTagList.append(TaintTagEnum.TAINT_LOCATION_GPS)
-        location.destinationTagList.append(TaintTagEnum.TAINT_LOCATION_NET)
-        location.destinationTagList.append(TaintTagEnum.TAINT_LOCATION_LAST)
-        if theTaintLog.doesMatch([location]):
-            if theReportMode:
-                theNumbers['location'][0] += len(theTaintLog.getMatchingLogEntries([location]))
-            else:
-                theNumbers['location'][0] += 1
-                theNumbers['location'][1].append(theApk)
-            oneMatch = True
-            
-        other = copy.deepcopy(theBaseObj)
-        other.destinationTagList.append(TaintTagEnum.TAINT_MIC)
-        other.destinationTagList.append(TaintTagEnum.TAINT_CAMERA)
-        other.destinationTagList.append(TaintTagEnum.TAINT_ACCELEROMETER)
-        other.destinationTagList.append(TaintTagEnum.TAINT_HISTORY)
-        other.destinationTagList.append(TaintTagEnum.TAINT_MEDIA)
-        other.destinationTagList.append(TaintTagEnum.TAINT_SMS)
-        if theTaintLog.doesMatch([other]):
-            if theReportMode:
-                theNumbers['other'][0] += len(theTaintLog.getMatchingLogEntries([other]))
-            else:
-                theNumbers['other'][0] += 1
-                theNumbers['other'][1].append(theApk)
-            oneMatch = True
-
-        if not oneMatch:
-            theNumbers['nothing'][0] += 1
-            if theReportMode: theNumbers['nothing'][1].append(theApk)
+    # Number key -> entry class, action list (all if None), tag column
+    NUMBERS_CATEGORY_LIST = [('call', CallActionLogEntry, None, 'tag'),
+                             ('cipher', CipherUsageLogEntry, None, 'tag'),
+                             ('fsRead', FileSystemLogEntry, [TaintLogActionEnum.FS_READ_ACTION,
+                                                             TaintLogActionEnum.FS_READ_DIRECT_ACTION,
+                                                             TaintLogActionEnum.FS_READV_ACTION], 'tag'),
+                             ('fsWrite', FileSystemLogEntry, [TaintLogActionEnum.FS_WRITE_ACTION,
+                                                              TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
+                                                              TaintLogActionEnum.FS_WRITEV_ACTION], 'tag'),
+                             ('netRead', NetworkSendLogEntry, [TaintLogActionEnum.NET_READ_ACTION,
+                                                               TaintLogActionEnum.NET_READ_DIRECT_ACTION,
+                                                               TaintLogActionEnum.NET_RECV_ACTION,
+                                                               TaintLogActionEnum.NET_RECV_DIRECT_ACTION], 'tag'),
+                             ('netWrite', NetworkSendLogEntry, [TaintLogActionEnum.NET_SEND_ACTION,
+                                                                TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
+                                                                TaintLogActionEnum.NET_SEND_URGENT_ACTION,
+                                                                TaintLogActionEnum.NET_WRITE_ACTION,
+                                                                TaintLogActionEnum.NET_WRITE_DIRECT_ACTION], 'tag'),
+                             ('ssl', SSLLogEntry, None, 'tag'),
+                             ('sms', SendSmsLogEntry, None, 'tag'),
+                             ('smsDest', SendSmsLogEntry, None, 'destinationTag')]
+    # Number key -> tags of the group (an entry needs one of them)
+    NUMBERS_TAG_LIST = [('contact', TaintTagEnum.TAINT_CONTACTS),
+                        ('deviceInfos', TaintTagEnum.TAINT_PHONE_NUMBER | TaintTagEnum.TAINT_IMEI | TaintTagEnum.TAINT_IMSI |
+                                        TaintTagEnum.TAINT_ICCID | TaintTagEnum.TAINT_DEVICE_SN),
+                        ('userInput', TaintTagEnum.TAINT_USER_INPUT),
+                        ('incomingData', TaintTagEnum.TAINT_INCOMING_DATA),
+                        ('location', TaintTagEnum.TAINT_LOCATION | TaintTagEnum.TAINT_LOCATION_GPS |
+                                     TaintTagEnum.TAINT_LOCATION_NET | TaintTagEnum.TAINT_LOCATION_LAST),
+                        ('other', TaintTagEnum.TAINT_MIC | TaintTagEnum.TAINT_CAMERA | TaintTagEnum.TAINT_ACCELEROMETER |
+                                  TaintTagEnum.TAINT_HISTORY | TaintTagEnum.TAINT_MEDIA | TaintTagEnum.TAINT_SMS)]
+    def evalColumnNumbers(self, theColumns, theApkList, theNumbersDictList, theReportMode=False):
+        """
+        Evaluates the numbers of all categories in NUMBERS_CATEGORY_LIST for
+        all apps of theColumns (app id = index in theApkList and
+        theNumbersDictList). An app counts for a tag group if one of its
+        entries has a tag of the group, for noTag if one is untainted (in
+        report mode the entries are counted). Calls are not checked for
+        tags. Returns a flag per app telling if anything matched.
+        """
+        oneMatchList = [False] * len(theApkList)
+        for key, entryClass, actionList, tagColumn in self.NUMBERS_CATEGORY_LIST:
+            ignoreTagFlag = entryClass is CallActionLogEntry
+            noTagMask = TaintTagEnum.TAINT_CLEAR
+            if ignoreTagFlag: noTagMask = None
+            countListList = [('noTag', theColumns.getCountsPerApp(entryClass, actionList, noTagMask, tagColumn))]
+            for tagKey, tagMask in self.NUMBERS_TAG_LIST:
+                if ignoreTagFlag: tagMask = None
+                countListList.append((tagKey, theColumns.getCountsPerApp(entryClass, actionList, tagMask, tagColumn)))
+
+            for appId, apk in enumerate(theApkList):
+                numbers = theNumbersDictList[appId][key]
+                oneMatch = False
+                for numberKey, countList in countListList:
+                    if countList[appId] == 0:
+                        continue
+                    if theReportMode:
+                        numbers[numberKey][0] += countList[appId]
+                    else:
+                        numbers[numberKey][0] += 1
+                        numbers[numberKey][1].append(apk)
+                    oneMatch = True
+                if ignoreTagFlag and oneMatch: # every call matches all tag groups, count them once (noTag)
+                    for tagKey, tagMask in self.NUMBERS_TAG_LIST:
+                        numbers[tagKey][0] -= 1
+                if oneMatch:
+                    oneMatchList[appId] = True
+                else:
+                    numbers['nothing'][0] += 1
+                    if theReportMode: numbers['nothing'][1].append(apk)
 
-        return oneMatch
+        return oneMatchList
 
     def printNumbers(self, theNumbers):
         for key, numbers in theNumbers['numbers'].iteritems():
@@ -454,23 +344,24 @@ class Analyzer:
         jsonFactory = JsonFactory()
 
         # Read main report file
-        mainReport = self.getMainReport(theDir, jsonFactory)        
+        mainReport = self.getMainReport(theDir, jsonFactory, self.APP_REPORT_FIELD_LIST)
 
         # Patterns
         filterList = [
-            NetworkSendLogEntry(action=0,
-                                tagList=[],
-                                destination='unknown',
-                                port=123,
-                                stackTraceStr=''),
-            FileSystemLogEntry(action=0,
-                               tagList=[],
-                               filePath='/data/data/com.android.music/shared_prefs/Music.xml',
-                               stackTraceStr='')
+            NetworkSendLogPattern(action=0,
+                                  tagList=[],
+                                  destination='unknown',
+                                  port=123,
+                                  stackTraceStr=''),
+            FileSystemLogPattern(action=0,
+                                 tagList=[],
+                                 filePath='/data/data/com.android.music/shared_prefs/Music.xml',
+                                 stackTraceStr='')
             ]        
+        filterList = LogEntryMatcher(filterList) # compiled once for all apps
 
         callPatterns = [
-            CallActionLogEntry(dialString='') # 15555218135
+            CallActionLogPattern(dialString='') # 15555218135
             ]
         
         # Analyze apps
@@ -488,6 +379,8 @@ class Analyzer:
                       'error' : [0, []],
                       'mainReport' : mainReport}
 
+        columns = LogEntryColumns()
+        apkList = [] # app id -> apk
         for appReport in mainReport.appList:
             
             apk = self.getAppApk(appReport.appPath)
@@ -500,45 +393,21 @@ class Analyzer:
                 #    taintLog.printOverview()
                 #    print '--------------------'
 
-                # Get numbers for overview table (eval calls)
-                oneMatch = self.evalTagNumbers(taintLog, apk, CallActionLogEntry(tagList=[]), resultDict['numbers']['call'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, CipherUsageLogEntry(tagList=[]), resultDict['numbers']['cipher'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_READ_ACTION,
-                                                                                  TaintLogActionEnum.FS_READ_DIRECT_ACTION,
-                                                                                  TaintLogActionEnum.FS_READV_ACTION],
-                                                                      tagList=[]),
-                                    resultDict['numbers']['fsRead'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_WRITE_ACTION,
-                                                                                  TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
-                                                                                  TaintLogActionEnum.FS_WRITEV_ACTION],
-                                                                      tagList=[]),
-                                    resultDict['numbers']['fsWrite'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_READ_ACTION,
-                                                                                   TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                                                                   TaintLogActionEnum.NET_RECV_ACTION,
-                                                                                   TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
-                                                                       tagList=[]),
-                                    resultDict['numbers']['netRead'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_SEND_ACTION,
-                                                                                   TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
-                                                                                   TaintLogActionEnum.NET_SEND_URGENT_ACTION,
-                                                                                   TaintLogActionEnum.NET_WRITE_ACTION,
-                                                                                   TaintLogActionEnum.NET_WRITE_DIRECT_ACTION],
-                                                                       tagList=[]),
-                                    resultDict['numbers']['netWrite'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, SSLLogEntry(tagList=[]), resultDict['numbers']['ssl'])
-                oneMatch |= self.evalTagNumbers(taintLog, apk, SendSmsLogEntry(tagList=[]), resultDict['numbers']['sms'])
-                oneMatch |= self.evalSmsDestTagNumbers(taintLog, apk, SendSmsLogEntry(destinationTagList=[]), resultDict['numbers']['smsDest'])
-
-                # Nothing happens
-                if not oneMatch:
-                    resultDict['nothing'][0] += 1
-                    resultDict['nothing'][1].append(apk)
+                columns.addLogEntries(taintLog.getLogEntryList(), len(apkList))
+                apkList.append(apk)
 
             else:
                 resultDict['error'][0] += 1
                 resultDict['error'][1].append(apk)
 
+        # Get numbers for overview table (all apps at once)
+        oneMatchList = self.evalColumnNumbers(columns, apkList, [resultDict['numbers']] * len(apkList))
+        for appId, apk in enumerate(apkList):
+            # Nothing happens
+            if not oneMatchList[appId]:
+                resultDict['nothing'][0] += 1
+                resultDict['nothing'][1].append(apk)
+
         # Return
         return resultDict
 
@@ -591,23 +460,21 @@ class Analyzer:
         networkReadSourceList = {}
         
         for directory in self.dirs:
-            # Read main report file
-            mainReport = self.getMainReport(directory, jsonFactory)
-
             # Patterns
             filterList = [
-                NetworkSendLogEntry(action=0,
-                                    tagList=[],
-                                    destination='unknown',
-                                    port=123,
-                                    stackTraceStr=''),
-                FileSystemLogEntry(action=0,
-                                   tagList=[],
-                                   filePath='/data/data/com.android.music/shared_prefs/Music.xml',
-                                   stackTraceStr='')
+                NetworkSendLogPattern(action=0,
+                                      tagList=[],
+                                      destination='unknown',
+                                      port=123,
+                                      stackTraceStr=''),
+                FileSystemLogPattern(action=0,
+                                     tagList=[],
+                                     filePath='/data/data/com.android.music/shared_prefs/Music.xml',
+                                     stackTraceStr='')
                 ]
+            filterList = LogEntryMatcher(filterList) # compiled once for all apps
 
-            for appReport in mainReport.appList:
+            for appReport in self.iterAppReports(directory, jsonFactory, self.APP_REPORT_FIELD_LIST):
                 apk = self.getAppApk(appReport.appPath)
                 md5 = apk.getMd5Hash()
                 taintLog = self.getAppTaintLog(directory, appReport.logcatFile)
@@ -648,11 +515,11 @@ class Analyzer:
                     # Network write dest
                     networkEntries = taintLog.getLogEntryList(NetworkSendLogEntry)
                     for networkEntry in networkEntries:
-                        if networkEntry.doesMatch(NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_READ_ACTION,
-                                                                                  TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                                                                  TaintLogActionEnum.NET_RECV_ACTION,
-                                                                                  TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
-                                                                      tagList=[])):
+                        if networkEntry.doesMatch(NetworkSendLogPattern(actionList=[TaintLogActionEnum.NET_READ_ACTION,
+                                                                                    TaintLogActionEnum.NET_READ_DIRECT_ACTION,
+                                                                                    TaintLogActionEnum.NET_RECV_ACTION,
+                                                                                    TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
+                                                                        tagList=[])):
                             if not networkReadSourceList.has_key(networkEntry.destination):
                                 networkReadSourceList[networkEntry.destination] = [1, [md5]]
                             else:
@@ -714,8 +581,7 @@ class Analyzer:
         appList = []
         jsonFactory = JsonFactory()
         for directory in self.dirs:            
-            mainReport = self.getMainReport(directory, jsonFactory)
-            for appReport in mainReport.appList:
+            for appReport in self.iterAppReports(directory, jsonFactory, self.APP_REPORT_FIELD_LIST):
                 apk = self.getAppApk(appReport.appPath)
                 targetName = '%s-%s.apk' % (apk.getPackage(), apk.getMd5Hash())
                 if not targetName in alreadyVisited:
@@ -764,8 +630,7 @@ class Analyzer:
                       'rawDirectory':[]}
         
         for directory in self.dirs:
-            mainReport = self.getMainReport(directory, jsonFactory)
-            for appReport in mainReport.appList:
+            for appReport in self.iterAppReports(directory, jsonFactory, self.APP_REPORT_FIELD_LIST):
                 apk = self.getAppApk(appReport.appPath)
                 md5 = apk.getMd5Hash()
 
@@ -801,67 +666,26 @@ class Analyzer:
                 # Sort name
                 result[md5]['sortName'] = '%s-%s' % (apk.getPackage(), md5)
 
-        # Evaluate results
+        # Evaluate results (app id = taint log)
+        columns = LogEntryColumns()
+        apkList = []
+        appResultList = []
         for appMd5, appResult in result.iteritems():
             for taintLog in appResult['taintLogList']:
-                oneMatch = self.evalTagNumbers(taintLog, appResult['apk'], CallActionLogEntry(tagList=[]), appResult['details']['call'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], CipherUsageLogEntry(tagList=[]), appResult['details']['cipher'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_READ_ACTION,
-                                                                                  TaintLogActionEnum.FS_READ_DIRECT_ACTION,
-                                                                                  TaintLogActionEnum.FS_READV_ACTION],
-                                                                      tagList=[]),
-                                    appResult['details']['fsRead'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_WRITE_ACTION,
-                                                                                  TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
-                                                                                  TaintLogActionEnum.FS_WRITEV_ACTION],
-                                                                      tagList=[]),
-                                    appResult['details']['fsWrite'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_READ_ACTION,
-                                                                                   TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                                                                   TaintLogActionEnum.NET_RECV_ACTION,
-                                                                                   TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
-                                                                       tagList=[]),
-                                    appResult['details']['netRead'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_SEND_ACTION,
-                                                                                   TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
-                                                                                   TaintLogActionEnum.NET_SEND_URGENT_ACTION,
-                                                                                   TaintLogActionEnum.NET_WRITE_ACTION,
-                                                                                   TaintLogActionEnum.NET_WRITE_DIRECT_ACTION],
-                                                                       tagList=[]),
-                                    appResult['details']['netWrite'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], SSLLogEntry(tagList=[]), appResult['details']['ssl'], theReportMode=True)
-                oneMatch |= self.evalTagNumbers(taintLog, appResult['apk'], SendSmsLogEntry(tagList=[]), appResult['details']['sms'], theReportMode=True)
-                oneMatch |= self.evalSmsDestTagNumbers(taintLog, appResult['apk'], SendSmsLogEntry(destinationTagList=[]), appResult['details']['smsDest'], theReportMode=True)
-
-                # Nothing happens
-                if not oneMatch:
-                    pass
-
-                # Get numbers of several actions
-                appResult['overview2']['sms'] += taintLog.getNumLogEntries(theType=SendSmsLogEntry)
-                appResult['overview2']['ssl'] += taintLog.getNumLogEntries(theType=SSLLogEntry)
-                appResult['overview2']['call'] += taintLog.getNumLogEntries(theType=CallActionLogEntry)
-                appResult['overview2']['cipher'] += taintLog.getNumLogEntries(theType=CipherUsageLogEntry)
-                appResult['overview2']['netRead'] += len(taintLog.getMatchingLogEntries([NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_READ_ACTION,
-                                                                                                                                TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                                                                                                                TaintLogActionEnum.NET_RECV_ACTION,
-                                                                                                                                TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
-                                                                                                                    tagList=[])]))
-                appResult['overview2']['netWrite'] += len(taintLog.getMatchingLogEntries([NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_SEND_ACTION,
-                                                                                                                                 TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
-                                                                                                                                 TaintLogActionEnum.NET_SEND_URGENT_ACTION,
-                                                                                                                                 TaintLogActionEnum.NET_WRITE_ACTION,
-                                                                                                                                 TaintLogActionEnum.NET_WRITE_DIRECT_ACTION],
-                                                                                                                     tagList=[])]))
-                appResult['overview2']['fsRead'] += len(taintLog.getMatchingLogEntries([FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_READ_ACTION,
-                                                                                                                             TaintLogActionEnum.FS_READ_DIRECT_ACTION,
-                                                                                                                             TaintLogActionEnum.FS_READV_ACTION],
-                                                                                                                 tagList=[])]))
-                appResult['overview2']['fsWrite'] += len(taintLog.getMatchingLogEntries([FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_WRITE_ACTION,
-                                                                                                                               TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
-                                                                                                                               TaintLogActionEnum.FS_WRITEV_ACTION],
-                                                                                                                   tagList=[])]))
+                columns.addLogEntries(taintLog.getLogEntryList(), len(apkList))
+                apkList.append(appResult['apk'])
+                appResultList.append(appResult)
+        self.evalColumnNumbers(columns, apkList, [appResult['details'] for appResult in appResultList], theReportMode=True)
+
+        # Get numbers of several actions
+        for key, entryClass, actionList, tagColumn in self.NUMBERS_CATEGORY_LIST:
+            if key == 'smsDest':
+                continue
+            countList = columns.getCountsPerApp(entryClass, actionList)
+            for appId, appResult in enumerate(appResultList):
+                appResult['overview2'][key] += countList[appId]
 
+        for appMd5, appResult in result.iteritems():
             # Add numbers to overview table
             for tag, overviewNumbers in appResult['overview'].iteritems():
                 for action, actionEntry in appResult['details'].iteritems():
@@ -942,31 +766,31 @@ class Analyzer:
                         relevantLogEntries.extend(taintLog.getLogEntryList(theType=CipherUsageLogEntry))
                         columnList = ['Tag', 'Mode', 'Data']
                     elif action == 'fsRead':
-                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_READ_ACTION,
-                                                                                                                 TaintLogActionEnum.FS_READ_DIRECT_ACTION,
-                                                                                                                 TaintLogActionEnum.FS_READV_ACTION],
-                                                                                                     tagList=[])]))
+                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([FileSystemLogPattern(actionList=[TaintLogActionEnum.FS_READ_ACTION,
+                                                                                                                   TaintLogActionEnum.FS_READ_DIRECT_ACTION,
+                                                                                                                   TaintLogActionEnum.FS_READV_ACTION],
+                                                                                                       tagList=[])]))
                         columnList = ['Tag', 'Action', 'File Path', 'Data']
                     elif action == 'fsWrite':
-                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([FileSystemLogEntry(actionList=[TaintLogActionEnum.FS_WRITE_ACTION,
-                                                                                                                 TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
-                                                                                                                 TaintLogActionEnum.FS_WRITEV_ACTION],
-                                                                                                     tagList=[])]))
+                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([FileSystemLogPattern(actionList=[TaintLogActionEnum.FS_WRITE_ACTION,
+                                                                                                                   TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
+                                                                                                                   TaintLogActionEnum.FS_WRITEV_ACTION],
+                                                                                                       tagList=[])]))
                         columnList = ['Tag', 'Action', 'File Path', 'Data']
                     elif action == 'netRead':
-                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_READ_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_RECV_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
-                                                                                                      tagList=[])]))
+                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([NetworkSendLogPattern(actionList=[TaintLogActionEnum.NET_READ_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_READ_DIRECT_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_RECV_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_RECV_DIRECT_ACTION],
+                                                                                                        tagList=[])]))
                         columnList = ['Tag', 'Action', 'Destination', 'Data']
                     elif action == 'netWrite':
-                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([NetworkSendLogEntry(actionList=[TaintLogActionEnum.NET_SEND_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_SEND_URGENT_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_WRITE_ACTION,
-                                                                                                                  TaintLogActionEnum.NET_WRITE_DIRECT_ACTION],
-                                                                                                      tagList=[])]))
+                        relevantLogEntries.extend(taintLog.getMatchingLogEntries([NetworkSendLogPattern(actionList=[TaintLogActionEnum.NET_SEND_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_SEND_DIRECT_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_SEND_URGENT_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_WRITE_ACTION,
+                                                                                                                    TaintLogActionEnum.NET_WRITE_DIRECT_ACTION],
+                                                                                                        tagList=[])]))
                         columnList = ['Tag', 'Action', 'Destination', 'Data']
                     elif action == 'ssl':
                         relevantLogEntries.extend(taintLog.getLogEntryList(theType=SSLLogEntry))
@@ -1089,29 +913,28 @@ class Analyzer:
 
     def findNotInstrumentedPatterns(self):
         notInstrumentedPatterns = [
-            NetworkSendLogEntry(action=0,
-                                actionList=[TaintLogActionEnum.NET_READ_DIRECT_ACTION,
-                                            TaintLogActionEnum.NET_WRITE_DIRECT_ACTION,
-                                            TaintLogActionEnum.NET_RECV_DIRECT_ACTION,
-                                            TaintLogActionEnum.NET_SEND_DIRECT_ACTION],
-                                tagList=[],
-                                destination='',
-                                stackTraceStr=''),
-            FileSystemLogEntry(action=0,
-                               actionList=[TaintLogActionEnum.FS_READ_DIRECT_ACTION,
-                                           TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
-                                           TaintLogActionEnum.FS_READV_ACTION,
-                                           TaintLogActionEnum.FS_WRITEV_ACTION],
-                               tagList=[],
-                               filePath='',
-                               stackTraceStr='')
+            NetworkSendLogPattern(action=0,
+                                  actionList=[TaintLogActionEnum.NET_READ_DIRECT_ACTION,
+                                              TaintLogActionEnum.NET_WRITE_DIRECT_ACTION,
+                                              TaintLogActionEnum.NET_RECV_DIRECT_ACTION,
+                                              TaintLogActionEnum.NET_SEND_DIRECT_ACTION],
+                                  tagList=[],
+                                  destination='',
+                                  stackTraceStr=''),
+            FileSystemLogPattern(action=0,
+                                 actionList=[TaintLogActionEnum.FS_READ_DIRECT_ACTION,
+                                             TaintLogActionEnum.FS_WRITE_DIRECT_ACTION,
+                                             TaintLogActionEnum.FS_READV_ACTION,
+                                             TaintLogActionEnum.FS_WRITEV_ACTION],
+                                 tagList=[],
+                                 filePath='',
+                                 stackTraceStr='')
             ]
         
         jsonFactory = JsonFactory()
         for directory in self.dirs:
             print 'Look in %s' % directory
-            mainReport = self.getMainReport(directory, jsonFactory)
-            for appReport in mainReport.appList:
+            for appReport in self.iterAppReports(directory, jsonFactory, self.APP_REPORT_FIELD_LIST):
                 apk = self.getAppApk(appReport.appPath)
                 taintLog = self.getAppTaintLog(directory, appReport.logcatFile)
                 if not taintLog is None:
@@ -1126,8 +949,7 @@ class Analyzer:
         jsonFactory = JsonFactory()
         for directory in self.dirs:
             print 'Look in %s' % directory
-            mainReport = self.getMainReport(directory, jsonFactory)
-            for appReport in mainReport.appList:
+            for appReport in self.iterAppReports(directory, jsonFactory, self.APP_REPORT_FIELD_LIST):
                 apk = self.getAppApk(appReport.appPath)
                 taintLog = self.getAppTaintLog(directory, appReport.logcatFile)
                 if not taintLog is None:
@@ -1166,6 +988,8 @@ if __name__ == '__main__':
     parser.add_option('', '--printDictFile', metavar='<path>', default=None, help='Set path to file in which output dict should be printed')
     parser.add_option('', '--htmlOutputDir', metavar='<path>', default=None, help='Output directory for generated HTML report')
     parser.add_option('', '--reportAppDir', metavar='<path>', default=None, help='Default app directory on USB stick')
+    parser.add_option('', '--noLogCache', action='store_true', default=False, help='Parse the logcat files without using or writing their cache files')
+    parser.add_option('', '--parseProcesses', metavar='<int>', type='int', default=1, help='Number of processes parsing a large logcat file')
     (options, args) = parser.parse_args()
 
     # Get report dir
@@ -1184,6 +1008,8 @@ if __name__ == '__main__':
     analyzer.printDictFile = options.printDictFile
     analyzer.htmlOutputDir = options.htmlOutputDir
     analyzer.reportAppDir = options.reportAppDir
+    analyzer.logCacheFlag = not options.noLogCache
+    analyzer.numParseProcesses = options.parseProcesses
     analyzer.analyze()
 
     # malware full: python helper_analyzer.py -m 0 --baseAppDir /home/daniel/Documents/Malware/thesis_analysis/ ~/Documents/Malware/reports/mw_nb_1_20120112-213037/ ~/Documents/Malware/reports/mw_nb_2_20120122-111827/ ~/Documents/Malware/reports/mw_nb_3_20120122-143747/ ~/Documents/Malware/reports/mw_nb_4_20120123-215147/ ~/Documents/Malware/reports/mw_rub_full_20120123-214357/ ~/Documents/Malware/reports/mw_desk_full/
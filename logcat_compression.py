@@ -0,0 +1,188 @@
+################################################################################
+#
+# Copyright (c) 2011-2012, Daniel Baeumges (dbaeumges@googlemail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+import gzip
+import os
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# ================================================================================
+# Logcat Compression
+# ================================================================================
+class LogcatCompression:
+    """
+    Compression formats of stored logcat files, the value is the suffix
+    appended to the file name. xz needs the lzma module (backports.lzma
+    with Python 2), zst the zstandard module.
+    """
+    NONE = ''
+    GZIP = 'gz'
+    XZ = 'xz'
+    ZSTD = 'zst'
+
+    FORMAT_LIST = [GZIP, XZ, ZSTD]
+
+# Block size for reading and copying
+BLOCK_SIZE = 1024 * 1024
+
+def isCompressionAvailable(theCompression):
+    if theCompression == LogcatCompression.XZ:
+        return not lzma is None
+    if theCompression == LogcatCompression.ZSTD:
+        return not zstandard is None
+    return theCompression in [LogcatCompression.NONE, LogcatCompression.GZIP]
+
+def getCompression(theFile):
+    """
+    Returns the compression of theFile by its suffix.
+    """
+    for compression in LogcatCompression.FORMAT_LIST:
+        if theFile.endswith('.' + compression):
+            return compression
+    return LogcatCompression.NONE
+
+def stripCompressionSuffix(theFile):
+    compression = getCompression(theFile)
+    if compression == LogcatCompression.NONE:
+        return theFile
+    return theFile[:-len(compression)-1]
+
+def findLogcatFile(theFile):
+    """
+    Returns theFile or, if it does not exist, its compressed version.
+    """
+    if os.path.exists(theFile):
+        return theFile
+    for compression in LogcatCompression.FORMAT_LIST:
+        if os.path.exists('%s.%s' % (theFile, compression)):
+            return '%s.%s' % (theFile, compression)
+    return theFile
+
+def openLogcatFile(theFile, theMode='rb'):
+    """
+    Opens theFile ('rb' or 'wb') with the compression of its suffix.
+    """
+    compression = getCompression(theFile)
+    if not isCompressionAvailable(compression):
+        raise ValueError('Compression \'%s\' of \'%s\' is not available' % (compression, theFile))
+    if compression == LogcatCompression.GZIP:
+        return gzip.open(theFile, theMode, 6)
+    if compression == LogcatCompression.XZ:
+        return lzma.LZMAFile(theFile, theMode)
+    if compression == LogcatCompression.ZSTD:
+        return _ZstdFile(theFile, theMode)
+    return open(theFile, theMode)
+
+def iterLogcatLines(theFile):
+    """
+    Generator yielding the lines (split at '\\n' only, line ends are kept)
+    of the opened theFile, which is read in blocks.
+    """
+    rest = ''
+    while True:
+        block = theFile.read(BLOCK_SIZE)
+        if not block:
+            break
+        lineList = (rest + block).split('\n')
+        rest = lineList.pop()
+        for line in lineList:
+            yield line + '\n'
+    if rest:
+        yield rest
+
+def compressLogcatFile(theFile, theCompression):
+    """
+    Compresses theFile to theFile.<theCompression> and removes theFile.
+    Returns the name of the compressed file. An existing compressed file
+    is never overwritten (IOError).
+    """
+    compressedFile = '%s.%s' % (theFile, theCompression)
+    if os.path.exists(compressedFile):
+        raise IOError('Compressed logcat file \'%s\' already exists' % compressedFile)
+    inFile = open(theFile, 'rb')
+    try:
+        outFile = openLogcatFile(compressedFile, 'wb')
+        try:
+            while True:
+                block = inFile.read(BLOCK_SIZE)
+                if not block:
+                    break
+                outFile.write(block)
+        finally:
+            outFile.close()
+    except:
+        inFile.close()
+        if os.path.exists(compressedFile):
+            os.remove(compressedFile)
+        raise
+    inFile.close()
+    os.remove(theFile)
+    return compressedFile
+
+
+# ================================================================================
+# Zstandard File
+# ================================================================================
+class _ZstdFile:
+    """
+    Minimal file object for one zstd frame: write or read in blocks (read
+    returns the next decompressed block, not exactly theSize bytes).
+    """
+    LEVEL = 3
+
+    def __init__(self, theFile, theMode):
+        self.file = open(theFile, theMode)
+        if theMode.startswith('w'):
+            self.compressor = zstandard.ZstdCompressor(level=self.LEVEL).compressobj()
+            self.decompressor = None
+        else:
+            self.compressor = None
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def write(self, theData):
+        self.file.write(self.compressor.compress(theData))
+
+    def read(self, theSize=BLOCK_SIZE):
+        while True:
+            block = self.file.read(theSize)
+            if not block:
+                return ''
+            data = self.decompressor.decompress(block)
+            if data:
+                return data
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            if not self.compressor is None:
+                self.file.write(self.compressor.flush())
+        finally:
+            self.file.close()
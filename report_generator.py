@@ -78,6 +78,8 @@ class ReportGenerator:
         report.write('<li><b>MD5 (hex)</b>: %s' % app.getMd5Hash())
         report.write('<li><b>Sha256 (hex)</b>: %s' % app.getSha256Hash())
         report.write('<li><b>maxLogcatSize</b>: %d' % theResultEntry['maxLogcatSize'])        
+        if theResultEntry.has_key('bootTime'):
+            report.write('<li><b>bootTime</b>: %.1fsec' % theResultEntry['bootTime'])
         
         report.write('<h2>Log</h2>')
         if log is None:
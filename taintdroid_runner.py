@@ -21,6 +21,7 @@ from apk_wrapper import APKWrapper, APKWrapperError
 from common import Logger, LogLevel, LogMode, SimulationSteps, Utils
 from emulator_client import *
 from emulator_telnet_client import *
+from logcat_compression import LogcatCompression, compressLogcatFile, findLogcatFile, isCompressionAvailable
 from ms_db_interface import MsDbInterface, MsDbInterfaceError
 from optparse import OptionParser
 from report_generator import ReportGenerator
@@ -28,13 +29,15 @@ from taintlog_analyzer import TaintLogAnalyzer, TaintLogAnalyzerError
 from taintlog_json import CallActionLogEntry, CipherUsageLogEntry, FileSystemLogEntry, NetworkSendLogEntry, SSLLogEntry, SendSmsLogEntry, SimulatorActionLogEntry
 from taintlog_json import AppReportEntry, MainReportEntry
 from taintlog_json import JsonFactory
-from threading import Thread
+from threading import Lock, Thread, Timer
 from detection.action_processor import ActionProcessor
 
+import Queue
 import random
 import datetime
 import os
 import shutil
+import subprocess
 import time
 import traceback
 import urllib2
@@ -67,6 +70,31 @@ class TaintDroidRunnerMode:
             raise ValueError('Invalid TaintDroid Runner mode: %s' % theStr)
 
 
+class ImageStagingMode:
+    """
+    How the clean images are staged into the per-app image dir.
+    COPY copies every image, LINK hard- or symlinks the read-only images
+    and reflinks/sparse-copies the writable ones.
+    """
+    COPY = 'copy'
+    LINK = 'link'
+
+    READ_ONLY_IMAGES = ['ramdisk.img', 'system.img', 'zImage']
+
+    @staticmethod
+    def isValidValue(theValue):
+        return theValue in [ImageStagingMode.COPY, ImageStagingMode.LINK]
+
+
+class RunnerEvent:
+    """
+    Events posted by runner threads and timers to the completion queue
+    of the main loop.
+    """
+    FINISHED = 1
+    TIMEOUT = 2
+
+
 # ========================================================================
 # TaintDroid Runner Error
 # ========================================================================
@@ -99,9 +127,17 @@ class RunnerThread(Thread):
         self.emulator = None
         self.result = {}
 
+        self.threadIndex = -1
+        self.completionQueue = None # Queue.Queue of the main loop, if any
+
+        self.keepEmulatorFlag = False # Reset emulator after run instead of stopping it
+        self.emulatorReusableFlag = False # Set if emulator was reset successfully
+
         self.cancelFlag = False  # Flag for canceling run
         self.resultFetchedFlag = False # Flag for whether has fetched logcat
         self.logcatRedirectFile = '/mnt/sdcard/logcat.log'
+        self.logAnalyzer = None # Tails the streamed logcat during the run
+        self.logAnalyzerLock = Lock()
 
     def __checkForCancelation(self):
         """
@@ -150,9 +186,12 @@ class RunnerThread(Thread):
             self.result['startTime'] = self.startTime
             self.result['errorList'] = []
 
-            # Init clean image dir
-            imageDirPath = self._initCleanImageDir(
-                self.tdRunnerMain.imageDirPath, self.app.getId(), self.app.getApkName())
+            # Init clean image dir (a pooled emulator brings its own)
+            if self.emulator is None:
+                imageDirPath = self._initCleanImageDir(
+                    self.tdRunnerMain.imageDirPath, self.app.getId(), self.app.getApkName())
+            else:
+                imageDirPath = self.emulator.imageDirPath
 
             # Init result
             # if exception thrown, result may not be properly initialized,
@@ -162,21 +201,34 @@ class RunnerThread(Thread):
             self.__checkForCancelation()
 
             # Start emulator
-            self.emulator = EmulatorClient(
-                theSdkPath=self.tdRunnerMain.sdkPath,
-                thePort=self.emulatorPort,
-                theImageDirPath=imageDirPath,
-                theAvdName=self.tdRunnerMain.avdName,
-                theRunHeadlessFlag=self.tdRunnerMain.runHeadless,
-                theLogger=self.log)
-            self.emulator.start()
+            if self.emulator is None:
+                self.emulator = EmulatorClient(
+                    theSdkPath=self.tdRunnerMain.sdkPath,
+                    thePort=self.emulatorPort,
+                    theImageDirPath=imageDirPath,
+                    theAvdName=self.tdRunnerMain.avdName,
+                    theRunHeadlessFlag=self.tdRunnerMain.runHeadless,
+                    theBootTimeout=self.tdRunnerMain.bootTimeout,
+                    theNativeAdbFlag=self.tdRunnerMain.nativeAdb,
+                    theAdbServerHost=self.tdRunnerMain.adbServerHost,
+                    theAdbServerPort=self.tdRunnerMain.adbServerPort,
+                    theLogger=self.log)
+                self.emulator.start()
+                self.result['bootTime'] = self.emulator.bootTime
+            else:
+                self.log.info('Reuse running emulator on port %d' % self.emulatorPort)
+                self.emulator.log = self.log
+                self.result['bootTime'] = 0
 
             # Run app
             keyboardInterruptFlag = self.runApp(
                 self.emulator, self.app, self.simulationSteps)
 
-            # Stop emulator
-            self.emulator.stop()
+            # Stop emulator or reset it for the next app
+            if self.keepEmulatorFlag and not keyboardInterruptFlag:
+                self._resetEmulator()
+            else:
+                self.emulator.stop()
 
             # Print results
             self.log.write('- App: %s (package: %s)' %
@@ -201,13 +253,38 @@ class RunnerThread(Thread):
             self.result['endTime'] = datetime.datetime.now()
 
         finally:
+            # Emulator is handed back to the pool, it keeps its image dir
+            if self.emulatorReusableFlag:
+                imageDirPath = None
+            elif self.keepEmulatorFlag and not self.emulator is None and \
+                    self.emulator.isEmulatorRunning():
+                self.emulator.killRun()
+
             # CleanUp folder
-            if self.tdRunnerMain.cleanUpImageDir:
+            if imageDirPath is None:
+                pass
+            elif self.tdRunnerMain.cleanUpImageDir:
                 self._cleanUpImageDir(imageDirPath)
             else:
                 self.log.info(
                     'Image dir \'%s\' will not be removed, cleanUpImageDir flag set to false.' % imageDirPath)
 
+            # Notify main loop
+            if not self.completionQueue is None:
+                self.completionQueue.put((RunnerEvent.FINISHED, self.threadIndex, self))
+
+    def _resetEmulator(self):
+        """
+        Reset the emulator for the next app. The emulator is stopped if the
+        reset fails.
+        """
+        try:
+            self.emulator.resetState(self.app.getPackage(), self.logcatRedirectFile)
+            self.emulatorReusableFlag = True
+        except EmulatorClientError as ecErr:
+            self.log.error('Failed to reset emulator, stop it: %s' % str(ecErr))
+            self.emulator.stop()
+
     def _initCleanImageDir(self, theImageDir, theSampleId, theAppName):
         """
         Build a new directory with clean images.
@@ -229,11 +306,57 @@ class RunnerThread(Thread):
         os.mkdir(newPath)
         for imageFile in imageFileList:
             self.__checkForCancelation()
-            self.log.info('- Copy %s' % imageFile)
-            shutil.copy2(
-                os.path.join(theImageDir, imageFile), os.path.join(newPath, imageFile))
+            srcFile = os.path.join(theImageDir, imageFile)
+            dstFile = os.path.join(newPath, imageFile)
+            if self.tdRunnerMain.imageStagingMode == ImageStagingMode.LINK:
+                if imageFile in ImageStagingMode.READ_ONLY_IMAGES:
+                    self._linkImage(srcFile, dstFile)
+                else:
+                    self._cowCopyImage(srcFile, dstFile)
+            else:
+                self.log.info('- Copy %s' % imageFile)
+                shutil.copy2(srcFile, dstFile)
         return newPath
 
+    def _linkImage(self, theSrcFile, theDstFile):
+        """
+        Stage a read-only image as hardlink, or as symlink if the image
+        dir is on a different file system. Falls back to a plain copy.
+        """
+        try:
+            os.link(theSrcFile, theDstFile)
+            self.log.info('- Hardlink %s' % theSrcFile)
+            return
+        except OSError as ose:
+            self.log.debug('Hardlink of %s failed: %s' % (theSrcFile, ose))
+        try:
+            os.symlink(os.path.abspath(theSrcFile), theDstFile)
+            self.log.info('- Symlink %s' % theSrcFile)
+            return
+        except OSError as ose:
+            self.log.debug('Symlink of %s failed: %s' % (theSrcFile, ose))
+        self.log.info('- Copy %s' % theSrcFile)
+        shutil.copy2(theSrcFile, theDstFile)
+
+    def _cowCopyImage(self, theSrcFile, theDstFile):
+        """
+        Stage a writable image as reflink (copy-on-write) where the file
+        system supports it, as sparse copy otherwise. Falls back to a plain
+        copy if cp cannot be run.
+        """
+        args = ['cp', '--reflink=auto', '--sparse=always', '--preserve=timestamps',
+                theSrcFile, theDstFile]
+        try:
+            retcode = subprocess.call(args)
+            if retcode == 0:
+                self.log.info('- Reflink/sparse copy %s' % theSrcFile)
+                return
+            self.log.debug('Reflink copy of %s failed: cp returned %d' % (theSrcFile, retcode))
+        except OSError as ose:
+            self.log.debug('Reflink copy of %s failed: %s' % (theSrcFile, ose))
+        self.log.info('- Copy %s' % theSrcFile)
+        shutil.copy2(theSrcFile, theDstFile)
+
     def _cleanUpImageDir(self, theImageDirPath):
         """
         Clean up the image dir.
@@ -254,16 +377,17 @@ class RunnerThread(Thread):
                 os.mkdir(theLogcatDirPath)
         logcatFileName = '%s%s_%06d_logcat.log' % (
             theLogcatDirPath, theFileName, theSampleId)
-        self.result['logcatFileName'] = logcatFileName
-        if os.path.exists(logcatFileName):
+        # Logcat files of earlier runs might have been compressed meanwhile
+        if os.path.exists(findLogcatFile(logcatFileName)):
             i = 1
             while True:
                 logcatFileName = '%s%s_%06d_%02d_logcat.log' % (
                     theLogcatDirPath, theFileName, theSampleId, i)
-                if os.path.exists(logcatFileName):
+                if os.path.exists(findLogcatFile(logcatFileName)):
                     i += 1
                 else:
                     break
+        self.result['logcatFileName'] = logcatFileName
         self.log.debug('Store logcat in %s' % logcatFileName)
         return logcatFileName
 
@@ -353,8 +477,15 @@ class RunnerThread(Thread):
         # theEmulator.setSimCountryIso('de')
 
         # Start logcat redirect
-        
-        theEmulator.startLogcatRedirect(self.logcatRedirectFile, self.maxLogcatSize)
+        if self.tdRunnerMain.streamLogcat:
+            logcatFileName = self._getLogcatFileName(
+                self.tdRunnerMain._getLogDirPath(), theApp.getId(), theApp.getApkName())
+            self.logAnalyzer = TaintLogAnalyzer(theLogger=self.log)
+            self.logAnalyzer.setLogFile(logcatFileName)
+            self.logcatRedirectFile = '' # nothing written to the sdcard
+            theEmulator.startLogcatStream(logcatFileName, self.maxLogcatSize)
+        else:
+            theEmulator.startLogcatRedirect(self.logcatRedirectFile, self.maxLogcatSize)
 
         # Switch on taint tracking
         #theEmulator.setProperty('tdroid.global.taintmask', '7176')
@@ -380,21 +511,25 @@ class RunnerThread(Thread):
             if (theSteps & SimulationSteps.MONKEY_BEFORE_GSM):
                 self._runMonkey(
                     theEmulator, theApp.getPackage(), numMonkeyEventsFirst)
+            self._tailLogcat()
             if (theSteps & SimulationSteps.GSM):
                 self._runGsmSimulation(theEmulator.getTelnetClient(), self.result['simulatorActions'])
             if (theSteps & SimulationSteps.MONKEY_BEFORE_GEO):
                 self._runMonkey(
                     theEmulator, theApp.getPackage(), numMonkeyEventsFirst)
+            self._tailLogcat()
             if (theSteps & SimulationSteps.GEO):
                 self._runGeoSimulation(theEmulator.getTelnetClient(),self.result['simulatorActions'])
             if (theSteps & SimulationSteps.MONKEY_BEFORE_SMS):
                 self._runMonkey(
                     theEmulator, theApp.getPackage(), numMonkeyEventsFirst)
+            self._tailLogcat()
             if (theSteps & SimulationSteps.SMS):
                 self._runSmsSimulation(theEmulator.getTelnetClient(), self.result['simulatorActions'])
             if (theSteps & SimulationSteps.MONKEY_BEFORE_POWER):
                 self._runMonkey(
                     theEmulator, theApp.getPackage(), numMonkeyEventsFirst)
+            self._tailLogcat()
             '''some emulator crashes on power command, comment it out
             if (theSteps & SimulationSteps.POWER):
                 self._runPowerSimulation(theEmulator.getTelnetClient())
@@ -429,21 +564,27 @@ class RunnerThread(Thread):
             theApp = self.app
             self.log.write('- %s: Analyze log' %
                            Utils.getTimeAsString(datetime.datetime.now()))
-            # Store log in logfile
-            #log = theEmulator.getLog()
-            theEmulator.stopLogcatRedirect()
-            #log = theEmulator.getLogcatRedirectFile(logcatRedirectFile)
-            #self._storeLogcatAsFile(self.tdRunnerMain._getLogDirPath(), theApp.getId(), theApp.getApkName(), log)
-            logcatFileName = self._getLogcatFileName(
-                self.tdRunnerMain._getLogDirPath(), theApp.getId(), theApp.getApkName())
-            theEmulator.storeLogcatRedirectFile(
-                self.logcatRedirectFile, logcatFileName)
-            
-            # Build LogAnalyzer
-            logAnalyzer = TaintLogAnalyzer(theLogger=self.log)
-            # logAnalyzer.setLogString(log)
-            logAnalyzer.setLogFile(logcatFileName)
-            logAnalyzer.extractLogEntries()
+            if not self.logAnalyzer is None:
+                # Streamed logcat was already stored and mostly parsed during the run
+                theEmulator.stopLogcatStream()
+                self._tailLogcat(True)
+                logAnalyzer = self.logAnalyzer
+            else:
+                # Store log in logfile
+                #log = theEmulator.getLog()
+                theEmulator.stopLogcatRedirect()
+                #log = theEmulator.getLogcatRedirectFile(logcatRedirectFile)
+                #self._storeLogcatAsFile(self.tdRunnerMain._getLogDirPath(), theApp.getId(), theApp.getApkName(), log)
+                logcatFileName = self._getLogcatFileName(
+                    self.tdRunnerMain._getLogDirPath(), theApp.getId(), theApp.getApkName())
+                theEmulator.storeLogcatRedirectFile(
+                    self.logcatRedirectFile, logcatFileName)
+
+                # Build LogAnalyzer
+                logAnalyzer = TaintLogAnalyzer(theLogger=self.log)
+                # logAnalyzer.setLogString(log)
+                logAnalyzer.setLogFile(logcatFileName)
+                logAnalyzer.extractLogEntries()
             logAnalyzer.postProcessLogObjects()
             self.result['errorList'].extend(
                 logAnalyzer.getJson2PyFailedErrorList())
@@ -454,11 +595,45 @@ class RunnerThread(Thread):
         except TaintLogAnalyzerError as tlaErr:
             self.result['errorList'].append(tlaErr)
 
+        # Compress the stored logcat after it was parsed
+        if not logAnalyzer is None and not self.tdRunnerMain.logcatCompression is None:
+            self._compressLogcat(logAnalyzer.logFile)
+
         # Build result entry
         self.result['log'] = logAnalyzer
         self.result['endTime'] = datetime.datetime.now()
         self.resultFetchedFlag = True
 
+    def _compressLogcat(self, theLogcatFileName):
+        """
+        Compresses the stored logcat file and its rotated files (streamed
+        logcat) with the compression of the runner.
+        """
+        fileNameList = [theLogcatFileName]
+        while os.path.exists('%s.%d' % (theLogcatFileName, len(fileNameList))):
+            fileNameList.append('%s.%d' % (theLogcatFileName, len(fileNameList)))
+        try:
+            for fileName in fileNameList:
+                compressedFileName = compressLogcatFile(fileName, self.tdRunnerMain.logcatCompression)
+                if fileName == theLogcatFileName:
+                    self.result['logcatFileName'] = compressedFileName
+        except (IOError, OSError, ValueError) as err:
+            self.log.error('Failed to compress logcat file %s: %s' % (theLogcatFileName, str(err)))
+
+    def _tailLogcat(self, theEndFlag=False):
+        """
+        Parses the lines of the streamed logcat written since the last call.
+        theEndFlag is set after the stream was stopped.
+        """
+        if self.logAnalyzer is None:
+            return
+        self.logAnalyzerLock.acquire()
+        try:
+            numLogEntries = self.logAnalyzer.tailLogEntries(theEndFlag)
+        finally:
+            self.logAnalyzerLock.release()
+        self.log.debug('Parsed %d new log entries of the streamed logcat' % numLogEntries)
+
     # ========================================================================
     # Simulations
     # ========================================================================
@@ -643,6 +818,30 @@ class RunnerThread(Thread):
                 time.sleep(timeLast)
 
 
+# ========================================================================
+# JSON Report App List
+# ========================================================================
+class JsonReportAppList:
+    """
+    appList of the main report passed to the final report. Each iteration
+    decodes the app reports from the lines yielded by theLineIterFunc
+    (report.jsonl) one at a time, so only one app is held in memory.
+    """
+    def __init__(self, theLineIterFunc):
+        self.lineIterFunc = theLineIterFunc
+
+    def __iter__(self):
+        jsonFactory = JsonFactory()
+        for appReportStr in self.lineIterFunc():
+            yield jsonFactory.json2Py(appReportStr)
+
+    def __len__(self):
+        numApps = 0
+        for appReportStr in self.lineIterFunc():
+            numApps += 1
+        return numApps
+
+
 # ========================================================================
 # TaintDroid Runner
 # ========================================================================
@@ -668,14 +867,22 @@ class TaintDroidRunner:
         self.avdName = None
 
         self.runHeadless = False
+        self.reuseEmulator = False  # keep one emulator per thread and reset it between apps
+        self.bootTimeout = 300
+        self.nativeAdb = False  # talk to the adb server directly instead of running adb
+        self.adbServerHost = 'localhost'
+        self.adbServerPort = 5037
 
         self.numMonkeyEvents = 500
         self.sleepTime = 60
         self.cleanUpImageDir = True
+        self.imageStagingMode = ImageStagingMode.COPY
 
         self.storeLogInFile = False
         self.logPathSuffix = theLogPathSuffix
         self.maxLogcatSize = 4096
+        self.streamLogcat = False  # stream logcat to the host and parse it during the run
+        self.logcatCompression = None  # LogcatCompression of the stored logcat files
 
         self.msDbLocation = 'mobile_sandbox/mobile_sandbox.db'
         self.msDb = None
@@ -685,6 +892,7 @@ class TaintDroidRunner:
         self.startTime = datetime.datetime.now()
 
         self.resultVec = []
+        self.jsonLinesFile = None  # report.jsonl in JSON mode, opened with the first app record
         
         self.remoteUrl = None
 
@@ -767,6 +975,33 @@ class TaintDroidRunner:
 
         return reportName
 
+    def _startTimeoutTimer(self, theCompletionQueue, theThreadIndex, theRunnerThread):
+        """
+        Start a timer which posts a timeout event for the provided runner
+        thread once maxThreadRuntime is exceeded.
+        """
+        timer = Timer(self.maxThreadRuntime,
+                      theCompletionQueue.put,
+                      [(RunnerEvent.TIMEOUT, theThreadIndex, theRunnerThread)])
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _stopEmulatorPool(self, theEmulatorPool):
+        """
+        Stop all emulators left in the pool and clean up their image dirs.
+        """
+        for emulator in theEmulatorPool:
+            if emulator is None or not emulator.isEmulatorRunning():
+                continue
+            self.log.debug('Stop pooled emulator on port %d' % emulator.port)
+            try:
+                emulator.stop()
+            except EmulatorClientError as ecErr:
+                self.log.error('Failed to stop pooled emulator: %s' % str(ecErr))
+            if self.cleanUpImageDir:
+                shutil.rmtree(emulator.imageDirPath, True)
+
     # ========================================================================
     # Run
     # ========================================================================
@@ -845,28 +1080,33 @@ class TaintDroidRunner:
             lastAppIndex = 0  # next app to be analyzed
             numRunningThreads = 0  # number of running threads
             threadList = []  # list of threads, size=numThreads
-            # bitmask to determine if thread is active, size=numThreads
-            threadActiveMask = []
+            timerList = []  # list of timeout timers, size=numThreads
+            emulatorPool = []  # list of reusable emulators, size=numThreads
             for i in xrange(numThreads):
                 threadList.append(None)
-                threadActiveMask.append(False)
+                timerList.append(None)
+                emulatorPool.append(None)
+
+            # Runner threads post RunnerEvent.FINISHED when done, timers
+            # post RunnerEvent.TIMEOUT when maxThreadRuntime is exceeded
+            completionQueue = Queue.Queue()
 
             while True:
                 try:
-                    # Get app and start thread
-                    if numRunningThreads < numThreads and lastAppIndex < len(appList):
+                    # Get apps and start threads for all free slots
+                    while numRunningThreads < numThreads and lastAppIndex < len(appList):
                         # Get app
                         app = appList[lastAppIndex]
 
                         # Check for inactive thread
                         threadIndex = -1
                         for i in xrange(numThreads):
-                            if not threadActiveMask[i]:
+                            if threadList[i] is None:
                                 threadIndex = i
                         if threadIndex == -1:
                             self.log.error(
                                 'No free thread index found even though numRunningThreads < numThreads')
-                            continue
+                            break
                         lastAppIndex += 1
                         self.log.debug(
                             'Free thread found (%d) for analyzing %s' %
@@ -900,74 +1140,87 @@ class TaintDroidRunner:
                             runnerThread.emulatorPort = runnerThread.emulatorPort + 1
                         else:
                             runnerThread.emulatorPort = runnerThread.emulatorPort + 2
+                        if self.reuseEmulator:
+                            # Pooled emulators are bound to their slot
+                            runnerThread.emulatorPort = self.emulatorStartPort + (threadIndex * 2)
+                            runnerThread.emulator = emulatorPool[threadIndex]
+                            runnerThread.keepEmulatorFlag = True
+                            emulatorPool[threadIndex] = None
                         runnerThread.daemon = False
                         runnerThread.startTime = datetime.datetime.now()
+                        runnerThread.threadIndex = threadIndex
+                        runnerThread.completionQueue = completionQueue
 
-                        # Start thread
+                        # Start thread and its timeout timer
                         threadList[threadIndex] = runnerThread
-                        threadActiveMask[threadIndex] = True
                         numRunningThreads += 1
                         runnerThread.start()
+                        timerList[threadIndex] = self._startTimeoutTimer(
+                            completionQueue, threadIndex, runnerThread)
 
-                    # No free thread -> check timing
+                    # Check for end
+                    if numFinishedApps == len(appList) or numRunningThreads == 0:
+                        break
+
+                    if lastAppIndex < len(appList):
+                        self.log.debug(
+                            'No free thread found, wait for free thread')
                     else:
-                        if lastAppIndex < len(appList):
-                            self.log.debug(
-                                'No free thread found, wait for free thread')
-                        else:
-                            self.log.debug(
-                                'No more apps to be analyzed, wait for end of analysis')
+                        self.log.debug(
+                            'No more apps to be analyzed, wait for end of analysis')
 
-                        # Check for inactive threads
-                        currentTime = datetime.datetime.now()
-                        for i in xrange(numThreads):
-                            # Thread terminated regulary
-                            if not threadList[i] is None and not threadList[i].isAlive():
-                                self.log.debug(
-                                    'Thread %d for %s finished' % ((i + 1), threadList[i].app.getApk()))
-                                self._handleThreadResult(
-                                    threadList[i].getResult())
-                                numFinishedApps += 1
-                                threadList[i] = None
-                                threadActiveMask[i] = False
-                                numRunningThreads -= 1
-
-                            # Check how long thread is running
-                            elif not threadList[i] is None:
-                                runningTime = currentTime - \
-                                    threadList[i].startTime
-                                if runningTime.seconds > self.maxThreadRuntime:
-                                    self.log.debug('Thread %d for %s is running more than %dsec, cancel' % (
-                                        (i + 1), threadList[i].app.getApk(), self.maxThreadRuntime))
-                                    threadList[i].cancelFlag = True
-                                    # Wait until finished, max 1min
-                                    threadList[i].join(60)
-                                    if threadList[i].isAlive():
-                                        self.log.error(
-                                            'Thread %d cannot be terminated, anyway free it up.' % ((i + 1)))
-                                        self._handleThreadResult(
-                                            threadList[i].getResult(), True)
-                                        threadList[i].killEmulator()
-                                        threadList[i].join(10)
-                                    else:
-                                        self.log.debug(
-                                            'Thread %d successfully terminated' % ((i + 1)))
-                                        self._handleThreadResult(
-                                            threadList[i].getResult())
-                                    numFinishedApps += 1
-                                    threadList[i] = None
-                                    threadActiveMask[i] = False
-                                    numRunningThreads -= 1
-
-                        # Sleep
-                        time.sleep(10)
+                    # Wait for next event
+                    try:
+                        (event, i, runnerThread) = completionQueue.get(True, 60)
+                    except Queue.Empty:
+                        continue
 
-                    # Check for end
-                    if numFinishedApps == len(appList):
-                        break
+                    # Event of an already freed thread
+                    if threadList[i] is not runnerThread:
+                        continue
+
+                    # Thread terminated regulary
+                    if event == RunnerEvent.FINISHED:
+                        self.log.debug(
+                            'Thread %d for %s finished' % ((i + 1), runnerThread.app.getApk()))
+                        runnerThread.join()
+                        self._handleThreadResult(runnerThread.getResult())
+
+                    # Thread is running too long
+                    elif event == RunnerEvent.TIMEOUT:
+                        self.log.debug('Thread %d for %s is running more than %dsec, cancel' % (
+                            (i + 1), runnerThread.app.getApk(), self.maxThreadRuntime))
+                        runnerThread.cancelFlag = True
+                        # Wait until finished, max 1min
+                        runnerThread.join(60)
+                        if runnerThread.isAlive():
+                            self.log.error(
+                                'Thread %d cannot be terminated, anyway free it up.' % ((i + 1)))
+                            self._handleThreadResult(
+                                runnerThread.getResult(), True)
+                            runnerThread.killEmulator()
+                            runnerThread.join(10)
+                        else:
+                            self.log.debug(
+                                'Thread %d successfully terminated' % ((i + 1)))
+                            self._handleThreadResult(
+                                runnerThread.getResult())
+
+                    # Free slot, keep emulator if it was reset successfully
+                    if runnerThread.emulatorReusableFlag and not runnerThread.isAlive():
+                        emulatorPool[i] = runnerThread.emulator
+                    if not timerList[i] is None:
+                        timerList[i].cancel()
+                        timerList[i] = None
+                    numFinishedApps += 1
+                    threadList[i] = None
+                    numRunningThreads -= 1
 
                 except KeyboardInterrupt:
                     self.log.write('KeyboardInterrupt detected, stop threads')
+                    for timer in timerList:
+                        if not timer is None:
+                            timer.cancel()
                     for runnerThread in threadList:
                         if not runnerThread is None:
                             runnerThread.cancelFlag = True
@@ -983,8 +1236,14 @@ class TaintDroidRunner:
                     traceback.print_exc()
                     traceback.print_exc(file=self.log.log)
                     self.log.error("error during thread execution, stop loop")
+                    for timer in timerList:
+                        if not timer is None:
+                            timer.cancel()
                     break
 
+            # Stop pooled emulators
+            self._stopEmulatorPool(emulatorPool)
+
         else:  # self.mode == TaintDroidRunnerMode.INTERACTIVE_MODE:
             # Initial check
             if self.appDir is not None:
@@ -1219,13 +1478,56 @@ class TaintDroidRunner:
                                  'numNetwork': numNetwork,
                                  'numSSL': numSSL,
                                  'numSMS': numSMS,
-                                 'numErrors': numErrors,
-                                 'actionList' : theThreadResult['log'].logEntryList,
-                                 'simulatorActions' : theThreadResult['simulatorActions']
+                                 'numErrors': numErrors
                                  }
 
+            # Append the app record to report.jsonl, the action lists are
+            # not kept in memory afterwards
+            actionList = []
+            if 'log' in theThreadResult:
+                actionList = theThreadResult['log'].logEntryList
+            appReport = AppReportEntry(id=appId,
+                                       appPackage=reportResultEntry['appPackage'],
+                                       appPath=reportResultEntry['appPath'],
+                                       appName=reportResultEntry['appName'],
+                                       logcatFile=logcatFileName,
+                                       md5Hash=reportResultEntry['appMd5Hash'],
+                                       startTime='%s %s' % (Utils.getDateAsString(theThreadResult['startTime']), Utils.getTimeAsString(theThreadResult['startTime'])),
+                                       endTime='%s %s' % (Utils.getDateAsString(theThreadResult['endTime']), Utils.getTimeAsString(theThreadResult['endTime'])),
+                                       actionList=actionList,
+                                       simulatorActions=theThreadResult.get('simulatorActions', []))
+            self._appendJsonReport(appReport)
+
             self.resultVec.append(reportResultEntry)
 
+    def _appendJsonReport(self, theAppReport):
+        """
+        Appends theAppReport as one line to report.jsonl and syncs it to
+        disk, so that the records of finished apps survive a crash.
+        """
+        if self.jsonLinesFile is None:
+            self.jsonLinesFile = open('%sreport.jsonl' % (self.reportPath), 'a')
+        self.jsonLinesFile.write(JsonFactory().py2Json(theAppReport))
+        self.jsonLinesFile.write('\n')
+        self.jsonLinesFile.flush()
+        os.fsync(self.jsonLinesFile.fileno())
+
+    def _iterJsonReport(self):
+        """
+        Generator yielding the lines (encoded AppReportEntry objects) of
+        report.jsonl. A last line cut off by a crash is skipped.
+        """
+        jsonLinesFileName = '%sreport.jsonl' % (self.reportPath)
+        if not os.path.exists(jsonLinesFileName):
+            return
+        jsonLinesFile = open(jsonLinesFileName, 'r')
+        try:
+            for line in jsonLinesFile:
+                if line.endswith('\n'):
+                    yield line[:-1]
+        finally:
+            jsonLinesFile.close()
+
     def _handleMainResult(self, theThreadLogFileList):
         """
         Handels the main result
@@ -1269,28 +1571,29 @@ class TaintDroidRunner:
                                    endTime), Utils.getTimeAsString(
                                    endTime)),
                 appList=[])
-            for appResult in self.resultVec:
-                appReport = AppReportEntry(id=appResult['id'],
-                                           appPackage=appResult['appPackage'],
-                                           appPath=appResult['appPath'],
-                                           appName=appResult['appName'],
-                                           logcatFile=appResult[
-                                               'logcatFileName'],
-                                           md5Hash=appResult['appMd5Hash'],
-                                           startTime='%s %s' % (Utils.getDateAsString(
-                                               appResult[
-                                                   'startTime']), Utils.getTimeAsString(appResult['startTime'])),
-                                           endTime='%s %s' % (Utils.getDateAsString(appResult['endTime']), Utils.getTimeAsString(appResult['endTime'])),
-                                           actionList = appResult['actionList'],
-                                           simulatorActions = appResult['simulatorActions'],
-                                           )
-                mainReport.appList.append(appReport)
+            if not self.jsonLinesFile is None:
+                self.jsonLinesFile.close()
+                self.jsonLinesFile = None
 
+            # Stream the app records of report.jsonl into the appList of
+            # report.json (same output as py2Json of the whole report)
             jsonFactory = JsonFactory()
-            jsonReportStr = jsonFactory.py2Json(mainReport)
+            jsonHeadStr, jsonTailStr = jsonFactory.py2Json(mainReport).split('"appList": []', 1)
             jsonFile = open(jsonFileName, "w")
-            jsonFile.write(jsonReportStr)
-            
+            try:
+                jsonFile.write(jsonHeadStr)
+                jsonFile.write('"appList": [')
+                for i, appReportStr in enumerate(self._iterJsonReport()):
+                    if i > 0:
+                        jsonFile.write(', ')
+                    jsonFile.write(appReportStr)
+                jsonFile.write(']')
+                jsonFile.write(jsonTailStr)
+            finally:
+                jsonFile.close()
+
+            # The final report reads the apps one at a time from report.jsonl
+            mainReport.appList = JsonReportAppList(self._iterJsonReport)
             self._genFinalReport(mainReport, finalFileName)
     
     def _genFinalReport(self, report, outfile):
@@ -1350,6 +1653,10 @@ def main():
         help='Set to true (1) if outputs should be logged in separate file.')
     parser.add_option('', '--maxLogcatSize', metavar='kBytes', default=4096,
                       help='Define the maximum logcat size in kBytes (logcat is ringbuffer), default is 4096kByes')
+    parser.add_option('', '--streamLogcat', action='store_true', default=False,
+                      help='Stream logcat to the host and parse it during the run instead of pulling it from the sdcard at the end.')
+    parser.add_option('', '--compressLogcat', metavar='<format>', default=None,
+                      help='Compress the stored logcat files after parsing them (%s)' % ', '.join(LogcatCompression.FORMAT_LIST))
 
     parser.add_option(
         '', '--sdkPath', metavar='<path>', help='Set path to Android SDK')
@@ -1358,12 +1665,22 @@ def main():
 
     parser.add_option('', '--runHeadless', action='store_true',
                       dest='headless', default=False, help='Run emulator without window.')
+    parser.add_option('', '--bootTimeout', metavar='<secs>', default=300,
+                      help='Maximum seconds to wait until the emulator is booted')
+    parser.add_option('', '--nativeAdb', action='store_true', default=False,
+                      help='Talk to the adb server (see --adbServer) directly instead of running the adb binary for every command.')
+    parser.add_option('', '--adbServer', metavar='<host:port>', default='localhost:5037',
+                      help='Set the address of the adb server (default: localhost:5037).')
+    parser.add_option('', '--reuseEmulator', action='store_true', default=False,
+                      help='Keep one emulator per thread running and reset it between apps instead of booting it for every app.')
 
     parser.add_option('', '--numMonkeyEvents', metavar='#', default='500',
                       help='Define number of monkey events to be executed (split into up to 5 separate runs).')
     parser.add_option(
         '', '--cleanUpImageDir', action='store_false', default=True,
         help='Set to false (0) if image dir should not be removed after run.')
+    parser.add_option('', '--imageStagingMode', metavar='<mode>', default='copy',
+                      help='Set how clean images are staged: copy (default) or link (hardlink read-only images, reflink/sparse-copy writable ones).')
     parser.add_option('', '--sleepTime', metavar='<secs>',
                       default='60', help='Set time to sleep during simulation.')
 
@@ -1399,12 +1716,29 @@ def main():
         tdroidRunner.storeLogInFile = options.storeLogInFile
 
     tdroidRunner.maxLogcatSize = int(options.maxLogcatSize)
+    tdroidRunner.streamLogcat = options.streamLogcat
+    if not options.compressLogcat is None:
+        if not options.compressLogcat in LogcatCompression.FORMAT_LIST or not isCompressionAvailable(options.compressLogcat):
+            raise ValueError('Logcat compression has to be one of the following available values: %s' % \
+                             [compression for compression in LogcatCompression.FORMAT_LIST if isCompressionAvailable(compression)])
+        tdroidRunner.logcatCompression = options.compressLogcat
 
     tdroidRunner.sdkPath = options.sdkPath
     tdroidRunner.avdName = options.avdName
     tdroidRunner.runHeadless = options.headless
+    tdroidRunner.reuseEmulator = options.reuseEmulator
+    tdroidRunner.bootTimeout = int(options.bootTimeout)
+    tdroidRunner.nativeAdb = options.nativeAdb
+    adbServer = options.adbServer.rsplit(':', 1)
+    if len(adbServer) != 2 or not adbServer[1].isdigit():
+        raise ValueError('Invalid adb server (<host:port>): %s' % options.adbServer)
+    tdroidRunner.adbServerHost = adbServer[0]
+    tdroidRunner.adbServerPort = int(adbServer[1])
     tdroidRunner.numMonkeyEvents = int(options.numMonkeyEvents)
     tdroidRunner.cleanUpImageDir = options.cleanUpImageDir
+    if not ImageStagingMode.isValidValue(options.imageStagingMode):
+        raise ValueError('Invalid image staging mode: %s' % options.imageStagingMode)
+    tdroidRunner.imageStagingMode = options.imageStagingMode
     tdroidRunner.sleepTime = int(options.sleepTime)
 
     tdroidRunner.startTime = datetime.datetime.now()
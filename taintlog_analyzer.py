@@ -18,9 +18,22 @@
 
 from optparse import OptionParser
 from taintlog_json import *
-from common import Logger, LogLevel
+from common import Logger, LogLevel, TaintLogActionEnum
+from logcat_compression import LogcatCompression, findLogcatFile, getCompression, iterLogcatLines, openLogcatFile
 
+import array
+import bisect
+import collections
+import json
+import marshal
+import mmap
+import multiprocessing
+import os
+import random
 import re
+import tempfile
+import time
+import weakref
 
 
 # ================================================================================
@@ -34,37 +47,355 @@ class TaintLogAnalyzerError(Exception):
         return repr(self.value)
 
 
+# ================================================================================
+# Stack Trace Automaton
+# ================================================================================
+class StackTraceAutomaton:
+    """
+    Aho-Corasick automaton over a list of substrings. search returns the
+    indices of all substrings contained in a text with one pass over it.
+    """
+    def __init__(self, theSubstringList):
+        self.substringList = list(theSubstringList)
+        self.gotoList = [{}]    # state -> {char: state}
+        self.failList = [0]     # state -> fallback state
+        self.outputList = [()]  # state -> substring indices ending here
+
+        # Trie
+        for index, substring in enumerate(self.substringList):
+            state = 0
+            for char in substring:
+                nextState = self.gotoList[state].get(char)
+                if nextState is None:
+                    nextState = len(self.gotoList)
+                    self.gotoList.append({})
+                    self.failList.append(0)
+                    self.outputList.append(())
+                    self.gotoList[state][char] = nextState
+                state = nextState
+            self.outputList[state] += (index,)
+
+        # Failure links (breadth first)
+        queue = list(self.gotoList[0].itervalues())
+        for state in queue:
+            for char, nextState in self.gotoList[state].iteritems():
+                queue.append(nextState)
+                failState = self.failList[state]
+                while failState != 0 and not char in self.gotoList[failState]:
+                    failState = self.failList[failState]
+                failState = self.gotoList[failState].get(char, 0)
+                if failState == nextState:
+                    failState = 0
+                self.failList[nextState] = failState
+                self.outputList[nextState] += self.outputList[failState]
+
+    def search(self, theText):
+        """
+        Returns the set of indices of the substrings found in theText.
+        """
+        gotoList = self.gotoList
+        failList = self.failList
+        outputList = self.outputList
+        matchSet = set()
+        state = 0
+        for char in theText:
+            nextState = gotoList[state].get(char)
+            while nextState is None and state != 0:
+                state = failList[state]
+                nextState = gotoList[state].get(char)
+            if nextState is None:
+                continue
+            state = nextState
+            if outputList[state]:
+                matchSet.update(outputList[state])
+        return matchSet
+
+
+# ================================================================================
+# Log Entry Encoding
+# ================================================================================
+def _encodeLogEntries(theLogEntryList):
+    """
+    Returns the log entries as dict of marshal-able values (used by the
+    cache files and the parse processes) or None if an entry has no slot
+    layout. Entries are tuples of the class index and their slot values,
+    stack traces are stored once and referenced by index.
+    """
+    classDict = {} # class -> index in classList
+    classList = []
+    stackTraceDict = {} # InternedStackTrace -> index in stackTraceList
+    stackTraceList = []
+    entryList = []
+    for logEntry in theLogEntryList:
+        entryClass = logEntry.__class__
+        classIndex = classDict.get(entryClass)
+        if classIndex is None:
+            if not issubclass(entryClass, BaseLogEntry) or hasattr(logEntry, '__dict__'):
+                return None
+            classIndex = len(classList)
+            classDict[entryClass] = classIndex
+            classList.append((entryClass.__name__, list(entryClass.__slots__)))
+        values = [classIndex]
+        for slot in entryClass.__slots__:
+            value = getattr(logEntry, slot)
+            if slot == 'stackTraceRef':
+                stackTraceIndex = stackTraceDict.get(value)
+                if stackTraceIndex is None:
+                    stackTraceIndex = len(stackTraceList)
+                    stackTraceDict[value] = stackTraceIndex
+                    stackTraceList.append(value.stackTraceStr)
+                value = stackTraceIndex
+            values.append(value)
+        entryList.append(tuple(values))
+    return {'classes': classList,
+            'stackTraces': stackTraceList,
+            'entries': entryList}
+
+def _decodeLogEntries(theEncodedDict):
+    """
+    Returns the log entries encoded by _encodeLogEntries or None if the
+    slot layout of an entry class changed meanwhile.
+    """
+    classList = []
+    for className, slotList in theEncodedDict['classes']:
+        entryClass = globals().get(className)
+        if not isinstance(entryClass, type) or not issubclass(entryClass, BaseLogEntry) or \
+               tuple(slotList) != entryClass.__slots__:
+            return None
+        classList.append((entryClass, slotList))
+    stackTraceRefList = [STACK_TRACE_TABLE.intern(stackTraceStr) for stackTraceStr in theEncodedDict['stackTraces']]
+
+    logEntryList = []
+    for values in theEncodedDict['entries']:
+        entryClass, slotList = classList[values[0]]
+        logEntry = entryClass.__new__(entryClass)
+        for slot, value in zip(slotList, values[1:]):
+            if slot == 'stackTraceRef':
+                value = stackTraceRefList[value]
+            setattr(logEntry, slot, value)
+        logEntryList.append(logEntry)
+    return logEntryList
+
+
+# ================================================================================
+# Log Entry Matcher
+# ================================================================================
+class LogEntryMatcher:
+    """
+    Patterns (log objects as passed to doesMatch) compiled once for matching
+    many log entries. Patterns are looked up by entry class, action lists
+    and tag lists are turned into sets and masks, and the stack trace
+    substrings of all patterns are searched with one automaton.
+    Entries of classes not listed in MATCH_FIELDS use their doesMatch.
+    """
+    # Entry class -> (checkActionFlag, checkTagFlag, [(field, wildcard value)])
+    # as checked by the doesMatch method of the class
+    MATCH_FIELDS = {CallActionLogEntry: (False, False, [('dialString', '')]),
+                    CipherUsageLogEntry: (True, True, []),
+                    FileSystemLogEntry: (True, True, [('filePath', '')]),
+                    NetworkSendLogEntry: (True, True, [('destination', ''), ('port', 0)]),
+                    SSLLogEntry: (True, True, [('destination', '')]),
+                    SendSmsLogEntry: (True, True, [('destination', '')])}
+
+    def __init__(self, thePatternList):
+        self.patternList = list(thePatternList)
+
+        # Stack trace substrings
+        substringList = []
+        substringDict = {}
+        self.stackTraceIdList = []
+        for pattern in self.patternList:
+            stackTraceStr = getattr(pattern, 'stackTraceStr', '')
+            if stackTraceStr == '' or stackTraceStr is None:
+                self.stackTraceIdList.append(None)
+            else:
+                if not stackTraceStr in substringDict:
+                    substringDict[stackTraceStr] = len(substringList)
+                    substringList.append(stackTraceStr)
+                self.stackTraceIdList.append(substringDict[stackTraceStr])
+        self.stackTraceAutomaton = StackTraceAutomaton(substringList)
+        self.stackTraceMatchDict = weakref.WeakKeyDictionary() # InternedStackTrace -> set of substring ids
+
+        self.candidateDict = {} # entry class -> [(pattern index, compiled checks...)]
+
+    def getMatchingPatterns(self, theLogEntry):
+        """
+        Returns all patterns matching theLogEntry (in pattern list order).
+        """
+        return [self.patternList[index] for index in self.__getMatchIndices(theLogEntry, False)]
+
+    def matches(self, theLogEntry):
+        """
+        Returns if theLogEntry matches one of the patterns.
+        """
+        return len(self.__getMatchIndices(theLogEntry, True)) > 0
+
+    def __getMatchIndices(self, theLogEntry, theFirstOnlyFlag):
+        """
+        Returns the indices of the patterns matching theLogEntry, only the
+        first one if theFirstOnlyFlag is set.
+        """
+        entryClass = theLogEntry.__class__
+        candidateList = self.candidateDict.get(entryClass)
+        if candidateList is None:
+            if not entryClass in self.MATCH_FIELDS:
+                indexList = []
+                for index, pattern in enumerate(self.patternList):
+                    if theLogEntry.doesMatch(pattern):
+                        indexList.append(index)
+                        if theFirstOnlyFlag:
+                            break
+                return indexList
+            candidateList = self.__compileCandidates(entryClass)
+
+        indexList = []
+        stackTraceMatchSet = None
+        for index, actionSet, tagNoneFlag, tagMask, fieldList, destTagNoneFlag, destTagMask, stackTraceId in candidateList:
+            if not actionSet is None and not theLogEntry.action in actionSet:
+                continue
+            if tagNoneFlag and theLogEntry.tag != 0:
+                continue
+            if not tagMask is None and not theLogEntry.tag & tagMask:
+                continue
+            fieldMatchFlag = True
+            for field, value in fieldList:
+                if getattr(theLogEntry, field) != value:
+                    fieldMatchFlag = False
+                    break
+            if not fieldMatchFlag:
+                continue
+            if destTagNoneFlag and theLogEntry.destinationTag != 0:
+                continue
+            if not destTagMask is None and not theLogEntry.destinationTag & destTagMask:
+                continue
+            if not stackTraceId is None:
+                if stackTraceMatchSet is None:
+                    stackTraceMatchSet = self.__searchStackTrace(theLogEntry.stackTraceRef)
+                if not stackTraceId in stackTraceMatchSet:
+                    continue
+            indexList.append(index)
+            if theFirstOnlyFlag:
+                break
+        return indexList
+
+    def __searchStackTrace(self, theStackTraceRef):
+        matchSet = self.stackTraceMatchDict.get(theStackTraceRef)
+        if matchSet is None:
+            matchSet = self.stackTraceAutomaton.search(theStackTraceRef.stackTraceStr)
+            self.stackTraceMatchDict[theStackTraceRef] = matchSet
+        return matchSet
+
+    def __compileCandidates(self, theEntryClass):
+        """
+        Compiles the patterns which can match entries of theEntryClass
+        (doesMatch requires the pattern to be an instance of the class).
+        """
+        checkActionFlag, checkTagFlag, matchFieldList = self.MATCH_FIELDS[theEntryClass]
+        candidateList = []
+        for index, pattern in enumerate(self.patternList):
+            if not isinstance(pattern, theEntryClass):
+                continue
+            actionSet = None
+            if checkActionFlag and len(getattr(pattern, 'actionList', [])) > 0:
+                actionSet = frozenset(pattern.actionList)
+            tagNoneFlag = False
+            tagMask = None
+            if checkTagFlag:
+                tagNoneFlag = (pattern.tag == -1)
+                tagMask = self.__getTagMask(pattern, 'tagList')
+            fieldList = []
+            for field, wildcard in matchFieldList:
+                value = getattr(pattern, field)
+                if value != wildcard:
+                    fieldList.append((field, value))
+            destTagNoneFlag = False
+            destTagMask = None
+            if theEntryClass is SendSmsLogEntry:
+                destTagNoneFlag = (pattern.destinationTag == -1)
+                destTagMask = self.__getTagMask(pattern, 'destinationTagList')
+            candidateList.append((index, actionSet, tagNoneFlag, tagMask, fieldList,
+                                  destTagNoneFlag, destTagMask, self.stackTraceIdList[index]))
+        self.candidateDict[theEntryClass] = candidateList
+        return candidateList
+
+    def __getTagMask(self, thePattern, theListName):
+        """
+        Returns the OR of the tags in the tag list of thePattern or None if
+        the list is not set (any tag of the list has to be set in the entry).
+        """
+        tagList = getattr(thePattern, theListName, [])
+        if len(tagList) == 0:
+            return None
+        tagMask = 0
+        for tag in tagList:
+            tagMask |= tag
+        return tagMask
+
+
 # ================================================================================
 # Log Analyzer
 # ================================================================================ 
 class TaintLogAnalyzer:
+    # Marker of the first line of a TaintLog entry
+    TAINTLOG_MARKER = 'TaintLog: ['
+    TAINTLOG_BEGIN_REGEX = 'W\([ 0-9]{5}:0x[0-9a-f]*\) TaintLog: \['
+    # numControlChars value for detecting the line end (\n, \r\n, \r\r\n) per line
+    DETECT_CONTROL_CHARS = None
+    # Limits of unfinished multi-line entries, larger or older ones are dropped
+    MAX_FRAGMENT_SIZE = 1024 * 1024 # chars of the JSON string
+    MAX_FRAGMENT_AGE = 1000 # entries begun since the last line of the fragment
+    FRAGMENT_SWEEP_INTERVAL = 256 # entries begun between checks for old fragments
+    # Cache file of the post-processed entries (<log file><LOG_CACHE_SUFFIX>),
+    # increase PARSER_VERSION if extraction or post-processing change their result
+    LOG_CACHE_SUFFIX = '.cache'
+    LOG_CACHE_MAGIC = 'TaintLogCache'
+    PARSER_VERSION = 2
+    # Smallest chunk of a log file parsed by one process
+    MIN_PARSE_CHUNK_SIZE = 4 * 1024 * 1024
+    # Chunks per process (smaller chunks balance the load)
+    NUM_PARSE_CHUNKS_PER_PROCESS = 4
+
     def __init__(self, theLogger=Logger()):
         self.log = theLogger
 
         self.jsonFactory = JsonFactory()
         
+        self.logFile = None
         self.logLines = []
         self.logEntryList = []
+        self.logEntryTypeDict = {} # class -> entries of logEntryList with this class
         self.json2pyFailedList = []
         self.json2pyFailedErrorList = []
 
-        self.numControlChars = 0
+        self.numControlChars = self.DETECT_CONTROL_CHARS
+        self.jsonStringDict = {} # pidTid -> [JSON string parts, length, clock] of unfinished entry
+        self.maxFragmentSize = self.MAX_FRAGMENT_SIZE
+        self.maxFragmentAge = self.MAX_FRAGMENT_AGE
+        self.fragmentClock = 0 # number of entries begun
+        self.numOversizedFragments = 0
+        self.numEvictedFragments = 0
+        self.tailOffset = None # offset in the log file read by tailLogEntries
+        self.tailFileId = None # (device, inode) of this file
 
     def setLogFile(self, theFile):
         """
-        Sets the log lines from the provided file
+        Sets the provided file as log, it is read by extractLogEntries.
+        If theFile does not exist, its compressed version (see
+        logcat_compression) is used.
         """
-        logFile = open(theFile, 'r')
-        for line in logFile:
-            self.logLines.append(line)
-        self.numControlChars = 1
+        self.logFile = findLogcatFile(theFile)
+        self.logLines = []
+        self.numControlChars = self.DETECT_CONTROL_CHARS
+        self.tailOffset = None
+        self.tailFileId = None
 
     def setLogString(self, theStr):
         """
         Sets the log lines from the provided string splitted by \r\n
         """
+        self.logFile = None
         self.logLines = theStr.split('\r\n')
-        self.numControlChars = 0
+        self.numControlChars = self.DETECT_CONTROL_CHARS
 
     def getLogEntryList(self, theType=None):
         """
@@ -74,12 +405,17 @@ class TaintLogAnalyzer:
         """
         if theType is None:
             return self.logEntryList
-        else:
-            logEntryList = []
-            for logEntry in self.logEntryList:
-                if isinstance(logEntry, theType):
-                    logEntryList.append(logEntry)
-            return logEntryList
+        typeList = self.__getIndexedTypes(theType)
+        if len(typeList) == 0:
+            return []
+        if len(typeList) == 1:
+            return list(self.logEntryTypeDict[typeList[0]])
+        # Several subclasses, keep the order of the log
+        logEntryList = []
+        for logEntry in self.logEntryList:
+            if isinstance(logEntry, theType):
+                logEntryList.append(logEntry)
+        return logEntryList
 
     def getNumLogEntries(self, theType=None):
         """
@@ -89,12 +425,37 @@ class TaintLogAnalyzer:
         """
         if theType is None:
             return len(self.logEntryList)
-        else:
-            num = 0
-            for logEntry in self.logEntryList:
-                if isinstance(logEntry, theType):
-                    num += 1
-            return num
+        num = 0
+        for entryType in self.__getIndexedTypes(theType):
+            num += len(self.logEntryTypeDict[entryType])
+        return num
+
+    def __getIndexedTypes(self, theType):
+        """
+        Returns the classes in the type index which are theType or a subclass.
+        """
+        return [entryType for entryType in self.logEntryTypeDict if issubclass(entryType, theType)]
+
+    def __addLogEntries(self, theLogEntries):
+        """
+        Appends the log entries to logEntryList and the type index.
+        """
+        logEntryTypeDict = self.logEntryTypeDict
+        for logEntry in theLogEntries:
+            self.logEntryList.append(logEntry)
+            entryType = logEntry.__class__
+            if entryType in logEntryTypeDict:
+                logEntryTypeDict[entryType].append(logEntry)
+            else:
+                logEntryTypeDict[entryType] = [logEntry]
+
+    def __setLogEntries(self, theLogEntryList):
+        """
+        Replaces the content of logEntryList (in place) and rebuilds the type index.
+        """
+        del self.logEntryList[:]
+        self.logEntryTypeDict = {}
+        self.__addLogEntries(theLogEntryList)
                 
     def getJson2PyFailedList(self):
         """
@@ -109,108 +470,593 @@ class TaintLogAnalyzer:
         be converted into LogEntries inclduing the error
         """
         return self.json2pyFailedErrorList
+
+    def getNumOversizedFragments(self):
+        """
+        Returns the number of unfinished multi-line entries dropped as
+        they exceeded maxFragmentSize.
+        """
+        return self.numOversizedFragments
+
+    def getNumEvictedFragments(self):
+        """
+        Returns the number of unfinished multi-line entries dropped as
+        they were not continued within maxFragmentAge entries or not
+        finished at the end of the log.
+        """
+        return self.numEvictedFragments
         
-    def extractLogEntries(self):
+    def extractLogEntries(self, theNumProcesses=1):
         """
         Extract JSON objects out of the log lines.
         setLogFile(<file>) or setLogString(<string>) need to be run before
+        A log file is parsed in chunks by theNumProcesses processes if it
+        is large enough (see __extractLogEntriesParallel). Compressed log
+        files are decompressed while reading.
         """
-        # Init regex
-        regexBegin = 'W\([ 0-9]{5}:0x[0-9a-f]*\) TaintLog: \['
-        #regexBegin = 'W/dalvikvm\([ 0-9]{5}\): TaintLog: \['
-        #regexGoOn = 'W/dalvikvm\([ 0-9]{5}\): '
-        
-        # Extract JSON strings
-        self.log.info('Extract JSON string lines')
-        jsonStringVec = []
+        self.log.info('Extract JSON objects')
+        self.beginLogLines(self.numControlChars)
+        if self.logFile is None:
+            self.__addLogEntries(self.iterLogEntries(self.logLines, self.numControlChars))
+        elif getCompression(self.logFile) != LogcatCompression.NONE:
+            logFile = openLogcatFile(self.logFile, 'rb')
+            try:
+                self.__addLogEntries(self.iterLogEntries(iterLogcatLines(logFile), self.numControlChars, False))
+            finally:
+                logFile.close()
+        elif theNumProcesses > 1 and os.path.getsize(self.logFile) >= 2 * self.MIN_PARSE_CHUNK_SIZE:
+            self.__extractLogEntriesParallel(theNumProcesses)
+        else:
+            logFile = open(self.logFile, 'r')
+            try:
+                self.__addLogEntries(self.iterLogEntries(logFile, self.numControlChars))
+            finally:
+                logFile.close()
 
+    def iterLogEntries(self, theFile, theNumControlChars=DETECT_CONTROL_CHARS, theMmapFlag=True):
+        """
+        Generator yielding the log objects of theFile (file object or any
+        other iterable of log lines) as they are found. Entries split over
+        several lines are reassembled per pid/tid, so only unfinished
+        entries are kept in memory. Failed conversions are added to the
+        JSON2Py failed lists.
+        Regular files are memory-mapped and only the TaintLog lines are
+        read (see __iterMappedTaintLogLines) unless theMmapFlag is False.
+        theNumControlChars is the number of control chars at the end of
+        each line, by default they are detected for each line.
+        """
         jsonStringDict = {}
-        for line in self.logLines:
-            # Extract PID and TID
-            startPidTidPos = line.find('(')
-            endPidTidPos = line.find(')')
-            pidTid = line[startPidTidPos+1:endPidTidPos]
+        logLines = None
+        if theMmapFlag:
+            logLines = self.__iterMappedTaintLogLines(theFile, jsonStringDict)
+        if logLines is None:
+            logLines = theFile
+        for line in logLines:
+            jsonString = self.__reassembleLogLine(line, jsonStringDict, theNumControlChars)
+            if not jsonString is None:
+                for logEntry in self.__json2Py(jsonString):
+                    yield logEntry
+        self.__evictFragments(jsonStringDict, 0)
 
-            #print 'line: "%s", pidTid: "%s"' % (line, pidTid)
-            
-            # Check for entry
-            if not jsonStringDict.has_key(pidTid):
-                regexMatch = re.match(regexBegin, line)
-                if not regexMatch is None:
-                    #print "FOUND regex"
-                    
-                    # Check for end in same line
-                    if line[len(line)-1] == ']' or line[len(line)-2] == ']' or line[len(line)-3] == ']':
-                        jsonString = line[regexMatch.end()-1:len(line)]
-                        jsonStringVec.append(jsonString)
-                        self.log.debug('Found JSON string: \'%s\'\n' % jsonString)
-                    else:
-                        jsonString = line[regexMatch.end()-1:len(line)-self.numControlChars] # remove control chars at the end
-                        jsonStringDict[pidTid] = jsonString
-
-            else: # pidTid found
-                regexGoOn = 'W\(%s\) ' % pidTid
-                #print 'regex: %s' % regexGoOn
-                regexMatch = re.match(regexGoOn, line)
-                if not regexMatch is None:
-                    partString = line[regexMatch.end():len(line)-self.numControlChars] # remove control chars at the end
-                    jsonStringDict[pidTid] += partString
-                    if line[len(line)-1] == ']' or line[len(line)-2] == ']' or line[len(line)-3] == ']':                        
-                        jsonStringVec.append(jsonStringDict[pidTid])                    
-                        self.log.debug('Found JSON string: \'%s\'\n' % jsonStringDict[pidTid])
-                        del jsonStringDict[pidTid]
+    def __extractLogEntriesParallel(self, theNumProcesses):
+        """
+        Parses the log file in chunks (split at line ends) with a pool of
+        theNumProcesses processes, see _parseLogChunk. The chunk results
+        are merged in file order: the entries still unfinished at the end
+        of the previous chunks are continued with the lines of their
+        pid/tid in the chunk and their entries are inserted at the position
+        of their last line. A chunk is parsed again in this process if such
+        a pid/tid begins a new entry in the chunk before its unfinished one
+        was completed (the chunk process did not know it as unfinished).
+        The result is the same as with a sequential parse.
+        """
+        logFile = open(self.logFile, 'r')
+        try:
+            buf = mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            logFile.close()
+        try:
+            # Chunks end after a line end
+            size = len(buf)
+            chunkSize = max(size / (theNumProcesses * self.NUM_PARSE_CHUNKS_PER_PROCESS), self.MIN_PARSE_CHUNK_SIZE)
+            chunkList = []
+            start = 0
+            while start < size:
+                end = buf.find('\n', min(start + chunkSize, size) - 1) + 1 or size
+                chunkList.append((self.logFile, start, end, self.numControlChars, self.maxFragmentSize, self.maxFragmentAge))
+                start = end
+            self.log.debug('Parse %d chunks with %d processes' % (len(chunkList), theNumProcesses))
+
+            pool = multiprocessing.Pool(theNumProcesses)
+            try:
+                for chunk, result in zip(chunkList, pool.imap(_parseLogChunkProcess, chunkList)):
+                    self.__mergeLogChunk(buf, chunk[1], chunk[2], result)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            buf.close()
+        self.__evictFragments(self.jsonStringDict, 0)
+
+    def __mergeLogChunk(self, theBuffer, theStart, theEnd, theResult):
+        """
+        Adds the result of _parseLogChunk for the chunk theStart-theEnd
+        after the entries of the previous chunks.
+        """
+        jsonStringDict = self.jsonStringDict
+        clockBase = self.fragmentClock
+        beginPosList = theResult['beginPositions']
+        savedState = (dict([(pidTid, [list(fragment[0]), fragment[1], fragment[2]]) for pidTid, fragment in jsonStringDict.iteritems()]),
+                      self.numOversizedFragments, self.numEvictedFragments)
+
+        # Continue the unfinished entries of the previous chunks
+        jsonStringList = [] # (position, JSON string)
+        for pidTid in jsonStringDict.keys():
+            pos = theStart
+            while jsonStringDict.has_key(pidTid):
+                lineStart = self.__findContinuation(theBuffer, pidTid, pos, theEnd)
+                if lineStart == -1:
+                    break
+                pos = theBuffer.find('\n', lineStart, theEnd) + 1 or theEnd
+                line = theBuffer[lineStart:pos]
+                self.fragmentClock = clockBase + bisect.bisect_left(beginPosList, lineStart)
+                if self.fragmentClock - jsonStringDict[pidTid][2] >= self.maxFragmentAge:
+                    # Dropped before this line, the chunk process parsed it right
+                    self.__evictFragment(jsonStringDict, pidTid)
+                    break
+                if not re.match(self.TAINTLOG_BEGIN_REGEX, line) is None:
+                    # Begin of an entry for the chunk process, a continuation in fact
+                    self.log.debug('Parse chunk at %d again, entry of %s continued' % (theStart, pidTid))
+                    jsonStringDict.clear()
+                    jsonStringDict.update(savedState[0])
+                    self.numOversizedFragments, self.numEvictedFragments = savedState[1:]
+                    self.fragmentClock = clockBase
+                    self.__reparseLogChunk(theStart, theEnd)
+                    return
+                jsonString = self.__reassembleLogLine(line, jsonStringDict, self.numControlChars)
+                if not jsonString is None:
+                    jsonStringList.append((lineStart, jsonString))
+
+        # Entries of the chunk and of the continued entries in file order
+        logEntryList = _decodeLogEntries(theResult)
+        entryPosList = theResult['entryPositions']
+        failedPosList = theResult['failedPositions']
+        failedList = theResult['json2pyFailed']
+        failedErrorList = theResult['json2pyFailedErrors']
+        jsonStringList.sort()
+        i = 0
+        j = 0
+        for pos, jsonString in jsonStringList + [(theEnd, None)]:
+            k = bisect.bisect_left(entryPosList, pos, i)
+            self.__addLogEntries(logEntryList[i:k])
+            i = k
+            k = bisect.bisect_left(failedPosList, pos, j)
+            self.json2pyFailedList.extend(failedList[j:k])
+            self.json2pyFailedErrorList.extend(failedErrorList[j:k])
+            j = k
+            if not jsonString is None:
+                self.__addLogEntries(self.__json2Py(jsonString))
+
+        # State at the end of the chunk
+        for pidTid, fragment in theResult['jsonStrings'].iteritems():
+            fragment[2] += clockBase
+            jsonStringDict[pidTid] = fragment
+        self.fragmentClock = clockBase + theResult['numBegins']
+        self.numOversizedFragments += theResult['numOversizedFragments']
+        self.numEvictedFragments += theResult['numEvictedFragments']
+
+    def __reparseLogChunk(self, theStart, theEnd):
+        logFile = open(self.logFile, 'r')
+        try:
+            buf = mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            logFile.close()
+        for line in self.__scanTaintLogLines(buf, theStart, self.jsonStringDict, theEnd):
+            jsonString = self.__reassembleLogLine(line, self.jsonStringDict, self.numControlChars)
+            if not jsonString is None:
+                self.__addLogEntries(self.__json2Py(jsonString))
+
+    def _parseLogChunk(self, theStart, theEnd):
+        """
+        Parses the lines theStart-theEnd of the log file as if no entry was
+        unfinished before theStart (run by the processes of
+        extractLogEntries). Returns the entries (see _encodeLogEntries)
+        with the position of their last line, the failed JSON strings with
+        their positions, the positions of the lines beginning an entry and
+        the entries left unfinished.
+        """
+        self.beginLogLines(self.numControlChars)
+        self.fragmentClock = 0
+        logEntryList = []
+        entryPosList = array.array('l')
+        failedPosList = []
+        beginPosList = array.array('l')
+        logFile = open(self.logFile, 'r')
+        try:
+            buf = mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            logFile.close()
+        for lineStart, line in self.__scanTaintLogLines(buf, theStart, self.jsonStringDict, theEnd, True):
+            clock = self.fragmentClock
+            jsonString = self.__reassembleLogLine(line, self.jsonStringDict, self.numControlChars)
+            if self.fragmentClock != clock:
+                beginPosList.append(lineStart)
+            if not jsonString is None:
+                numFailed = len(self.json2pyFailedList)
+                for logEntry in self.__json2Py(jsonString):
+                    logEntryList.append(logEntry)
+                    entryPosList.append(lineStart)
+                if len(self.json2pyFailedList) > numFailed:
+                    failedPosList.append(lineStart)
+
+        result = _encodeLogEntries(logEntryList)
+        result['entryPositions'] = entryPosList.tolist()
+        result['failedPositions'] = failedPosList
+        result['beginPositions'] = beginPosList.tolist()
+        result['json2pyFailed'] = self.json2pyFailedList
+        result['json2pyFailedErrors'] = self.json2pyFailedErrorList
+        result['jsonStrings'] = self.jsonStringDict
+        result['numBegins'] = self.fragmentClock
+        result['numOversizedFragments'] = self.numOversizedFragments
+        result['numEvictedFragments'] = self.numEvictedFragments
+        return result
+
+    def __iterMappedTaintLogLines(self, theFile, theJsonStringDict):
+        """
+        Returns a generator over the lines of theFile which can belong to a
+        TaintLog entry or None if theFile cannot be memory-mapped.
+        The map is scanned with find for the TaintLog marker and, for each
+        pid/tid with an unfinished entry in theJsonStringDict, for its next
+        'W(<pidTid>) ' line. All other lines are skipped without being
+        copied. Lines are yielded in file order, the consumer has to update
+        theJsonStringDict before requesting the next line.
+        """
+        try:
+            offset = theFile.tell()
+            buf = mmap.mmap(theFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, ValueError, EnvironmentError):
+            return None
+        return self.__scanTaintLogLines(buf, offset, theJsonStringDict)
+
+    def __scanTaintLogLines(self, theBuffer, theOffset, theJsonStringDict, theEnd=None, thePositionFlag=False):
+        """
+        Generator for __iterMappedTaintLogLines scanning theBuffer from
+        theOffset to theEnd (end of the buffer if None). Continuations of
+        the entries already unfinished in theJsonStringDict are found as
+        well. With thePositionFlag (line start, line) is yielded instead of
+        the line. theBuffer is closed when the scan is done.
+        """
+        buf = theBuffer
+        size = theEnd
+        if size is None:
+            size = len(buf)
+        marker = self.TAINTLOG_MARKER
+        try:
+            markerPos = buf.find(marker, theOffset, size)
+            markerLineStart = -1
+            if markerPos != -1:
+                markerLineStart = buf.rfind('\n', theOffset, markerPos) + 1 or theOffset
+            contPosDict = {} # pidTid -> start of next continuation line
+            for pidTid in theJsonStringDict.iterkeys():
+                contPosDict[pidTid] = self.__findContinuation(buf, pidTid, theOffset, size)
+            while True:
+                # Next line in file order
+                lineStart = markerLineStart
+                for contPos in contPosDict.itervalues():
+                    if contPos != -1 and (lineStart == -1 or contPos < lineStart):
+                        lineStart = contPos
+                if lineStart == -1:
+                    return
+                lineEnd = buf.find('\n', lineStart, size) + 1 or size
+
+                if thePositionFlag:
+                    yield (lineStart, buf[lineStart:lineEnd])
                 else:
-                    self.log.info('Warning: Do not find line match even though it was expected\n')
+                    yield buf[lineStart:lineEnd]
+
+                # Advance candidates consumed by this line
+                if markerLineStart != -1 and markerLineStart <= lineStart:
+                    markerPos = buf.find(marker, lineEnd, size)
+                    markerLineStart = -1
+                    if markerPos != -1:
+                        markerLineStart = buf.rfind('\n', lineEnd, markerPos) + 1 or lineEnd
+                for pidTid in contPosDict.keys():
+                    if not theJsonStringDict.has_key(pidTid):
+                        del contPosDict[pidTid]
+                    elif contPosDict[pidTid] != -1 and contPosDict[pidTid] <= lineStart:
+                        contPosDict[pidTid] = self.__findContinuation(buf, pidTid, lineEnd, size)
+                for pidTid in theJsonStringDict.iterkeys():
+                    if not contPosDict.has_key(pidTid):
+                        contPosDict[pidTid] = self.__findContinuation(buf, pidTid, lineEnd, size)
+        finally:
+            buf.close()
+
+    def __findContinuation(self, theBuffer, thePidTid, theStart, theEnd):
+        prefix = 'W(%s) ' % thePidTid
+        if theStart == 0:
+            # No line end before the first line
+            if theBuffer[0:len(prefix)] == prefix:
+                return 0
+            theStart = 1
+        pos = theBuffer.find('\n' + prefix, theStart - 1, theEnd)
+        if pos == -1:
+            return -1
+        return pos + 1
+
+    def tailLogEntries(self, theEndFlag=False):
+        """
+        Extracts the JSON objects out of the lines appended to the log file
+        since the last call, so a growing logcat can be analyzed while it is
+        written. The offset in the file and the unfinished entries are kept
+        between the calls. If the file was rotated (renamed to <file>.1,
+        <file>.2, ... like logcat -r and startLogcatStream do), the rest of
+        the old file and the files rotated after it are read first.
+        A last line without line end is left for the next call unless
+        theEndFlag is set, then the unfinished entries are dropped as well.
+        setLogFile(<file>) need to be run before, the first call resets the
+        extracted log objects. Returns the number of new log objects.
+        """
+        if self.logFile is None:
+            raise TaintLogAnalyzerError('Tail mode needs a log file')
+        if getCompression(self.logFile) != LogcatCompression.NONE:
+            raise TaintLogAnalyzerError('Tail mode needs an uncompressed log file')
+        if self.tailOffset is None:
+            self.beginLogLines(self.numControlChars)
+            self.tailOffset = 0
+        numLogEntries = len(self.logEntryList)
+
+        # Identify the opened file, the name may be rotated meanwhile
+        try:
+            logFile = open(self.logFile, 'r')
+        except IOError:
+            logFile = None # rotated and not yet recreated
+        try:
+            fileId = None
+            if not logFile is None:
+                fileStat = os.fstat(logFile.fileno())
+                fileId = (fileStat.st_dev, fileStat.st_ino)
 
-        # Extract JSON objects
+            if self.tailFileId is None or fileId != self.tailFileId:
+                # New file: read the rotated files not read yet oldest first,
+                # all of them if the stream was rotated before the first call
+                rotatedFileList = self.__getRotatedLogFiles()
+                startIndex = len(rotatedFileList) - 1
+                offset = 0
+                if not self.tailFileId is None:
+                    for i in xrange(len(rotatedFileList)):
+                        if rotatedFileList[i][1] == self.tailFileId:
+                            startIndex = i
+                            offset = self.tailOffset
+                            break
+                    else:
+                        self.log.error('Rotated log file of \'%s\' not found, continue with the newer files' % self.logFile)
+                for i in xrange(startIndex, -1, -1):
+                    rotatedFile, rotatedFileId = rotatedFileList[i]
+                    if rotatedFileId == fileId:
+                        break # the opened file was rotated meanwhile
+                    self.tailOffset = self.__tailRotatedLogFile(rotatedFile, offset)
+                    self.tailFileId = rotatedFileId
+                    offset = 0
+                if not logFile is None:
+                    self.tailOffset = 0
+                    self.tailFileId = fileId
+            elif not logFile is None and fileStat.st_size < self.tailOffset:
+                self.log.error('Log file \'%s\' was truncated, continue at its beginning' % self.logFile)
+                self.tailOffset = 0
+
+            if not logFile is None:
+                self.tailOffset = self.__tailLogFile(logFile, self.tailOffset, theEndFlag)
+        finally:
+            if not logFile is None:
+                logFile.close()
+        if theEndFlag:
+            self.__evictFragments(self.jsonStringDict, 0)
+        return len(self.logEntryList) - numLogEntries
+
+    def __getRotatedLogFiles(self):
+        """
+        Returns the list of (file, (device, inode)) of the existing rotated
+        log files, most recent first.
+        """
+        rotatedFileList = []
+        while True:
+            rotatedFile = '%s.%d' % (self.logFile, len(rotatedFileList) + 1)
+            try:
+                fileStat = os.stat(rotatedFile)
+            except OSError:
+                return rotatedFileList
+            rotatedFileList.append((rotatedFile, (fileStat.st_dev, fileStat.st_ino)))
+
+    def __tailRotatedLogFile(self, theFile, theOffset):
+        logFile = open(theFile, 'r')
+        try:
+            return self.__tailLogFile(logFile, theOffset, True)
+        finally:
+            logFile.close()
+
+    def __tailLogFile(self, theLogFile, theOffset, theEndFlag):
+        """
+        Adds the lines of the opened theLogFile from theOffset on to the
+        unfinished entries of jsonStringDict (see addLogLine). Returns the
+        offset after the last line read.
+        """
+        try:
+            buf = mmap.mmap(theLogFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError, EnvironmentError):
+            buf = None # empty or cannot be memory-mapped
+        if buf is None:
+            theLogFile.seek(theOffset)
+            offset = theOffset
+            for line in iter(theLogFile.readline, ''):
+                if not theEndFlag and not line.endswith('\n'):
+                    break
+                self.addLogLine(line)
+                offset += len(line)
+            return offset
+
+        end = len(buf)
+        if not theEndFlag:
+            end = buf.rfind('\n', theOffset) + 1 or theOffset
+        for line in self.__scanTaintLogLines(buf, theOffset, self.jsonStringDict, end):
+            self.addLogLine(line)
+        return end
+
+    def beginLogLines(self, theNumControlChars=DETECT_CONTROL_CHARS):
+        """
+        Resets the extracted log objects for feeding lines with addLogLine.
+        theNumControlChars is the number of control chars at the end of
+        each line, by default they are detected for each line.
+        """
         self.logEntryList = []
+        self.logEntryTypeDict = {}
         self.json2pyFailedList = []
         self.json2pyFailedErrorList = []
-        self.log.info('Extract JSON objects')
-        for jsonString in jsonStringVec:
-            self.log.dev(jsonString)
-            try:
-                self.logEntryList.extend(self.jsonFactory.json2Py(jsonString))
-            except Exception, ex:
-                import traceback
-                traceback.print_exc()
-                self.json2pyFailedList.append(jsonString)
-                errMsg = 'Conversion for JSON string \'%s\' failed: %s.' % (jsonString, str(ex))
-                self.log.error(errMsg)
-                self.json2pyFailedErrorList.append(errMsg)
+        self.numControlChars = theNumControlChars
+        self.jsonStringDict = {}
+        self.numOversizedFragments = 0
+        self.numEvictedFragments = 0
+
+    def addLogLine(self, theLine):
+        """
+        Extracts the JSON objects out of one log line. Entries split over
+        several lines are converted as soon as their last line was added.
+        beginLogLines needs to be run before.
+        """
+        jsonString = self.__reassembleLogLine(theLine, self.jsonStringDict, self.numControlChars)
+        if not jsonString is None:
+            self.__addLogEntries(self.__json2Py(jsonString))
+
+    def __reassembleLogLine(self, theLine, theJsonStringDict, theNumControlChars):
+        """
+        Adds one log line to the unfinished JSON strings in theJsonStringDict
+        (pidTid -> [JSON string parts, length, clock]). Returns the JSON
+        string if the line completed one, otherwise None.
+        Fragments exceeding maxFragmentSize or not continued within
+        maxFragmentAge entries begun are dropped.
+        """
+        # Init regex
+        regexBegin = self.TAINTLOG_BEGIN_REGEX
+        #regexBegin = 'W/dalvikvm\([ 0-9]{5}\): TaintLog: \['
+        #regexGoOn = 'W/dalvikvm\([ 0-9]{5}\): '
+
+        line = theLine
+        jsonStringDict = theJsonStringDict
+
+        # Number of control chars and entry end
+        if theNumControlChars is self.DETECT_CONTROL_CHARS:
+            numControlChars = len(line) - len(line.rstrip('\r\n'))
+            endFlag = line[len(line)-numControlChars-1:len(line)-numControlChars] == ']'
+        else:
+            numControlChars = theNumControlChars
+            endFlag = line[len(line)-1] == ']' or line[len(line)-2] == ']' or line[len(line)-3] == ']'
+
+        # Extract PID and TID
+        startPidTidPos = line.find('(')
+        endPidTidPos = line.find(')')
+        pidTid = line[startPidTidPos+1:endPidTidPos]
+
+        #print 'line: "%s", pidTid: "%s"' % (line, pidTid)
+
+        # Drop an unfinished entry not continued in time, independent of
+        # when the fragments were swept last
+        fragment = jsonStringDict.get(pidTid)
+        if not fragment is None and self.fragmentClock - fragment[2] >= self.maxFragmentAge:
+            self.__evictFragment(jsonStringDict, pidTid)
+            fragment = None
+
+        # Check for entry
+        if fragment is None:
+            regexMatch = re.match(regexBegin, line)
+            if not regexMatch is None:
+                #print "FOUND regex"
+                self.fragmentClock += 1
+                if self.fragmentClock % self.FRAGMENT_SWEEP_INTERVAL == 0:
+                    self.__evictFragments(jsonStringDict, self.maxFragmentAge)
+
+                # Check for end in same line
+                if endFlag:
+                    jsonString = line[regexMatch.end()-1:len(line)]
+                    self.log.debug('Found JSON string: \'%s\'\n' % jsonString)
+                    return jsonString
+                else:
+                    jsonString = line[regexMatch.end()-1:len(line)-numControlChars] # remove control chars at the end
+                    jsonStringDict[pidTid] = [[jsonString], len(jsonString), self.fragmentClock]
+
+        else: # pidTid found
+            regexGoOn = 'W\(%s\) ' % pidTid
+            #print 'regex: %s' % regexGoOn
+            regexMatch = re.match(regexGoOn, line)
+            if not regexMatch is None:
+                partString = line[regexMatch.end():len(line)-numControlChars] # remove control chars at the end
+                fragment[1] += len(partString)
+                if fragment[1] > self.maxFragmentSize:
+                    del jsonStringDict[pidTid]
+                    self.numOversizedFragments += 1
+                    self.log.info('Warning: Drop unfinished entry of %s exceeding %d chars\n' % (pidTid, self.maxFragmentSize))
+                    return None
+                fragment[0].append(partString)
+                fragment[2] = self.fragmentClock
+                if endFlag:
+                    del jsonStringDict[pidTid]
+                    jsonString = ''.join(fragment[0])
+                    self.log.debug('Found JSON string: \'%s\'\n' % jsonString)
+                    return jsonString
+            else:
+                self.log.info('Warning: Do not find line match even though it was expected\n')
+        return None
+
+    def __evictFragments(self, theJsonStringDict, theMaxAge):
+        """
+        Drops the fragments of theJsonStringDict not continued within the
+        last theMaxAge entries begun (all for 0).
+        """
+        for pidTid, fragment in theJsonStringDict.items():
+            if self.fragmentClock - fragment[2] >= theMaxAge:
+                self.__evictFragment(theJsonStringDict, pidTid)
+
+    def __evictFragment(self, theJsonStringDict, thePidTid):
+        fragment = theJsonStringDict.pop(thePidTid)
+        self.numEvictedFragments += 1
+        self.log.info('Warning: Drop unfinished entry of %s (%d chars)\n' % (thePidTid, fragment[1]))
+
+    def __json2Py(self, theJsonString):
+        """
+        Converts a complete JSON string into a list of log objects.
+        """
+        self.log.dev(theJsonString)
+        try:
+            return self.jsonFactory.json2Py(theJsonString)
+        except Exception, ex:
+            import traceback
+            traceback.print_exc()
+            self.json2pyFailedList.append(theJsonString)
+            errMsg = 'Conversion for JSON string \'%s\' failed: %s.' % (theJsonString, str(ex))
+            self.log.error(errMsg)
+            self.json2pyFailedErrorList.append(errMsg)
+            return []
 
     def postProcessLogObjects(self, theDeleteStaleObjectsFlag=True):
         """
         CleanUp log objects:
-        - Generate stack trace vector
         - Set file path for OSFileAccess
+        Stack trace vectors are split once per distinct stack trace by
+        STACK_TRACE_TABLE.
+        The payloads of merged fragments are collected as chunks and joined
+        once at the end.
         """
-        cipherUsageDict = {}
-        netUsageDict = {}
-        fileSystemUsageDict = {}
+        cipherUsageDict = {} # id -> [entry, indices, input chunks, output chunks]
+        netUsageDict = {} # taintLogId -> [entry, indices, data chunks]
+        fileSystemUsageDict = {} # taintLogId -> [entry, indices, data chunks]
         
-        filteredLogEntryList = []
-        logEntryIndex = 0
-        for logEntry in self.logEntryList:
-            # Stack trace vec
-            if isinstance(logEntry, CallActionLogEntry) or \
-               isinstance(logEntry, CipherUsageLogEntry) or \
-               isinstance(logEntry, ErrorLogEntry) or \
-               isinstance(logEntry, FileSystemLogEntry) or \
-               isinstance(logEntry, NetworkSendLogEntry) or \
-               isinstance(logEntry, SSLLogEntry) or \
-               isinstance(logEntry, SendSmsLogEntry):
-                stackTrace = logEntry.stackTraceStr.split('||')
-                logEntry.stackTrace = stackTrace[:len(stackTrace)-1]
-
+        for logEntryIndex, logEntry in enumerate(self.logEntryList):
             # Cipher cleaning (combine inputs and outputs)
             if isinstance(logEntry, CipherUsageLogEntry):
                 if logEntry.action == CipherActionEnum.INIT_ACTION:
                     if cipherUsageDict.has_key(logEntry.id):
-                        cipherUsageDict[logEntry.id][0].tag = TaintTagEnum.appendTaintTags(cipherUsageDict[logEntry.id][0].tag, logEntry.tag)
-                        cipherUsageDict[logEntry.id][0].input = logEntry.input + cipherUsageDict[logEntry.id][0].input
-                        cipherUsageDict[logEntry.id][0].output = logEntry.output + cipherUsageDict[logEntry.id][0].output
-                        cipherUsageDict[logEntry.id][1].append(logEntryIndex)               
+                        cipherUsageDict[logEntry.id][0].tag |= logEntry.tag
+                        cipherUsageDict[logEntry.id][2].appendleft(logEntry.input)
+                        cipherUsageDict[logEntry.id][3].appendleft(logEntry.output)
+                        cipherUsageDict[logEntry.id][1].append(logEntryIndex)
                     else:
                         cipherUsageLogEntry = CipherUsageLogEntry(action=CipherActionEnum.CLEANED,
                                                                   id=logEntry.id,
@@ -219,15 +1065,15 @@ class TaintLogAnalyzer:
                                                                   input='',
                                                                   output='',
                                                                   stackTraceStr=logEntry.stackTraceStr,
-                                                                  stackTrace=logEntry.stackTrace,
                                                                   timestamp=logEntry.timestamp)
-                        cipherUsageDict[logEntry.id] = [cipherUsageLogEntry, [logEntryIndex]]
+                        cipherUsageDict[logEntry.id] = [cipherUsageLogEntry, [logEntryIndex],
+                                                         collections.deque(), collections.deque()]
                         
                 else: # logEntry.action != CipherActionEnum.INIT_ACTION
                     if cipherUsageDict.has_key(logEntry.id):
-                        cipherUsageDict[logEntry.id][0].tag = TaintTagEnum.appendTaintTags(cipherUsageDict[logEntry.id][0].tag, logEntry.tag)
-                        cipherUsageDict[logEntry.id][0].input += logEntry.input
-                        cipherUsageDict[logEntry.id][0].output += logEntry.output
+                        cipherUsageDict[logEntry.id][0].tag |= logEntry.tag
+                        cipherUsageDict[logEntry.id][2].append(logEntry.input)
+                        cipherUsageDict[logEntry.id][3].append(logEntry.output)
                         cipherUsageDict[logEntry.id][1].append(logEntryIndex)
                         
                     else:
@@ -238,17 +1084,17 @@ class TaintLogAnalyzer:
                                                                   input='',
                                                                   output='',
                                                                   stackTraceStr=logEntry.stackTraceStr,
-                                                                  stackTrace=logEntry.stackTrace,
                                                                   timestamp=logEntry.timestamp)
-                        cipherUsageDict[logEntry.id] = [cipherUsageLogEntry, [logEntryIndex]]
+                        cipherUsageDict[logEntry.id] = [cipherUsageLogEntry, [logEntryIndex],
+                                                         collections.deque(), collections.deque()]
                         self.log.info("CipherUsageLogEntry with action '%s' found without starting init" % logEntry.action)
 
             # Network cleaning (combine multiple calls)
             if isinstance(logEntry, NetworkSendLogEntry):
                 if logEntry.taintLogId == 0: continue
                 if netUsageDict.has_key(logEntry.taintLogId):
-                    netUsageDict[logEntry.taintLogId][0].tag = TaintTagEnum.appendTaintTags(netUsageDict[logEntry.taintLogId][0].tag, logEntry.tag)
-                    netUsageDict[logEntry.taintLogId][0].data = netUsageDict[logEntry.taintLogId][0].data + logEntry.data
+                    netUsageDict[logEntry.taintLogId][0].tag |= logEntry.tag
+                    netUsageDict[logEntry.taintLogId][2].append(logEntry.data)
                     netUsageDict[logEntry.taintLogId][1].append(logEntryIndex)
                     
                 else:
@@ -259,32 +1105,36 @@ class TaintLogAnalyzer:
                                                           taintLogId=logEntry.taintLogId,
                                                           data=logEntry.data,
                                                           stackTraceStr=logEntry.stackTraceStr,
-                                                          stackTrace=logEntry.stackTrace,
                                                           timestamp=logEntry.timestamp)
-                    netUsageDict[logEntry.taintLogId] = [netSendLogEntry, [logEntryIndex]]
+                    netUsageDict[logEntry.taintLogId] = [netSendLogEntry, [logEntryIndex], [logEntry.data]]
 
             # File system cleaning (combine multiple calls)
             if isinstance(logEntry, FileSystemLogEntry):
                 if logEntry.taintLogId == 0: continue
                 if fileSystemUsageDict.has_key(logEntry.taintLogId):
-                    fileSystemUsageDict[logEntry.taintLogId][0].tag = TaintTagEnum.appendTaintTags(fileSystemUsageDict[logEntry.taintLogId][0].tag, logEntry.tag)
-                    fileSystemUsageDict[logEntry.taintLogId][0].data = fileSystemUsageDict[logEntry.taintLogId][0].data + logEntry.data
+                    fileSystemUsageDict[logEntry.taintLogId][0].tag |= logEntry.tag
+                    fileSystemUsageDict[logEntry.taintLogId][2].append(logEntry.data)
                     fileSystemUsageDict[logEntry.taintLogId][1].append(logEntryIndex)
                     
                 else:
-                    fileSystemLogEntry = NetworkSendLogEntry(action=logEntry.action,
-                                                             tag=logEntry.tag,
-                                                             fileDescriptor=logEntry.fileDescriptor,
-                                                             filePath=logEntry.filePath,
-                                                             taintLogId=logEntry.taintLogId,
-                                                             data=logEntry.data,
-                                                             stackTraceStr=logEntry.stackTraceStr,
-                                                             stackTrace=logEntry.stackTrace,
-                                                             timestamp=logEntry.timestamp)
-                    fileSystemUsageDict[logEntry.taintLogId] = [fileSystemLogEntry, [logEntryIndex]]
-                
-            # Update index
-            logEntryIndex += 1
+                    fileSystemLogEntry = FileSystemLogEntry(action=logEntry.action,
+                                                            tag=logEntry.tag,
+                                                            fileDescriptor=logEntry.fileDescriptor,
+                                                            filePath=logEntry.filePath,
+                                                            taintLogId=logEntry.taintLogId,
+                                                            data=logEntry.data,
+                                                            stackTraceStr=logEntry.stackTraceStr,
+                                                            timestamp=logEntry.timestamp)
+                    fileSystemUsageDict[logEntry.taintLogId] = [fileSystemLogEntry, [logEntryIndex], [logEntry.data]]
+
+        # Join payload chunks
+        for logEntry in cipherUsageDict.itervalues():
+            logEntry[0].input = ''.join(logEntry[2])
+            logEntry[0].output = ''.join(logEntry[3])
+        for logEntry in netUsageDict.itervalues():
+            logEntry[0].data = ''.join(logEntry[2])
+        for logEntry in fileSystemUsageDict.itervalues():
+            logEntry[0].data = ''.join(logEntry[2])
 
         # Delete stale objects
         if theDeleteStaleObjectsFlag:
@@ -308,68 +1158,136 @@ class TaintLogAnalyzer:
             
 
         # Add cleaned cipher usage objects
-        for id, logEntry in cipherUsageDict.iteritems():
-            self.logEntryList.append(logEntry[0])
+        self.__addLogEntries([logEntry[0] for logEntry in cipherUsageDict.itervalues()])
 
         # Add cleaned network objects
-        for id, logEntry in netUsageDict.iteritems():
-            self.logEntryList.append(logEntry[0])
+        self.__addLogEntries([logEntry[0] for logEntry in netUsageDict.itervalues()])
 
         # Add cleaned file system objects
-        for id, logEntry in fileSystemUsageDict.iteritems():
-            self.logEntryList.append(logEntry[0])
+        self.__addLogEntries([logEntry[0] for logEntry in fileSystemUsageDict.itervalues()])
             
 
     def __deleteStaleLogObjects(self, theDelLogEntryIdxList):
         """
         Delete all log entries whose indices are included in the provided
-        delete log entry index list.
+        delete log entry index list (single pass, the list is updated in place).
         """
-        theDelLogEntryIdxList.sort()
-        for i in xrange(len(theDelLogEntryIdxList)):
-            del self.logEntryList[theDelLogEntryIdxList[i] - i]
-            
+        if len(theDelLogEntryIdxList) == 0:
+            return
+        delLogEntryIdxSet = set(theDelLogEntryIdxList)
+        self.__setLogEntries([logEntry for logEntryIndex, logEntry in enumerate(self.logEntryList)
+                              if not logEntryIndex in delLogEntryIdxSet])
 
     def filterLogObjects(self, theFilterList):
         """
         Remove entries which match to one of the provided patterns.
+        theFilterList can be a list of patterns or a LogEntryMatcher.
         """
-        delLogEntryIdxList = []
-        logEntryIndex = 0
-        for logEntry in self.logEntryList:
-            if self.__matches(logEntry, theFilterList):
-                delLogEntryIdxList.append(logEntryIndex)
-            logEntryIndex += 1
-        self.__deleteStaleLogObjects(delLogEntryIdxList)
-        
-    def __matches(self, theLogObject, thePatternList):
+        matcher = self.__getMatcher(theFilterList)
+        self.__setLogEntries([logEntry for logEntry in self.logEntryList
+                              if not matcher.matches(logEntry)])
+
+    def __getMatcher(self, thePatternList):
         """
-        Returns if log object should be filtered.
+        Returns the LogEntryMatcher for the provided patterns.
         """
-        for pattern in thePatternList:
-            if theLogObject.doesMatch(pattern):
-                return True
+        if isinstance(thePatternList, LogEntryMatcher):
+            return thePatternList
+        return LogEntryMatcher(thePatternList)
 
     def getMatchingLogEntries(self, thePatternList):
         """
         Returns a list of log entries matching with one of the provided patterns
         """
-        logEntryList = []
-        for logEntry in self.logEntryList:
-            if self.__matches(logEntry, thePatternList):
-                logEntryList.append(logEntry)
-        return logEntryList
+        matcher = self.__getMatcher(thePatternList)
+        return [logEntry for logEntry in self.logEntryList if matcher.matches(logEntry)]
 
     def doesMatch(self, thePatternList):
         """
         Returns if there are any log entries matching to one of the provided
         patterns.
         """
+        matcher = self.__getMatcher(thePatternList)
         for logEntry in self.logEntryList:
-            if self.__matches(logEntry, thePatternList):
+            if matcher.matches(logEntry):
                 return True
         return False
         
+    def loadLogCache(self):
+        """
+        Loads the post-processed log objects of the log file from its cache
+        file written by storeLogCache, instead of extractLogEntries and
+        postProcessLogObjects. Returns False if there is no cache file or if
+        it is outdated (size or mtime of the log file, PARSER_VERSION or
+        the field layout of the log entries changed).
+        setLogFile(<file>) needs to be run before.
+        """
+        if self.logFile is None:
+            return False
+        try:
+            fileStat = os.stat(self.logFile)
+            cacheFile = open(self.logFile + self.LOG_CACHE_SUFFIX, 'rb')
+        except (IOError, OSError):
+            return False
+        try:
+            try:
+                header = marshal.load(cacheFile)
+                if header != (self.LOG_CACHE_MAGIC, self.PARSER_VERSION, fileStat.st_size, fileStat.st_mtime):
+                    return False
+                cache = marshal.load(cacheFile)
+            except (EOFError, ValueError, TypeError):
+                self.log.error('Cache file of \'%s\' is damaged' % self.logFile)
+                return False
+        finally:
+            cacheFile.close()
+
+        logEntryList = _decodeLogEntries(cache)
+        if logEntryList is None:
+            return False
+        self.beginLogLines(self.numControlChars)
+        self.__setLogEntries(logEntryList)
+        self.json2pyFailedList = cache['json2pyFailed']
+        self.json2pyFailedErrorList = cache['json2pyFailedErrors']
+        self.numOversizedFragments = cache['numOversizedFragments']
+        self.numEvictedFragments = cache['numEvictedFragments']
+        return True
+
+    def storeLogCache(self):
+        """
+        Writes the log objects to the cache file of the log file (see
+        loadLogCache), to be run after postProcessLogObjects. Returns False
+        if the cache file could not be written.
+        """
+        if self.logFile is None:
+            return False
+        cache = _encodeLogEntries(self.logEntryList)
+        if cache is None:
+            self.log.error('Log entries of \'%s\' cannot be cached' % self.logFile)
+            return False
+        cache['json2pyFailed'] = self.json2pyFailedList
+        cache['json2pyFailedErrors'] = self.json2pyFailedErrorList
+        cache['numOversizedFragments'] = self.numOversizedFragments
+        cache['numEvictedFragments'] = self.numEvictedFragments
+
+        # Write to a temporary file and rename, readers never see a partial cache
+        cacheFileName = self.logFile + self.LOG_CACHE_SUFFIX
+        tmpFileName = '%s.%d' % (cacheFileName, os.getpid())
+        try:
+            fileStat = os.stat(self.logFile)
+            cacheFile = open(tmpFileName, 'wb')
+            try:
+                marshal.dump((self.LOG_CACHE_MAGIC, self.PARSER_VERSION, fileStat.st_size, fileStat.st_mtime), cacheFile)
+                marshal.dump(cache, cacheFile)
+            finally:
+                cacheFile.close()
+            os.rename(tmpFileName, cacheFileName)
+        except (IOError, OSError, ValueError), err:
+            self.log.error('Failed to write cache file of \'%s\': %s' % (self.logFile, str(err)))
+            if os.path.exists(tmpFileName):
+                os.remove(tmpFileName)
+            return False
+        return True
+
     def printOverview(self):
         """
         Print overview.
@@ -379,6 +1297,173 @@ class TaintLogAnalyzer:
             self.log.write(logEntry.getOverviewLogStr())
 
 
+# ================================================================================
+# Parse Processes
+# ================================================================================
+def _parseLogChunkProcess(theArgs):
+    """
+    Parses one chunk of a log file in a process of extractLogEntries.
+    """
+    (logFile, start, end, numControlChars, maxFragmentSize, maxFragmentAge) = theArgs
+    logAnalyzer = TaintLogAnalyzer(theLogger=Logger(theLevel=LogLevel.ERROR))
+    logAnalyzer.setLogFile(logFile)
+    logAnalyzer.numControlChars = numControlChars
+    logAnalyzer.maxFragmentSize = maxFragmentSize
+    logAnalyzer.maxFragmentAge = maxFragmentAge
+    return logAnalyzer._parseLogChunk(start, end)
+
+
+# ================================================================================
+# Benchmark
+# ================================================================================
+def _generateLogFile(theFile, theNumEntries, theSeed=0, theLineWidth=180):
+    """
+    Writes a synthetic log with theNumEntries TaintLog entries to theFile:
+    call actions and cipher, file system and network fragments which are
+    merged by postProcessLogObjects. Entries longer than theLineWidth are
+    continued in further lines, other log lines are mixed in.
+    """
+    rand = random.Random(theSeed)
+    logFile = open(theFile, 'w')
+    try:
+        for i in xrange(theNumEntries):
+            kind = rand.randint(0, 3)
+            stackTraceStr = ''.join(['com.app.C%d.m%d()||' % (rand.randint(0, 50), j) for j in xrange(rand.randint(1, 6))])
+            tag = '0x%x' % (1 << rand.randint(0, 14))
+            if kind == 0:
+                entryDict = {'__CallActionLogEntry__': True, 'tag': tag, 'dialString': str(rand.randint(0, 999))}
+            elif kind == 1:
+                entryDict = {'__CipherUsageLogEntry__': True, 'tag': tag, 'id': rand.randint(0, 10),
+                             'action': rand.choice([CipherActionEnum.INIT_ACTION, CipherActionEnum.UPDATE_ACTION, CipherActionEnum.DO_FINAL_ACTION]),
+                             'mode': CipherModeEnum.ENCRYPT_MODE, 'input': 'i' * rand.randint(0, 50), 'output': 'o' * rand.randint(0, 50)}
+            elif kind == 2:
+                entryDict = {'__FileSystemLogEntry__': True, 'tag': tag, 'action': TaintLogActionEnum.FS_WRITE_ACTION,
+                             'fileDescriptor': 3, 'taintLogId': rand.randint(0, 20), 'data': 'f' * rand.randint(1, 300)}
+            else:
+                entryDict = {'__NetworkSendLogEntry__': True, 'tag': tag, 'action': TaintLogActionEnum.NET_SEND_ACTION,
+                             'destination': '10.0.0.%d' % rand.randint(0, 9), 'port': 80,
+                             'taintLogId': rand.randint(0, 20), 'data': 'n' * rand.randint(1, 300)}
+            entryDict['stackTraceStr'] = stackTraceStr
+            entryDict['timestamp'] = 't%d' % i
+            jsonString = json.dumps([entryDict])
+
+            pidTid = '%5d:0x%x' % (rand.randint(100, 130), rand.randint(1, 3))
+            if rand.random() < 0.3:
+                logFile.write('I(%s) ActivityManager: line %d\n' % (pidTid, i))
+            logFile.write('W(%s) TaintLog: %s\n' % (pidTid, jsonString[:theLineWidth]))
+            for start in xrange(theLineWidth, len(jsonString), theLineWidth):
+                logFile.write('W(%s) %s\n' % (pidTid, jsonString[start:start+theLineWidth]))
+    finally:
+        logFile.close()
+
+def _legacyExtract(theLogAnalyzer, theFile, theNumControlChars=1):
+    """
+    Generator yielding the log objects of theFile with the line loop of
+    the original extractLogEntries (a regex match per line, the regex of
+    continued entries built per line), only used by benchmark as baseline.
+    """
+    regexBegin = 'W\([ 0-9]{5}:0x[0-9a-f]*\) TaintLog: \['
+    jsonStringDict = {}
+    for line in theFile:
+        # Extract PID and TID
+        startPidTidPos = line.find('(')
+        endPidTidPos = line.find(')')
+        pidTid = line[startPidTidPos+1:endPidTidPos]
+
+        jsonString = None
+        if not jsonStringDict.has_key(pidTid):
+            regexMatch = re.match(regexBegin, line)
+            if not regexMatch is None:
+                if line[len(line)-1] == ']' or line[len(line)-2] == ']' or line[len(line)-3] == ']':
+                    jsonString = line[regexMatch.end()-1:len(line)]
+                else:
+                    jsonStringDict[pidTid] = line[regexMatch.end()-1:len(line)-theNumControlChars]
+        else:
+            regexGoOn = 'W\(%s\) ' % pidTid
+            regexMatch = re.match(regexGoOn, line)
+            if not regexMatch is None:
+                jsonStringDict[pidTid] += line[regexMatch.end():len(line)-theNumControlChars]
+                if line[len(line)-1] == ']' or line[len(line)-2] == ']' or line[len(line)-3] == ']':
+                    jsonString = jsonStringDict.pop(pidTid)
+            else:
+                theLogAnalyzer.log.info('Warning: Do not find line match even though it was expected\n')
+
+        if not jsonString is None:
+            theLogAnalyzer.log.debug('Found JSON string: \'%s\'\n' % jsonString)
+            try:
+                for logEntry in theLogAnalyzer.jsonFactory.json2Py(jsonString):
+                    yield logEntry
+            except Exception, ex:
+                theLogAnalyzer.json2pyFailedList.append(jsonString)
+
+def _legacyDeleteStaleLogObjects(theLogEntryList, theDelLogEntryIdxList):
+    """
+    The original __deleteStaleLogObjects (one list deletion per index),
+    only used by benchmark as baseline.
+    """
+    theDelLogEntryIdxList.sort()
+    for i in xrange(len(theDelLogEntryIdxList)):
+        del theLogEntryList[theDelLogEntryIdxList[i] - i]
+
+def benchmark(theFile, theLogger=Logger(), theNumRuns=3):
+    """
+    Prints the extraction throughput (MB/s) for theFile with the line
+    loop of the original extractLogEntries, the line based reassembler
+    and the mmap scanner, the post-processing and
+    filter times and the stale object deletion time of the original and
+    the current implementation for growing prefixes of the log entries.
+    """
+    size = os.path.getsize(theFile) / (1024.0 * 1024.0)
+    for name, iterFunc in [('legacy', lambda a, f: _legacyExtract(a, f, 1)),
+                           ('lines', lambda a, f: a.iterLogEntries(f, 1, False)),
+                           ('mmap', lambda a, f: a.iterLogEntries(f, 1, True))]:
+        bestTime = None
+        for i in xrange(theNumRuns):
+            logAnalyzer = TaintLogAnalyzer(theLogger=theLogger)
+            logFile = open(theFile, 'r')
+            try:
+                startTime = time.time()
+                numEntries = 0
+                for logEntry in iterFunc(logAnalyzer, logFile):
+                    numEntries += 1
+                runTime = time.time() - startTime
+            finally:
+                logFile.close()
+            if bestTime is None or runTime < bestTime:
+                bestTime = runTime
+        theLogger.write('%-6s %8.1f MB/s (%.1f MB, %d entries, %.3fs)' % (name, size / max(bestTime, 1e-9), size, numEntries, bestTime))
+
+    # Post-processing and filtering (drops all call actions)
+    logAnalyzer = TaintLogAnalyzer(theLogger=theLogger)
+    logAnalyzer.setLogFile(theFile)
+    logAnalyzer.extractLogEntries()
+    numEntries = logAnalyzer.getNumLogEntries()
+    logEntryList = list(logAnalyzer.getLogEntryList())
+    startTime = time.time()
+    logAnalyzer.postProcessLogObjects()
+    postProcessTime = time.time() - startTime
+    startTime = time.time()
+    logAnalyzer.filterLogObjects([CallActionLogPattern()])
+    filterTime = time.time() - startTime
+    theLogger.write('postProcessLogObjects: %.3fs, filterLogObjects: %.3fs (%d entries)' % (postProcessTime, filterTime, numEntries))
+
+    # Stale object deletion (the merged fragments as in postProcessLogObjects)
+    for size in [numEntries / 4, numEntries / 2, numEntries]:
+        delLogEntryIdxList = [logEntryIndex for logEntryIndex, logEntry in enumerate(logEntryList[:size])
+                              if isinstance(logEntry, CipherUsageLogEntry) or
+                              (isinstance(logEntry, (FileSystemLogEntry, NetworkSendLogEntry)) and logEntry.taintLogId != 0)]
+        legacyLogEntryList = logEntryList[:size]
+        startTime = time.time()
+        _legacyDeleteStaleLogObjects(legacyLogEntryList, list(delLogEntryIdxList))
+        legacyTime = time.time() - startTime
+        logAnalyzer = TaintLogAnalyzer(theLogger=theLogger)
+        logAnalyzer.logEntryList = logEntryList[:size]
+        startTime = time.time()
+        logAnalyzer._TaintLogAnalyzer__deleteStaleLogObjects(list(delLogEntryIdxList)) # private, timed directly
+        deleteTime = time.time() - startTime
+        theLogger.write('deleteStaleLogObjects: legacy %.3fs, current %.3fs (%d entries, %d deleted)' % (legacyTime, deleteTime, size, len(delLogEntryIdxList)))
+
+
 # ================================================================================
 # Main method
 # ================================================================================
@@ -387,16 +1472,34 @@ def main():
     parser = OptionParser(usage='usage: %prog [options] logcatFile', version='%prog 0.1')    
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=True)
     parser.add_option('-q', '--quiet', action='store_false', dest='verbose')
+    parser.add_option('-b', '--benchmark', action='store_true', default=False,
+                      help='Compare the extraction throughput of the original line loop, the line and the mmap scanner')
+    parser.add_option('-n', '--numEntries', metavar='<int>', type='int', default=0,
+                      help='Benchmark a synthetic log with <int> entries instead of logcatFile')
+    parser.add_option('-p', '--processes', metavar='<int>', type='int', default=1,
+                      help='Number of processes parsing a large log file in chunks')
     (options, args) = parser.parse_args()
 
     # Run
-    if options.verbose:
+    if options.verbose and not options.benchmark:
         logger = Logger(LogLevel.DEBUG)
     else:
         logger = Logger()
+    if options.benchmark and options.numEntries > 0:
+        fd, logFile = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        try:
+            _generateLogFile(logFile, options.numEntries)
+            benchmark(logFile, logger)
+        finally:
+            os.remove(logFile)
+        return
+    if options.benchmark:
+        benchmark(args[0], logger)
+        return
     logAnalyzer = TaintLogAnalyzer(theLogger=logger)
     logAnalyzer.setLogFile(args[0])
-    logAnalyzer.extractLogEntries()
+    logAnalyzer.extractLogEntries(options.processes)
     logAnalyzer.postProcessLogObjects()
     logAnalyzer.printOverview()
 
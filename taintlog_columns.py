@@ -0,0 +1,237 @@
+################################################################################
+#
+# Copyright (c) 2011-2012, Daniel Baeumges (dbaeumges@googlemail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+from common import TaintTagEnum
+
+from itertools import izip
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# ================================================================================
+# Log Entry Columns
+# ================================================================================
+class LogEntryColumns:
+    """
+    Columnar store of the decoded log entries of many apps. Each entry is
+    one row of the columns below (array module arrays). Entry classes,
+    actions, destinations, timestamps and apps are interned, their columns
+    hold the ids. Counts and histograms run vectorized on NumPy views of
+    the columns if NumPy is available and as plain loops otherwise.
+    """
+    # Column name -> array typecode (also the NumPy dtype of the view)
+    COLUMN_TYPES = [('typeCode', 'B'),
+                    ('action', 'i'),
+                    ('tag', 'I'),
+                    ('destinationTag', 'I'),
+                    ('destination', 'i'),
+                    ('port', 'i'),
+                    ('timestamp', 'i'),
+                    ('app', 'i')]
+    TAG_BITS = 32
+
+    def __init__(self):
+        self.columnDict = {}
+        for name, typeCode in self.COLUMN_TYPES:
+            self.columnDict[name] = array.array(typeCode)
+
+        # Interned values (id = index in the list)
+        self.typeList = []
+        self.typeDict = {}
+        self.actionList = []
+        self.actionDict = {}
+        self.destinationList = []
+        self.destinationDict = {}
+        self.timestampList = []
+        self.timestampDict = {}
+        self.appList = []
+        self.appDict = {}
+
+    def getNumEntries(self):
+        return len(self.columnDict['typeCode'])
+
+    def getAppList(self):
+        return self.appList
+
+    def getColumn(self, theName):
+        """
+        Returns the column theName as NumPy array (a view of the stored
+        column) or as array module array if NumPy is missing.
+        """
+        column = self.columnDict[theName]
+        if numpy is None:
+            return column
+        if len(column) == 0:
+            return numpy.zeros(0, dtype=column.typecode)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def addLogEntries(self, theLogEntryList, theApp=None):
+        """
+        Appends the entries of theLogEntryList for theApp (any hashable key,
+        e.g. an index or md5 hash). Returns the app id.
+        """
+        appId = self.__intern(self.appDict, self.appList, theApp)
+        typeCodeColumn = self.columnDict['typeCode']
+        actionColumn = self.columnDict['action']
+        tagColumn = self.columnDict['tag']
+        destinationTagColumn = self.columnDict['destinationTag']
+        destinationColumn = self.columnDict['destination']
+        portColumn = self.columnDict['port']
+        timestampColumn = self.columnDict['timestamp']
+        appColumn = self.columnDict['app']
+        for logEntry in theLogEntryList:
+            typeCodeColumn.append(self.__intern(self.typeDict, self.typeList, logEntry.__class__))
+            actionColumn.append(self.__intern(self.actionDict, self.actionList, getattr(logEntry, 'action', None)))
+            tagColumn.append(getattr(logEntry, 'tag', TaintTagEnum.TAINT_CLEAR))
+            destinationTagColumn.append(getattr(logEntry, 'destinationTag', TaintTagEnum.TAINT_CLEAR))
+            destinationColumn.append(self.__intern(self.destinationDict, self.destinationList, getattr(logEntry, 'destination', None)))
+            portColumn.append(getattr(logEntry, 'port', 0))
+            timestampColumn.append(self.__intern(self.timestampDict, self.timestampList, getattr(logEntry, 'timestamp', None)))
+            appColumn.append(appId)
+        return appId
+
+    def getCountsPerApp(self, theEntryClass, theActionList=None, theTagMask=None, theTagColumn='tag'):
+        """
+        Returns the number of entries of theEntryClass per app id. Only
+        entries with one of the actions in theActionList are counted (all if
+        the list is None or empty, as for pattern action lists). theTagMask
+        restricts the count to entries with one of its tags set in
+        theTagColumn ('tag' or 'destinationTag'), TAINT_CLEAR to untainted
+        entries and None counts entries regardless of their tags.
+        """
+        numApps = len(self.appList)
+        select = self.__select(theEntryClass, theActionList, theTagMask, theTagColumn)
+        if select is None:
+            return [0] * numApps
+        if numpy is None:
+            countList = [0] * numApps
+            for selectFlag, appId in izip(select, self.columnDict['app']):
+                if selectFlag:
+                    countList[appId] += 1
+            return countList
+        appColumn = self.getColumn('app')[select]
+        if len(appColumn) == 0:
+            return [0] * numApps
+        return numpy.bincount(appColumn, minlength=numApps).tolist()
+
+    def getTagHistogram(self, theEntryClass=None, theTagColumn='tag'):
+        """
+        Returns a dict tag -> number of entries (of theEntryClass, all if
+        None) with the tag set in theTagColumn. Only tags set at least
+        once are listed.
+        """
+        select = self.__select(theEntryClass, None, None, theTagColumn)
+        histogramDict = {}
+        if select is None:
+            return histogramDict
+        if numpy is None:
+            for selectFlag, tag in izip(select, self.columnDict[theTagColumn]):
+                if selectFlag:
+                    while tag:
+                        bit = int(tag & -tag)
+                        histogramDict[bit] = histogramDict.get(bit, 0) + 1
+                        tag ^= bit
+            return histogramDict
+        tagColumn = self.getColumn(theTagColumn)[select]
+        for shift in xrange(self.TAG_BITS):
+            count = int(((tagColumn >> shift) & 1).sum())
+            if count > 0:
+                histogramDict[1 << shift] = count
+        return histogramDict
+
+    def getActionHistogram(self, theEntryClass=None):
+        """
+        Returns a dict action -> number of entries (of theEntryClass, all
+        if None) with the action.
+        """
+        select = self.__select(theEntryClass, None, None, 'tag')
+        histogramDict = {}
+        if select is None:
+            return histogramDict
+        if numpy is None:
+            for selectFlag, actionId in izip(select, self.columnDict['action']):
+                if selectFlag:
+                    action = self.actionList[actionId]
+                    histogramDict[action] = histogramDict.get(action, 0) + 1
+            return histogramDict
+        actionColumn = self.getColumn('action')[select]
+        if len(actionColumn) == 0:
+            return histogramDict
+        for actionId, count in enumerate(numpy.bincount(actionColumn).tolist()):
+            if count > 0:
+                histogramDict[self.actionList[actionId]] = count
+        return histogramDict
+
+    # ================================================================================
+    # Helpers
+    # ================================================================================
+    def __intern(self, theDict, theList, theValue):
+        valueId = theDict.get(theValue)
+        if valueId is None:
+            valueId = len(theList)
+            theDict[theValue] = valueId
+            theList.append(theValue)
+        return valueId
+
+    def __select(self, theEntryClass, theActionList, theTagMask, theTagColumn):
+        """
+        Returns the row selection (NumPy bool array or list of bools) for
+        the conditions of getCountsPerApp or None if no row can match.
+        """
+        typeCode = None
+        if not theEntryClass is None:
+            typeCode = self.typeDict.get(theEntryClass)
+            if typeCode is None:
+                return None
+        actionIdSet = None
+        if not theActionList is None and len(theActionList) > 0:
+            actionIdSet = set([self.actionDict[action] for action in theActionList if action in self.actionDict])
+            if len(actionIdSet) == 0:
+                return None
+
+        if numpy is None:
+            select = [True] * self.getNumEntries()
+            for row, (entryTypeCode, actionId, tag) in enumerate(izip(self.columnDict['typeCode'],
+                                                                      self.columnDict['action'],
+                                                                      self.columnDict[theTagColumn])):
+                if not typeCode is None and entryTypeCode != typeCode:
+                    select[row] = False
+                elif not actionIdSet is None and not actionId in actionIdSet:
+                    select[row] = False
+                elif theTagMask == TaintTagEnum.TAINT_CLEAR and tag != 0:
+                    select[row] = False
+                elif theTagMask and not tag & theTagMask:
+                    select[row] = False
+            return select
+
+        select = numpy.ones(self.getNumEntries(), dtype=bool)
+        if not typeCode is None:
+            select &= (self.getColumn('typeCode') == typeCode)
+        if not actionIdSet is None:
+            select &= numpy.in1d(self.getColumn('action'), list(actionIdSet))
+        if not theTagMask is None:
+            tagColumn = self.getColumn(theTagColumn)
+            if theTagMask == TaintTagEnum.TAINT_CLEAR:
+                select &= (tagColumn == 0)
+            else:
+                select &= ((tagColumn & numpy.array(theTagMask, dtype=tagColumn.dtype)) != 0)
+        return select
@@ -18,6 +18,9 @@
 
 from common import TaintLogActionEnum, TaintTagEnum
 import json
+import re
+import threading
+import weakref
 
 
 # ================================================================================
@@ -89,16 +92,140 @@ class MainReportEntry(BaseReportEntry):
     appList = []
 
 
+# ================================================================================
+# Stack Trace Table
+# ================================================================================
+class InternedStackTrace(object):
+    """
+    Distinct stack trace of the log entries: the string, its frames and the
+    cached substring searches. Log entries refer to it instead of keeping
+    their own copies, it is freed with the last entry referring to it.
+    """
+    __slots__ = ('stackTraceStr', 'frameTuple', 'matchDict', '__weakref__')
+
+    # Cached substring searches per stack trace (cleared when reached)
+    MAX_MATCHES = 64
+
+    def __init__(self, theStackTraceStr, theFrameTuple):
+        self.stackTraceStr = theStackTraceStr
+        self.frameTuple = theFrameTuple
+        self.matchDict = None # substring -> found flag
+
+    def contains(self, theSubstring):
+        """
+        Returns if theSubstring is part of the stack trace.
+        """
+        if self.matchDict is None:
+            self.matchDict = {}
+        foundFlag = self.matchDict.get(theSubstring)
+        if foundFlag is None:
+            if len(self.matchDict) >= self.MAX_MATCHES:
+                self.matchDict.clear()
+            foundFlag = (self.stackTraceStr.find(theSubstring) != -1)
+            self.matchDict[theSubstring] = foundFlag
+        return foundFlag
+
+class StackTraceTable:
+    """
+    Interns the stack traces of the log entries (shared by all apps). Each
+    distinct stackTraceStr is kept once as InternedStackTrace, its frames
+    are split once and shared between the traces. The table only holds
+    weak references, so a trace is dropped with the last log entry
+    referring to it. Frames of dropped traces are swept once the frame
+    dict doubled since the last sweep.
+    """
+    FRAME_SEPARATOR = '||'
+    MIN_SWEEP_FRAMES = 4096
+
+    def __init__(self):
+        self.stackTraceDict = weakref.WeakValueDictionary() # stackTraceStr -> InternedStackTrace
+        self.frameDict = {} # frame -> shared frame string
+        self.sweepFrames = self.MIN_SWEEP_FRAMES # frame dict size of the next sweep
+        self.lock = threading.Lock()
+
+    def intern(self, theStackTraceStr):
+        """
+        Returns the InternedStackTrace of theStackTraceStr.
+        """
+        if theStackTraceStr is None:
+            theStackTraceStr = ''
+        stackTrace = self.stackTraceDict.get(theStackTraceStr)
+        if stackTrace is None:
+            self.lock.acquire()
+            try:
+                stackTrace = self.stackTraceDict.get(theStackTraceStr)
+                if stackTrace is None:
+                    if len(self.frameDict) >= self.sweepFrames:
+                        self.__sweepFrames()
+                    frameList = theStackTraceStr.split(self.FRAME_SEPARATOR)
+                    frameList = frameList[:len(frameList)-1] # last frame ends with the separator
+                    stackTrace = InternedStackTrace(theStackTraceStr,
+                                                    tuple([self.frameDict.setdefault(frame, frame) for frame in frameList]))
+                    self.stackTraceDict[theStackTraceStr] = stackTrace
+            finally:
+                self.lock.release()
+        return stackTrace
+
+    def getNumStackTraces(self):
+        return len(self.stackTraceDict)
+
+    def getNumFrames(self):
+        return len(self.frameDict)
+
+    def __sweepFrames(self):
+        """
+        Keeps only the frames of the stack traces still referred to.
+        """
+        frameDict = {}
+        for stackTrace in self.stackTraceDict.values():
+            for frame in stackTrace.frameTuple:
+                frameDict[frame] = frame
+        self.frameDict = frameDict
+        self.sweepFrames = max(self.MIN_SWEEP_FRAMES, 2 * len(frameDict))
+
+STACK_TRACE_TABLE = StackTraceTable()
+
+
 # ================================================================================
 # Json Log Objects (comming from TaintDroid)
 # ================================================================================
-class BaseLogEntry(JsonBase):
+def _getSlots(theFieldList):
+    """
+    Returns the slot names of a field layout (stackTraceStr is stored as
+    InternedStackTrace of STACK_TRACE_TABLE in stackTraceRef).
+    """
+    slotList = []
+    for name, default in theFieldList:
+        if name == 'stackTraceStr':
+            name = 'stackTraceRef'
+        slotList.append(name)
+    return tuple(slotList)
+
+class BaseLogEntry(object):
+    """
+    Log entries use slots with a fixed field layout (_fields lists the field
+    names with their default values). Pattern-only fields are kept by the
+    pattern classes below. Stack traces are interned in STACK_TRACE_TABLE,
+    stackTraceStr and stackTrace (list of frames) are looked up there.
+    """
+    _json = True
+    _fields = ()
+    _derivedFields = ('stackTrace',) # encoded, but not stored
+    __slots__ = ()
+
+    def __init__(self, **keys):
+        for name, default in self._fields:
+            setattr(self, name, keys.pop(name, default))
+        for name, value in keys.iteritems():
+            setattr(self, name, value)
+
     def doesActionMatch(self, theOther):
         #if theOther.action != 0 and theOther.action != self.action:
         #    return False
-        if theOther.__dict__.has_key('actionList') and len(theOther.actionList) > 0:
+        actionList = getattr(theOther, 'actionList', [])
+        if len(actionList) > 0:
             match = False
-            for action in theOther.actionList:
+            for action in actionList:
                 if self.action == action:
                     match = True
                     break
@@ -109,20 +236,32 @@ class BaseLogEntry(JsonBase):
         else:
             return True
             
+    def __getStackTraceStr(self):
+        return self.stackTraceRef.stackTraceStr
+
+    def __setStackTraceStr(self, theStackTraceStr):
+        self.stackTraceRef = STACK_TRACE_TABLE.intern(theStackTraceStr)
+
+    stackTraceStr = property(__getStackTraceStr, __setStackTraceStr)
+
+    def __getStackTrace(self):
+        return list(self.stackTraceRef.frameTuple)
+
+    stackTrace = property(__getStackTrace)
+
     def doesStackTraceMatch(self, theOther):
         if theOther.stackTraceStr == '' or theOther.stackTraceStr is None:
             return True
-        if self.stackTraceStr.find(theOther.stackTraceStr) != -1:
-            return True
-        return False
+        return self.stackTraceRef.contains(theOther.stackTraceStr)
 
     def doesTagMatch(self, theOther):
-        if theOther.tag == -1 and int(self.tag, 16) != 0:
+        if theOther.tag == -1 and self.tag != 0:
             return False
-        if theOther.__dict__.has_key('tagList') and len(theOther.tagList) > 0:
+        tagList = getattr(theOther, 'tagList', [])
+        if len(tagList) > 0:
             match = False
-            for tag in theOther.tagList:
-                if int(self.tag, 16) & tag:
+            for tag in tagList:
+                if self.tag & tag:
                     match = True
             if not match:
                 return False
@@ -134,19 +273,19 @@ class BaseLogEntry(JsonBase):
 class ErrorLogEntry(BaseLogEntry):
     """
     """
-    message = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('message', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
 class CallActionLogEntry(BaseLogEntry):
     """
     """
-    tag = TaintTagEnum.TAINT_CLEAR
-    dialString = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('tag', TaintTagEnum.TAINT_CLEAR),
+               ('dialString', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, CallActionLogEntry):
@@ -173,15 +312,15 @@ class CallActionLogEntry(BaseLogEntry):
 class CipherUsageLogEntry(BaseLogEntry):
     """
     """
-    action = '' # CipherActionEnum
-    id = 0    
-    mode = 0 # CipherModeEnum
-    tag = TaintTagEnum.TAINT_CLEAR
-    input = ''
-    output = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('action', ''), # CipherActionEnum
+               ('id', 0),
+               ('mode', 0), # CipherModeEnum
+               ('tag', TaintTagEnum.TAINT_CLEAR),
+               ('input', ''),
+               ('output', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, CipherUsageLogEntry):
@@ -212,15 +351,15 @@ class CipherUsageLogEntry(BaseLogEntry):
 class FileSystemLogEntry(BaseLogEntry):
     """
     """
-    action = 0 # TaintLogActionEnum.FS_*
-    tag = TaintTagEnum.TAINT_CLEAR
-    fileDescriptor = 0
-    filePath = '' # filled by postProcess
-    taintLogId = 0
-    data = ''
-    stackTraceStr = ''    
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('action', 0), # TaintLogActionEnum.FS_*
+               ('tag', TaintTagEnum.TAINT_CLEAR),
+               ('fileDescriptor', 0),
+               ('filePath', ''), # filled by postProcess
+               ('taintLogId', 0),
+               ('data', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, FileSystemLogEntry):
@@ -251,15 +390,15 @@ class FileSystemLogEntry(BaseLogEntry):
 class NetworkSendLogEntry(BaseLogEntry):
     """
     """
-    action = 0 # TaintLogActionEnum.NET_*
-    tag = TaintTagEnum.TAINT_CLEAR
-    destination = ''
-    port = 0
-    taintLogId = 0
-    data = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('action', 0), # TaintLogActionEnum.NET_*
+               ('tag', TaintTagEnum.TAINT_CLEAR),
+               ('destination', ''),
+               ('port', 0),
+               ('taintLogId', 0),
+               ('data', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, NetworkSendLogEntry):
@@ -292,14 +431,14 @@ class NetworkSendLogEntry(BaseLogEntry):
 class SSLLogEntry(BaseLogEntry):
     """
     """
-    action = 0 # TaintLogActionEnum.SSL_*
-    tag = TaintTagEnum.TAINT_CLEAR
-    destination = ''
-    port = 0
-    data = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('action', 0), # TaintLogActionEnum.SSL_*
+               ('tag', TaintTagEnum.TAINT_CLEAR),
+               ('destination', ''),
+               ('port', 0),
+               ('data', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, SSLLogEntry):
@@ -329,15 +468,15 @@ class SSLLogEntry(BaseLogEntry):
 class SendSmsLogEntry(BaseLogEntry):
     """
     """
-    action = 0 # TaintLogActionEnum.SMS_*
-    tag = TaintTagEnum.TAINT_CLEAR
-    destination = ''
-    destinationTag = TaintTagEnum.TAINT_CLEAR
-    scAddress = ''
-    text = ''
-    stackTraceStr = ''
-    stackTrace = [] # filled by postProcess
-    timestamp = ''
+    _fields = (('action', 0), # TaintLogActionEnum.SMS_*
+               ('tag', TaintTagEnum.TAINT_CLEAR),
+               ('destination', ''),
+               ('destinationTag', TaintTagEnum.TAINT_CLEAR),
+               ('scAddress', ''),
+               ('text', ''),
+               ('stackTraceStr', ''),
+               ('timestamp', ''))
+    __slots__ = _getSlots(_fields)
 
     def doesMatch(self, theOther):
         if not isinstance(theOther, SendSmsLogEntry):
@@ -348,12 +487,13 @@ class SendSmsLogEntry(BaseLogEntry):
             return False
         if theOther.destination != '' and theOther.destination != self.destination:
             return False
-        if theOther.destinationTag == -1 and int(self.destinationTag, 16) != 0:
+        if theOther.destinationTag == -1 and self.destinationTag != 0:
             return False
-        if theOther.__dict__.has_key('destinationTagList') and len(theOther.destinationTagList) > 0:
+        destinationTagList = getattr(theOther, 'destinationTagList', [])
+        if len(destinationTagList) > 0:
             match = False
-            for tag in theOther.destinationTagList:
-                if int(self.destinationTag, 16) & tag:
+            for tag in destinationTagList:
+                if self.destinationTag & tag:
                     match = True
             if not match:
                 return False        
@@ -375,7 +515,48 @@ class SendSmsLogEntry(BaseLogEntry):
         if theDetailsFlag: columnList.append(self.stackTraceStr)
         return columnList
 
+
+# ================================================================================
+# Json Log Patterns (passed to doesMatch/LogEntryMatcher)
+# ================================================================================
+class BaseLogPattern(BaseLogEntry):
+    """
+    Patterns are log entries with additional pattern-only lists (an entry
+    matches if its action is in actionList and it has one of the tags in
+    tagList). Fields not set keep the wildcard default of the entry class.
+    """
+    _patternFields = ('actionList', 'tagList')
+    __slots__ = ()
+
+    def __init__(self, **keys):
+        for name in self._patternFields:
+            setattr(self, name, list(keys.pop(name, [])))
+        BaseLogEntry.__init__(self, **keys)
+
+class CallActionLogPattern(BaseLogPattern, CallActionLogEntry):
+    pass
+
+class CipherUsageLogPattern(BaseLogPattern, CipherUsageLogEntry):
+    pass
+
+class FileSystemLogPattern(BaseLogPattern, FileSystemLogEntry):
+    pass
+
+class NetworkSendLogPattern(BaseLogPattern, NetworkSendLogEntry):
+    pass
+
+class SSLLogPattern(BaseLogPattern, SSLLogEntry):
+    pass
+
+class SendSmsLogPattern(BaseLogPattern, SendSmsLogEntry):
+    _patternFields = ('actionList', 'tagList', 'destinationTagList')
+
+
+# ================================================================================
+# Simulator Actions
+# ================================================================================
 class SimulatorActionLogEntry(BaseLogEntry):
+    _derivedFields = ()
     timestamp = ''
     
     @staticmethod
@@ -431,18 +612,30 @@ looker = {'__CallActionLogEntry__':CallActionLogEntry,
               }
  
  
+# Taint tags are ints in memory and hex strings (as logged by TaintDroid) in JSON
+TAINT_TAG_KEYS = ('tag', 'destinationTag')
+
 class _JSONEncoder(json.JSONEncoder):
     
     def default(self, theObject):
         if hasattr(theObject, '_json'):
             res = {}
             if theObject._json == True:
-                for key in theObject.__dict__:
+                # Slots of log entries and __dict__ of patterns/report objects
+                for key, default in getattr(theObject, '_fields', ()):
+                    res[key] = getattr(theObject, key)
+                for key in getattr(theObject, '_derivedFields', ()):
+                    res[key] = getattr(theObject, key)
+                objectDict = getattr(theObject, '__dict__', {})
+                for key in objectDict:
                     if not key.startswith('_'):
-                        res[key] = theObject.__dict__[key]
+                        res[key] = objectDict[key]
             else:
                 for key in theObject._json:
-                    res[key] = theObject.__dict__[key]
+                    res[key] = getattr(theObject, key)
+            for key in TAINT_TAG_KEYS:
+                if key in res and isinstance(res[key], (int, long)) and res[key] >= 0:
+                    res[key] = '0x%X' % res[key]
             res['__' + theObject.__class__.__name__ + '__'] = True
             return res
         return json.JSONEncoder.default(self, theObject)
@@ -457,7 +650,11 @@ def _JSONDecoder(theDict):
         
     if objtype == None: return theDict
     
-    obj = looker[objtype]()
+    objClass = looker[objtype]
+    if isinstance(objClass, type):
+        obj = objClass.__new__(objClass) # fields are set below
+    else:
+        obj = objClass()
     '''
     objstr = objtype[2:-2]
     klass = type(str(objstr),(object,),{})
@@ -503,7 +700,15 @@ def _JSONDecoder(theDict):
         print "unknow type "+type
         return theDict
 
-    obj.__dict__.update(theDict)
+    if hasattr(obj, '__dict__'):
+        obj.__dict__.update(theDict)
+    else:
+        # Slotted log entry: keys outside of its field layout are dropped
+        for key, default in obj._fields:
+            setattr(obj, key, theDict.get(key, default))
+    for key in TAINT_TAG_KEYS:
+        if key in theDict:
+            setattr(obj, key, TaintTagEnum.parseTaintTag(theDict[key]))
 
     return obj
 
@@ -521,3 +726,189 @@ class JsonFactory:
     def json2Py(self, theString):
         return json.loads(theString, object_hook=_JSONDecoder)
     
+
+
+# ================================================================================
+# Json Report Reader
+# ================================================================================
+class JsonReportReader:
+    """
+    Incremental reader of a report.json file (encoded MainReportEntry).
+    The file is read in blocks and the AppReportEntry objects of the
+    appList are yielded one at a time. If theFieldList is given, only
+    these fields of the app reports are decoded, the values of the other
+    ones (e.g. actionList) are skipped without being decoded.
+    """
+    BLOCK_SIZE = 1024 * 1024
+
+    # Next non-whitespace char; run of chars and complete strings up to the
+    # next bracket (a string cut off by the end of the buffer stops the run)
+    NON_WHITESPACE_REGEX = re.compile(r'\S')
+    VALUE_SKIP_REGEX = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+    NUMBER_CHARS = '+-.0123456789Ee'
+
+    def __init__(self, theFile, theFieldList=None):
+        self.fileName = theFile
+        self.fieldList = None
+        if not theFieldList is None:
+            self.fieldList = set(theFieldList)
+        self.decoder = json.JSONDecoder(object_hook=_JSONDecoder)
+
+        self.file = None
+        self.buffer = ''
+        self.pos = 0
+        self.eofFlag = False
+        self.mainDict = {}
+
+    def getMainReport(self):
+        """
+        Reads the whole file and returns the MainReportEntry, its appList
+        holds the app reports restricted to the field list.
+        """
+        appList = list(self.iterAppReports())
+        mainDict = dict(self.mainDict)
+        mainDict['appList'] = appList
+        return _JSONDecoder(mainDict)
+
+    def iterAppReports(self):
+        """
+        Generator yielding the AppReportEntry objects of the appList. The
+        other fields of the main report are available in mainDict once the
+        generator is exhausted.
+        """
+        self.file = open(self.fileName, 'r')
+        self.buffer = ''
+        self.pos = 0
+        self.eofFlag = False
+        self.mainDict = {}
+        try:
+            for key in self.__iterObjectKeys():
+                if key == 'appList':
+                    for i in self.__iterArrayItems():
+                        yield self.__readAppReport()
+                else:
+                    self.mainDict[key] = self.__decodeValue()
+        finally:
+            self.file.close()
+            self.buffer = ''
+
+    # ================================================================================
+    # Helpers
+    # ================================================================================
+    def __readAppReport(self):
+        appDict = {}
+        for key in self.__iterObjectKeys():
+            if self.fieldList is None or key in self.fieldList or key.startswith('__'):
+                appDict[key] = self.__decodeValue()
+            else:
+                self.__skipValue()
+        return _JSONDecoder(appDict)
+
+    def __iterObjectKeys(self):
+        """
+        Generator yielding the keys of the object at the current position,
+        the caller has to consume the value before the next key is read.
+        """
+        self.__expect('{')
+        if self.__peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.__decodeValue()
+            self.__expect(':')
+            yield key
+            if self.__expect(',}') == '}':
+                return
+
+    def __iterArrayItems(self):
+        """
+        Generator yielding the index of each item of the array at the
+        current position, the caller has to consume the item.
+        """
+        self.__expect('[')
+        if self.__peek() == ']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self.__expect(',]') == ']':
+                return
+
+    def __fill(self, theSize=None):
+        """
+        Drops the consumed part of the buffer and appends the next block.
+        Returns False at the end of the file.
+        """
+        if theSize is None:
+            theSize = self.BLOCK_SIZE
+        block = self.file.read(theSize)
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        if not block:
+            self.eofFlag = True
+            return False
+        return True
+
+    def __peek(self):
+        """
+        Moves to the next non-whitespace char and returns it ('' at the end
+        of the file).
+        """
+        while True:
+            match = self.NON_WHITESPACE_REGEX.search(self.buffer, self.pos)
+            if not match is None:
+                self.pos = match.start()
+                return match.group()
+            self.pos = len(self.buffer)
+            if not self.__fill():
+                return ''
+
+    def __expect(self, theChars):
+        char = self.__peek()
+        if char == '' or not char in theChars:
+            raise ValueError('Invalid report \'%s\': expected one of \'%s\' at \'%s\'' % (self.fileName, theChars, self.buffer[self.pos:self.pos+32]))
+        self.pos += 1
+        return char
+
+    def __decodeValue(self):
+        """
+        Decodes the value at the current position, the buffer is extended
+        until the value is complete.
+        """
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut off by the end of the buffer goes on in the next block
+                if self.eofFlag or (end < len(self.buffer) and not self.buffer[end] in self.NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eofFlag:
+                    raise
+            self.__fill(max(self.BLOCK_SIZE, len(self.buffer) - self.pos))
+
+    def __skipValue(self):
+        """
+        Moves behind the value at the current position without decoding it.
+        """
+        if not self.__peek() in '[{':
+            self.__decodeValue()
+            return
+        depth = 0
+        while True:
+            end = self.VALUE_SKIP_REGEX.match(self.buffer, self.pos).end()
+            if end == len(self.buffer) or self.buffer[end] == '"':
+                self.pos = end
+                if not self.__fill(max(self.BLOCK_SIZE, len(self.buffer) - self.pos)):
+                    raise ValueError('Invalid report \'%s\': unexpected end of file' % self.fileName)
+                continue
+            self.pos = end + 1
+            if self.buffer[end] in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
@@ -0,0 +1,266 @@
+################################################################################
+#
+# Copyright (c) 2011-2012, Daniel Baeumges (dbaeumges@googlemail.com)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+from adb_client import AdbClient, AdbClientError
+from common import Logger, LogLevel
+from emulator_client import EmulatorClient
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+
+# ================================================================================
+# Fake ADB Server
+# ================================================================================
+class FakeAdbServer:
+    """
+    Minimal adb server for tests: host:transport for the serials in
+    deviceList, shell: (output from shellDict, '' otherwise) and sync:
+    RECV/SEND on the files in fileDict (remote path -> content).
+    """
+    def __init__(self, theDeviceList=['emulator-5554']):
+        self.deviceList = list(theDeviceList)
+        self.shellDict = {} # command -> output
+        self.shellCmdList = [] # commands run
+        self.fileDict = {} # remote path -> content
+        self.modeDict = {} # remote path -> mode of the push
+        self.numConnections = 0
+        self.dropSyncFlag = False # close sync sessions after one transfer
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.host, self.port = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.__serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.sock.close()
+
+    def __serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.numConnections += 1
+            thread = threading.Thread(target=self.__handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def __handle(self, theConn):
+        try:
+            request = self.__recvRequest(theConn)
+            if not request.startswith('host:transport:'):
+                self.__sendFail(theConn, 'unknown request %s' % request)
+                return
+            if not request[len('host:transport:'):] in self.deviceList:
+                self.__sendFail(theConn, 'device not found')
+                return
+            theConn.sendall('OKAY')
+            request = self.__recvRequest(theConn)
+            if request.startswith('shell:'):
+                theConn.sendall('OKAY')
+                cmd = request[len('shell:'):]
+                self.shellCmdList.append(cmd)
+                theConn.sendall(self.shellDict.get(cmd, ''))
+            elif request == 'sync:':
+                theConn.sendall('OKAY')
+                self.__handleSync(theConn)
+            else:
+                self.__sendFail(theConn, 'unknown service %s' % request)
+        except (socket.error, struct.error):
+            pass
+        finally:
+            theConn.close()
+
+    def __handleSync(self, theConn):
+        while True:
+            msgId, length = struct.unpack('<4sI', self.__recvExact(theConn, 8))
+            if msgId == 'QUIT':
+                return
+            path = self.__recvExact(theConn, length)
+            if msgId == 'RECV':
+                if not path in self.fileDict:
+                    message = 'No such file or directory'
+                    theConn.sendall(struct.pack('<4sI', 'FAIL', len(message)) + message)
+                else:
+                    content = self.fileDict[path]
+                    for i in xrange(0, len(content), AdbClient.SYNC_DATA_MAX):
+                        chunk = content[i:i+AdbClient.SYNC_DATA_MAX]
+                        theConn.sendall(struct.pack('<4sI', 'DATA', len(chunk)) + chunk)
+                    theConn.sendall(struct.pack('<4sI', 'DONE', 0))
+            elif msgId == 'SEND':
+                path, mode = path.rsplit(',', 1)
+                chunkList = []
+                while True:
+                    msgId, length = struct.unpack('<4sI', self.__recvExact(theConn, 8))
+                    if msgId == 'DONE':
+                        break
+                    chunkList.append(self.__recvExact(theConn, length))
+                self.fileDict[path] = ''.join(chunkList)
+                self.modeDict[path] = int(mode)
+                theConn.sendall(struct.pack('<4sI', 'OKAY', 0))
+            if self.dropSyncFlag:
+                return
+
+    def __recvRequest(self, theConn):
+        return self.__recvExact(theConn, int(self.__recvExact(theConn, 4), 16))
+
+    def __sendFail(self, theConn, theMessage):
+        theConn.sendall('FAIL%04x%s' % (len(theMessage), theMessage))
+
+    def __recvExact(self, theConn, theLength):
+        data = ''
+        while len(data) < theLength:
+            chunk = theConn.recv(theLength - len(data))
+            if not chunk:
+                raise socket.error('connection closed')
+            data += chunk
+        return data
+
+
+# ================================================================================
+# Tests
+# ================================================================================
+class AdbClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.client = AdbClient('emulator-5554', theHost=self.server.host, thePort=self.server.port,
+                                theTimeout=5, theLogger=Logger(theLevel=LogLevel.ERROR))
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        shutil.rmtree(self.tmpDir, True)
+
+    def testShell(self):
+        self.server.shellDict['getprop ro.build.version.sdk'] = '10\r\n'
+        self.assertEqual(self.client.shell('getprop ro.build.version.sdk'), '10\r\n')
+        self.assertEqual(self.server.shellCmdList, ['getprop ro.build.version.sdk'])
+
+    def testPull(self):
+        content = ''.join([chr(i % 256) for i in xrange(3 * AdbClient.SYNC_DATA_MAX + 17)])
+        self.server.fileDict['/sdcard/logcat.log'] = content
+        localFile = os.path.join(self.tmpDir, 'logcat.log')
+        self.client.pull('/sdcard/logcat.log', localFile)
+        self.assertEqual(open(localFile, 'rb').read(), content)
+
+    def testPullMissingFile(self):
+        localFile = os.path.join(self.tmpDir, 'missing.log')
+        try:
+            self.client.pull('/sdcard/missing.log', localFile)
+            self.fail('AdbClientError expected')
+        except AdbClientError as adbErr:
+            self.assertEqual(adbErr.getCode(), AdbClientError.COMMAND_FAILED)
+
+    def testPush(self):
+        content = 'x' * (AdbClient.SYNC_DATA_MAX + 1)
+        localFile = os.path.join(self.tmpDir, 'app.apk')
+        open(localFile, 'wb').write(content)
+        self.client.push(localFile, '/data/local/tmp/app.apk')
+        self.assertEqual(self.server.fileDict['/data/local/tmp/app.apk'], content)
+        self.assertEqual(self.server.modeDict['/data/local/tmp/app.apk'] & 0777, 0644)
+
+    def testSyncSessionIsKept(self):
+        self.server.fileDict['/a'] = 'a'
+        self.server.fileDict['/b'] = 'b'
+        self.client.pull('/a', os.path.join(self.tmpDir, 'a'))
+        self.client.pull('/b', os.path.join(self.tmpDir, 'b'))
+        self.assertEqual(self.server.numConnections, 1)
+
+    def testSyncSessionIsReopened(self):
+        self.server.dropSyncFlag = True
+        self.server.fileDict['/a'] = 'a'
+        self.client.pull('/a', os.path.join(self.tmpDir, 'a'))
+        self.client.pull('/a', os.path.join(self.tmpDir, 'b'))
+        self.assertEqual(open(os.path.join(self.tmpDir, 'b'), 'rb').read(), 'a')
+        self.assertEqual(self.server.numConnections, 2)
+
+    def testInstall(self):
+        localFile = os.path.join(self.tmpDir, 'app.apk')
+        open(localFile, 'wb').write('apk')
+        self.server.shellDict['pm install /data/local/tmp/app.apk'] = 'Success\r\n'
+        self.assertEqual(self.client.install(localFile), 'Success\r\n')
+        self.assertEqual(self.server.fileDict['/data/local/tmp/app.apk'], 'apk')
+        self.assertEqual(self.server.shellCmdList, ['pm install /data/local/tmp/app.apk', 'rm /data/local/tmp/app.apk'])
+
+    def testTransportError(self):
+        client = AdbClient('emulator-5556', theHost=self.server.host, thePort=self.server.port,
+                           theTimeout=5, theLogger=Logger(theLevel=LogLevel.ERROR))
+        try:
+            client.shell('ls')
+            self.fail('AdbClientError expected')
+        except AdbClientError as adbErr:
+            self.assertEqual(adbErr.getCode(), AdbClientError.COMMAND_FAILED)
+
+    def testConnectionError(self):
+        self.server.close()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = AdbClient('emulator-5554', theHost='127.0.0.1', thePort=port,
+                           theTimeout=5, theLogger=Logger(theLevel=LogLevel.ERROR))
+        try:
+            client.shell('ls')
+            self.fail('AdbClientError expected')
+        except AdbClientError as adbErr:
+            self.assertEqual(adbErr.getCode(), AdbClientError.CONNECTION_ERROR)
+
+
+class EmulatorClientNativeAdbTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.emulator = EmulatorClient(thePort=5554, theNativeAdbFlag=True,
+                                       theAdbServerHost=self.server.host, theAdbServerPort=self.server.port,
+                                       theLogger=Logger(theLevel=LogLevel.ERROR))
+
+    def tearDown(self):
+        self.server.close()
+
+    def testShellUsesServer(self):
+        self.server.shellDict['setprop key value'] = ''
+        self.server.shellDict['getprop key'] = 'value\r\n'
+        self.emulator.setProperty('key', 'value')
+        self.assertEqual(self.emulator.runAdbCommand(['shell', 'getprop', 'key']), ('value\r\n', ''))
+        self.assertEqual(self.server.shellCmdList, ['setprop key value', 'getprop key'])
+
+    def testTransportErrorIsReturned(self):
+        self.server.deviceList = []
+        stdout, stderr = self.emulator.runAdbCommand(['shell', 'ls'])
+        self.assertEqual(stdout, '')
+        self.assertTrue(stderr.find('device not found') != -1)
+
+    def testLoggerOfReusedEmulator(self):
+        logger = Logger(theLevel=LogLevel.ERROR)
+        self.emulator.log = logger
+        self.emulator.runAdbCommand(['shell', 'ls'])
+        self.assertTrue(self.emulator.adbClient.log is logger)
+
+
+if __name__ == '__main__':
+    unittest.main()